@@ -0,0 +1,274 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from estimator import completion_estimator
+from schemas import ImageGenerationParams
+from settings import admission_settings
+
+
+QueueListener = Callable[[int], Awaitable[None]]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def retry_after(self, amount: float = 1) -> float:
+        self._refill()
+        if self.tokens >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float = 1) -> None:
+        self._refill()
+        self.tokens -= amount
+
+
+class _Ticket:
+    def __init__(self, cost: float, user_id: str, guild_id: str) -> None:
+        self.cost = cost
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.position = 0
+        self.granted = False
+        self.changed = asyncio.Event()
+
+
+class _FairState:
+    # start-time fair queuing on two levels, guilds share the budget first and the users of a guild share their guild's part
+    def __init__(self) -> None:
+        self.virtual_time = 0.0
+        self.guild_finish: Dict[str, float] = {}
+        self.guild_virtual_time: Dict[str, float] = {}
+        self.user_finish: Dict[str, float] = {}
+
+    def copy(self) -> "_FairState":
+        state = _FairState()
+        state.virtual_time = self.virtual_time
+        state.guild_finish = dict(self.guild_finish)
+        state.guild_virtual_time = dict(self.guild_virtual_time)
+        state.user_finish = dict(self.user_finish)
+        return state
+
+    def pick(
+        self, flows: Dict[str, Dict[str, Deque[_Ticket]]], heads: Dict[Tuple[str, str], int]
+    ) -> Optional[_Ticket]:
+        # the queued ticket with the smallest finish tag, heads skips tickets already picked in a simulation
+        best: Optional[Tuple[float, _Ticket]] = None
+        for guild_id, users in flows.items():
+            guild_virtual_time = self.guild_virtual_time.get(guild_id, 0.0)
+            user_best: Optional[Tuple[float, _Ticket]] = None
+            for user_id, tickets in users.items():
+                index = heads.get((guild_id, user_id), 0)
+                if index >= len(tickets):
+                    continue
+                ticket = tickets[index]
+                tag = max(self.user_finish.get(user_id, 0.0), guild_virtual_time) + ticket.cost
+                if user_best is None or tag < user_best[0]:
+                    user_best = (tag, ticket)
+            if user_best is None:
+                continue
+            ticket = user_best[1]
+            tag = max(self.guild_finish.get(guild_id, 0.0), self.virtual_time) + ticket.cost
+            if best is None or tag < best[0]:
+                best = (tag, ticket)
+        return best[1] if best is not None else None
+
+    def advance(self, ticket: _Ticket) -> None:
+        start = max(self.guild_finish.get(ticket.guild_id, 0.0), self.virtual_time)
+        self.guild_finish[ticket.guild_id] = start + ticket.cost
+        self.virtual_time = start
+        start = max(self.user_finish.get(ticket.user_id, 0.0), self.guild_virtual_time.get(ticket.guild_id, 0.0))
+        self.user_finish[ticket.user_id] = start + ticket.cost
+        self.guild_virtual_time[ticket.guild_id] = start
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        user_rate: float,
+        user_burst: float,
+        guild_rate: float,
+        guild_burst: float,
+        global_rate: float,
+        global_burst: float,
+        max_in_flight: int,
+        max_in_flight_cost: float,
+        max_queue: int,
+        max_buckets: int,
+    ) -> None:
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_cost = max_in_flight_cost
+        self.max_queue = max_queue
+        self.max_buckets = max_buckets
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._user_buckets: OrderedDict = OrderedDict()
+        self._guild_buckets: OrderedDict = OrderedDict()
+        # guild id -> user id -> tickets of that user in arrival order
+        self._flows: Dict[str, Dict[str, Deque[_Ticket]]] = {}
+        self._fair_state = _FairState()
+        self.queued = 0
+        self.in_flight = 0
+        self.in_flight_cost = 0.0
+        self.rate_limited = 0
+        self.queue_rejected = 0
+
+    def _get_bucket(self, buckets: OrderedDict, key: str, rate: float, capacity: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity)
+            buckets[key] = bucket
+            while len(buckets) > self.max_buckets:
+                buckets.popitem(last=False)
+        buckets.move_to_end(key)
+        return bucket
+
+    def check(self, user_id: str, guild_id: str, amount: float = 1) -> float:
+        # returns 0 when the request is admitted, otherwise the seconds to wait before retrying
+        buckets = [
+            self._get_bucket(self._user_buckets, user_id, self.user_rate, self.user_burst),
+            self._get_bucket(self._guild_buckets, guild_id, self.guild_rate, self.guild_burst),
+            self._global_bucket,
+        ]
+        # a batch larger than a bucket is admitted once the bucket is full and leaves it in debt,
+        # so the next requests wait as long as if the batch had been requested one task at a time
+        retry_after = max(bucket.retry_after(min(amount, bucket.capacity)) for bucket in buckets)
+        if retry_after > 0:
+            self.rate_limited += 1
+            return retry_after
+        for bucket in buckets:
+            bucket.consume(amount)
+        return 0.0
+
+    @staticmethod
+    def cost(params: ImageGenerationParams) -> float:
+        # estimated seconds of model server time, learned per model and weighted by scheduler, size and image count
+        return completion_estimator.estimate(params)
+
+    def _fits(self, cost: float) -> bool:
+        if self.in_flight == 0:
+            # a task larger than the whole budget still runs, alone
+            return True
+        return self.in_flight < self.max_in_flight and self.in_flight_cost + cost <= self.max_in_flight_cost
+
+    def _grant(self, cost: float) -> None:
+        self.in_flight += 1
+        self.in_flight_cost += cost
+
+    async def acquire(
+        self,
+        cost: float,
+        user_id: str,
+        guild_id: str,
+        on_queue_position: Optional[QueueListener] = None,
+    ) -> bool:
+        if not self.queued and self._fits(cost):
+            self._grant(cost)
+            return True
+        if self.queued >= self.max_queue:
+            self.queue_rejected += 1
+            return False
+        ticket = _Ticket(cost, user_id, guild_id)
+        self._flows.setdefault(guild_id, {}).setdefault(user_id, deque()).append(ticket)
+        self.queued += 1
+        self._notify_queue()
+        try:
+            while not ticket.granted:
+                ticket.changed.clear()
+                if on_queue_position is not None:
+                    await on_queue_position(ticket.position)
+                if not ticket.granted:
+                    await ticket.changed.wait()
+        except BaseException:
+            if ticket.granted:
+                self.release(cost)
+            else:
+                self._remove(ticket)
+                self._notify_queue()
+            raise
+        return True
+
+    def release(self, cost: float) -> None:
+        self.in_flight -= 1
+        self.in_flight_cost = max(self.in_flight_cost - cost, 0.0)
+        self._dispatch()
+
+    def _remove(self, ticket: _Ticket) -> None:
+        users = self._flows[ticket.guild_id]
+        tickets = users[ticket.user_id]
+        tickets.remove(ticket)
+        if not tickets:
+            del users[ticket.user_id]
+        if not users:
+            del self._flows[ticket.guild_id]
+        self.queued -= 1
+        if not self.queued:
+            # nobody competes anymore, the next backlog starts with a clean slate
+            self._fair_state = _FairState()
+
+    def _dispatch(self) -> None:
+        granted = False
+        while self.queued:
+            ticket = self._fair_state.pick(self._flows, {})
+            # the chosen ticket waits for room instead of being overtaken by smaller ones
+            if not self._fits(ticket.cost):
+                break
+            self._fair_state.advance(ticket)
+            self._remove(ticket)
+            self._grant(ticket.cost)
+            ticket.granted = True
+            ticket.changed.set()
+            granted = True
+        if granted:
+            self._notify_queue()
+
+    def _notify_queue(self) -> None:
+        # positions follow the order the queued tickets would be granted in
+        state = self._fair_state.copy()
+        heads: Dict[Tuple[str, str], int] = {}
+        for position in range(1, self.queued + 1):
+            ticket = state.pick(self._flows, heads)
+            state.advance(ticket)
+            key = (ticket.guild_id, ticket.user_id)
+            heads[key] = heads.get(key, 0) + 1
+            ticket.position = position
+            ticket.changed.set()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "in_flight_cost": self.in_flight_cost,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "queue_rejected": self.queue_rejected,
+        }
+
+
+admission_controller = AdmissionController(
+    user_rate=admission_settings.admission_user_rate,
+    user_burst=admission_settings.admission_user_burst,
+    guild_rate=admission_settings.admission_guild_rate,
+    guild_burst=admission_settings.admission_guild_burst,
+    global_rate=admission_settings.admission_global_rate,
+    global_burst=admission_settings.admission_global_burst,
+    max_in_flight=admission_settings.admission_max_in_flight,
+    max_in_flight_cost=admission_settings.admission_max_in_flight_cost,
+    max_queue=admission_settings.admission_max_queue,
+    max_buckets=admission_settings.admission_max_buckets,
+)
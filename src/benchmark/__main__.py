@@ -0,0 +1,45 @@
+import argparse
+import asyncio
+
+from benchmark.cli import DISTRIBUTIONS_EPILOG, add_common_arguments, build_stub, configure_environment, write_report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Drive the bot's command and button handlers against a local stub model server.",
+        epilog=DISTRIBUTIONS_EPILOG,
+    )
+    parser.add_argument("--flows", type=int, default=100, help="number of /generate flows")
+    parser.add_argument("--rate", type=float, default=0.0, help="flow arrivals per second, 0 starts all at once")
+    parser.add_argument("--users", type=int, default=100, help="distinct fake users")
+    parser.add_argument("--guilds", type=int, default=10, help="distinct fake guilds")
+    parser.add_argument("--no-followups", action="store_true", help="skip /result, /params and button clicks")
+    parser.add_argument("--regenerate-ratio", type=float, default=0.0, help="share of flows pressing the 🔄 button")
+    add_common_arguments(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    configure_environment(args)
+    # settings are read on import, so the bot modules are imported after the environment is set
+    from benchmark.runner import BenchmarkOptions, run_benchmark
+
+    options = BenchmarkOptions(
+        flows=args.flows,
+        rate=args.rate,
+        users=args.users,
+        guilds=args.guilds,
+        followups=not args.no_followups,
+        regenerate_ratio=args.regenerate_ratio,
+        discord_latency=args.discord_latency,
+        lag_interval=args.lag_interval,
+        seed=args.seed,
+    )
+    report = asyncio.run(run_benchmark(options, build_stub(args), args.host, args.port))
+    write_report(report, args.json_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import tempfile
+from typing import Dict, Optional
+
+from benchmark.stub_server import StubModelServer, parse_distribution
+
+
+DISTRIBUTIONS_EPILOG = "Distributions: fixed:S | uniform:LOW,HIGH | exp:MEAN | lognormal:MU,SIGMA (seconds)"
+
+
+def add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", default="fixed:0.01", help="stub server response latency")
+    parser.add_argument("--queue-time", default="exp:1", help="time a task stays pending")
+    parser.add_argument("--run-time", default="uniform:2,4", help="time a task stays assigned")
+    parser.add_argument("--tx-time", default="fixed:1", help="time from completion until the tx hash exists")
+    parser.add_argument("--upscale-time", default="uniform:1,2", help="time an upscale task takes")
+    parser.add_argument("--nsfw-ratio", type=float, default=0.1, help="share of filtered images")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="latency of every fake Discord call")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument(
+        "--webhook", action="store_true", help="push task notifications to the bot's webhook receiver on port + 1"
+    )
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="event loop lag sampling interval")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the report to this file")
+
+
+def build_stub(args: argparse.Namespace) -> StubModelServer:
+    return StubModelServer(
+        latency=parse_distribution(args.latency),
+        queue_time=parse_distribution(args.queue_time),
+        run_time=parse_distribution(args.run_time),
+        tx_time=parse_distribution(args.tx_time),
+        upscale_time=parse_distribution(args.upscale_time),
+        nsfw_ratio=args.nsfw_ratio,
+        seed=args.seed,
+    )
+
+
+def write_report(report: Dict, json_path: Optional[str]) -> None:
+    print(json.dumps(report, indent=2))
+    if json_path is not None:
+        with open(json_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+def configure_environment(args: argparse.Namespace, lift_in_flight_limits: bool = True) -> None:
+    endpoint = f"http://{args.host}:{args.port}"
+    os.environ["ENDPOINT"] = endpoint
+    os.environ["UPSCALE_ENDPOINT"] = endpoint
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ.setdefault("GUILD_ID", "1")
+    os.environ.setdefault("TASK_STORE_PATH", os.path.join(tempfile.mkdtemp(prefix="tti-benchmark-"), "tasks.db"))
+    # measure the bot itself, admission limits can still be set explicitly
+    for name in ("USER", "GUILD", "GLOBAL"):
+        os.environ.setdefault(f"ADMISSION_{name}_RATE", "1000000")
+        os.environ.setdefault(f"ADMISSION_{name}_BURST", "1000000")
+    if lift_in_flight_limits:
+        os.environ.setdefault("ADMISSION_MAX_IN_FLIGHT", "1000000")
+        os.environ.setdefault("ADMISSION_MAX_IN_FLIGHT_COST", "1000000000")
+    if args.webhook:
+        os.environ["WEBHOOK_ENABLED"] = "true"
+        os.environ["WEBHOOK_PUBLIC_URL"] = f"http://{args.host}:{args.port + 1}"
+        os.environ["SERVER_HOST"] = args.host
+        os.environ["SERVER_PORT"] = str(args.port + 1)
+    # the bot under test must not record the synthetic traffic
+    os.environ.pop("RECORD_PATH", None)
@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import discord
+
+
+_snowflakes = itertools.count(1 << 40)
+
+COMPLETED_CONTENT = "Your task is completed."
+
+
+@dataclass
+class FakeUser:
+    id: int
+
+    @property
+    def name(self) -> str:
+        return f"bench-user-{self.id}"
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+@dataclass
+class FakeSnowflake:
+    id: int
+
+
+class FakeDiscordAPI:
+    # stands in for the Discord REST API every fake interaction responds through
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.counts: Counter = Counter()
+
+    async def call(self, kind: str) -> None:
+        self.counts[kind] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content: Optional[str] = None, **kwargs: Any) -> None:
+        self._done = True
+        await self._interaction.record("send_message", content=content, **kwargs)
+
+    async def defer(self, **kwargs: Any) -> None:
+        self._done = True
+        await self._interaction.record("defer", **kwargs)
+
+    async def edit_message(self, **kwargs: Any) -> None:
+        self._done = True
+        await self._interaction.record("edit_message", **kwargs)
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self._interaction = interaction
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> None:
+        await self._interaction.record("followup", content=content, **kwargs)
+
+
+class FakeInteraction:
+    def __init__(
+        self,
+        api: FakeDiscordAPI,
+        user_id: int,
+        guild_id: int,
+        channel_id: int,
+        custom_id: Optional[str] = None,
+    ) -> None:
+        self.api = api
+        self.id = next(_snowflakes)
+        self.user = FakeUser(user_id)
+        self.guild = FakeSnowflake(guild_id)
+        self.channel = FakeSnowflake(channel_id)
+        self.message = None
+        if custom_id is None:
+            self.type = discord.InteractionType.application_command
+            self.data: Dict = {}
+        else:
+            self.type = discord.InteractionType.component
+            self.data = {"custom_id": custom_id, "component_type": discord.ComponentType.button.value}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.started_at = time.perf_counter()
+        self.completed_at: Optional[float] = None
+        self.events: List[Tuple[float, str, Dict]] = []
+        self._original_response = FakeSnowflake(next(_snowflakes))
+
+    async def record(self, kind: str, **kwargs: Any) -> None:
+        await self.api.call(kind)
+        now = time.perf_counter()
+        self.events.append((now, kind, kwargs))
+        if self.completed_at is None and COMPLETED_CONTENT in (kwargs.get("content") or ""):
+            self.completed_at = now
+
+    async def edit_original_response(self, **kwargs: Any) -> FakeSnowflake:
+        await self.record("edit_original_response", **kwargs)
+        return self._original_response
+
+    async def original_response(self) -> FakeSnowflake:
+        await self.api.call("original_response")
+        return self._original_response
+
+    @property
+    def time_to_result(self) -> Optional[float]:
+        if self.completed_at is None:
+            return None
+        return self.completed_at - self.started_at
+
+    @property
+    def last_view(self) -> Optional[discord.ui.View]:
+        for _, _, kwargs in reversed(self.events):
+            if kwargs.get("view") is not None:
+                return kwargs["view"]
+        return None
+
+    def custom_ids(self) -> List[str]:
+        view = self.last_view
+        if view is None:
+            return []
+        return [item.custom_id for item in view.children if getattr(item, "custom_id", None)]
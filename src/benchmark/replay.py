@@ -0,0 +1,38 @@
+import argparse
+import asyncio
+
+from benchmark.cli import DISTRIBUTIONS_EPILOG, add_common_arguments, build_stub, configure_environment, write_report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.replay",
+        description="Replay a recorded traffic file through the bot's handlers against a local stub model server.",
+        epilog=DISTRIBUTIONS_EPILOG,
+    )
+    parser.add_argument("trace", help="file written with RECORD_PATH, .gz is decompressed")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale, 10 replays ten times faster")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first records")
+    add_common_arguments(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    # the in-flight budget stays as configured, so the replay shows queueing under the scaled load
+    configure_environment(args, lift_in_flight_limits=False)
+    # settings are read on import, so the bot modules are imported after the environment is set
+    from benchmark.replayer import ReplayOptions, load_trace, run_replay
+
+    options = ReplayOptions(
+        speed=args.speed,
+        discord_latency=args.discord_latency,
+        lag_interval=args.lag_interval,
+    )
+    records = load_trace(args.trace, args.limit)
+    report = asyncio.run(run_replay(options, records, build_stub(args), args.host, args.port))
+    write_report(report, args.json_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import asyncio
+import gzip
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import bot
+from admission import admission_controller
+from benchmark.fake_discord import FakeDiscordAPI, FakeInteraction
+from benchmark.runner import LoopLagMonitor, close_bot, custom_ids_for, percentiles, quiet_bot_logs, start_bot
+from benchmark.stub_server import StubModelServer
+from components import build_custom_id, component_dispatcher, parse_custom_id
+from enums import ComponentAction, ResponseStatusEnum
+from recorder import BUTTON, GENERATE, PARAMS, RESULT, STATUS, TASK
+from schemas import ImageGenerationParams
+from utils import generate_image
+
+
+REPLAYED_KINDS = (GENERATE, RESULT, PARAMS, BUTTON)
+
+
+@dataclass
+class ReplayOptions:
+    speed: float
+    discord_latency: float
+    lag_interval: float
+
+
+def load_trace(path: str, limit: Optional[int] = None) -> List[Dict]:
+    records = []
+    with (gzip.open if path.endswith(".gz") else open)(path, "rt") as trace_file:
+        for line in trace_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last line of a trace that is still being written may be cut off
+                continue
+            if limit is not None and len(records) >= limit:
+                break
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def recorded_times_to_result(records: List[Dict]) -> List[float]:
+    generated_at = {record["i"]: record["t"] for record in records if record["k"] == GENERATE}
+    task_interactions = {record["task"]: record["i"] for record in records if record["k"] == TASK}
+    times = []
+    for record in records:
+        if record["k"] == STATUS and record["s"] == ResponseStatusEnum.COMPLETED:
+            interaction_hash = task_interactions.get(record["task"])
+            if interaction_hash in generated_at:
+                times.append(record["t"] - generated_at.pop(interaction_hash))
+    return times
+
+
+class ReplayRunner:
+    def __init__(self, options: ReplayOptions, records: List[Dict], stub: StubModelServer) -> None:
+        self.options = options
+        self.records = records
+        self.stub = stub
+        self.api = FakeDiscordAPI(latency=options.discord_latency)
+        # recorded interaction hash -> recorded task hash, and recorded task hash -> replayed task id
+        self.generated_tasks = {record["i"]: record["task"] for record in records if record["k"] == TASK}
+        self.task_ids: Dict[str, asyncio.Future] = {}
+        self.generations: List[FakeInteraction] = []
+        self.queue_depths: List[int] = []
+        self.replayed: Counter = Counter()
+        self.skipped: Counter = Counter()
+        self.failed: Counter = Counter()
+
+    def interaction(self, record: Dict, custom_id: Optional[str] = None) -> FakeInteraction:
+        return FakeInteraction(
+            self.api,
+            user_id=int(record["u"][:12], 16),
+            guild_id=int(record["g"][:12], 16),
+            channel_id=int(record["g"][:12], 16),
+            custom_id=custom_id,
+        )
+
+    async def resolve(self, task_hash: str) -> str:
+        future = self.task_ids.get(task_hash)
+        task_id = await future if future is not None else None
+        # tasks created before the recording started are looked up like unknown task ids
+        return task_id if task_id is not None else f"unknown-{task_hash}"
+
+    async def replay_generate(self, record: Dict) -> None:
+        interaction = self.interaction(record)
+        self.generations.append(interaction)
+        task_id = None
+        try:
+            await generate_image(interaction, ImageGenerationParams.parse_obj(record["p"]), [])
+            image_custom_ids = custom_ids_for(interaction, ComponentAction.IMAGE)
+            if image_custom_ids:
+                task_id = parse_custom_id(image_custom_ids[0])[1][0]
+        finally:
+            future = self.task_ids.get(self.generated_tasks.get(record["i"]))
+            if future is not None and not future.done():
+                future.set_result(task_id)
+
+    async def replay_button(self, record: Dict) -> bool:
+        action = ComponentAction(record["a"])
+        if action == ComponentAction.REGENERATE:
+            # the generation the button started is recorded and replayed on its own
+            self.skipped[f"{BUTTON}:{action}"] += 1
+            return False
+        custom_id = build_custom_id(action, await self.resolve(record["task"]), *record["args"])
+        await component_dispatcher.dispatch(self.interaction(record, custom_id=custom_id))
+        return True
+
+    async def replay(self, record: Dict) -> None:
+        kind = record["k"]
+        try:
+            if kind == GENERATE:
+                await self.replay_generate(record)
+            elif kind == BUTTON:
+                if not await self.replay_button(record):
+                    return
+            else:
+                task_ids = " ".join([await self.resolve(task_hash) for task_hash in record["tasks"]])
+                command = bot.result if kind == RESULT else bot.params
+                await command.callback(self.interaction(record), task_ids=task_ids)
+            self.replayed[kind] += 1
+        except Exception:
+            self.failed[kind] += 1
+
+    async def sample_queue(self) -> None:
+        while True:
+            self.queue_depths.append(admission_controller.queued)
+            await asyncio.sleep(self.options.lag_interval)
+
+    async def run(self) -> Dict:
+        loop = asyncio.get_running_loop()
+        for task_hash in self.generated_tasks.values():
+            self.task_ids[task_hash] = loop.create_future()
+        records = [record for record in self.records if record["k"] in REPLAYED_KINDS]
+        monitor = LoopLagMonitor(self.options.lag_interval)
+        monitor.start()
+        sampler = asyncio.ensure_future(self.sample_queue())
+        started_at = time.perf_counter()
+        replays = []
+        for record in records:
+            delay = (record["t"] - records[0]["t"]) / self.options.speed - (time.perf_counter() - started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            replays.append(asyncio.ensure_future(self.replay(record)))
+        await asyncio.gather(*replays)
+        wall_time = time.perf_counter() - started_at
+        sampler.cancel()
+        await monitor.stop()
+
+        times_to_result = [each.time_to_result for each in self.generations if each.time_to_result is not None]
+        return {
+            "records": len(self.records),
+            "speed": self.options.speed,
+            "trace_duration": round(records[-1]["t"] - records[0]["t"], 3) if records else 0.0,
+            "wall_time": round(wall_time, 3),
+            "replayed": dict(self.replayed),
+            "skipped": dict(self.skipped),
+            "failed": dict(self.failed),
+            "generations": len(self.generations),
+            "completed": len(times_to_result),
+            "time_to_result": percentiles(times_to_result),
+            "recorded_time_to_result": percentiles(recorded_times_to_result(self.records)),
+            "queue_depth": percentiles(self.queue_depths),
+            "loop_lag": percentiles(monitor.samples),
+            "polls": sum(count for route, count in self.stub.counts.items() if route.startswith("GET")),
+            "endpoint_requests": dict(sorted(self.stub.counts.items())),
+            "discord_calls": dict(sorted(self.api.counts.items())),
+            "admission": admission_controller.stats(),
+        }
+
+
+async def run_replay(options: ReplayOptions, records: List[Dict], stub: StubModelServer, host: str, port: int) -> Dict:
+    quiet_bot_logs()
+    await start_bot(stub, host, port)
+    try:
+        return await ReplayRunner(options, records, stub).run()
+    finally:
+        await close_bot(stub)
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import bot
+from admission import admission_controller
+from benchmark.fake_discord import FakeDiscordAPI, FakeInteraction
+from benchmark.stub_server import StubModelServer
+from cache import task_cache
+from components import component_dispatcher, parse_custom_id
+from dedupe import generation_index
+from enums import ComponentAction
+from http_client import http_client
+from message_editor import message_editor
+from poller import task_poller
+from server import embedded_server
+from settings import webhook_settings
+from singleflight import get_flight
+from task_store import task_store
+from tx_reconciler import tx_reconciler
+from webhook import webhook_receiver
+
+
+@dataclass
+class BenchmarkOptions:
+    flows: int
+    rate: float
+    users: int
+    guilds: int
+    followups: bool
+    regenerate_ratio: float
+    discord_latency: float
+    lag_interval: float
+    seed: Optional[int]
+
+
+@dataclass
+class FlowResult:
+    time_to_result: Optional[float] = None
+    upscale_time_to_result: Optional[float] = None
+    regenerate_time_to_result: Optional[float] = None
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.perf_counter() - expected, 0.0))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def percentiles(values: List[float]) -> Dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def nearest_rank(percentile: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(percentile / 100 * len(ordered)))], 4)
+
+    return {"count": len(ordered), "p50": nearest_rank(50), "p99": nearest_rank(99), "max": round(ordered[-1], 4)}
+
+
+def custom_ids_for(interaction: FakeInteraction, action: ComponentAction) -> List[str]:
+    custom_ids = []
+    for custom_id in interaction.custom_ids():
+        parsed = parse_custom_id(custom_id)
+        if parsed is not None and parsed[0] == action:
+            custom_ids.append(custom_id)
+    return custom_ids
+
+
+class BenchmarkRunner:
+    def __init__(self, options: BenchmarkOptions, stub: StubModelServer) -> None:
+        self.options = options
+        self.stub = stub
+        self.api = FakeDiscordAPI(latency=options.discord_latency)
+        self.random = random.Random(options.seed)
+
+    def interaction(self, index: int, custom_id: Optional[str] = None) -> FakeInteraction:
+        return FakeInteraction(
+            self.api,
+            user_id=1_000_000 + index % self.options.users,
+            guild_id=2_000_000 + index % self.options.guilds,
+            channel_id=3_000_000 + index % self.options.guilds,
+            custom_id=custom_id,
+        )
+
+    async def run_flow(self, index: int) -> FlowResult:
+        flow_result = FlowResult()
+        interaction = self.interaction(index)
+        await bot.generate.callback(
+            interaction, prompt=f"benchmark prompt {index}", seed=self.random.randint(0, 2**32)
+        )
+        flow_result.time_to_result = interaction.time_to_result
+        if flow_result.time_to_result is None or not self.options.followups:
+            return flow_result
+
+        image_custom_ids = custom_ids_for(interaction, ComponentAction.IMAGE)
+        task_id = parse_custom_id(image_custom_ids[0])[1][0]
+        await bot.result.callback(self.interaction(index), task_ids=task_id)
+        await bot.params.callback(self.interaction(index), task_ids=task_id)
+
+        image_interaction = self.interaction(index, custom_id=image_custom_ids[0])
+        await component_dispatcher.dispatch(image_interaction)
+        upscale_custom_ids = custom_ids_for(image_interaction, ComponentAction.UPSCALE)
+        if upscale_custom_ids:
+            upscale_interaction = self.interaction(index, custom_id=upscale_custom_ids[0])
+            await component_dispatcher.dispatch(upscale_interaction)
+            flow_result.upscale_time_to_result = upscale_interaction.time_to_result
+
+        if self.random.random() < self.options.regenerate_ratio:
+            regenerate_custom_id = custom_ids_for(interaction, ComponentAction.REGENERATE)[0]
+            regenerate_interaction = self.interaction(index, custom_id=regenerate_custom_id)
+            await component_dispatcher.dispatch(regenerate_interaction)
+            flow_result.regenerate_time_to_result = regenerate_interaction.time_to_result
+        return flow_result
+
+    async def run(self) -> Dict:
+        monitor = LoopLagMonitor(self.options.lag_interval)
+        monitor.start()
+        started_at = time.perf_counter()
+        flows = []
+        for index in range(self.options.flows):
+            flows.append(asyncio.ensure_future(self.run_flow(index)))
+            if self.options.rate > 0:
+                await asyncio.sleep(self.random.expovariate(self.options.rate))
+        results: List[FlowResult] = await asyncio.gather(*flows)
+        wall_time = time.perf_counter() - started_at
+        await monitor.stop()
+
+        times_to_result = [each.time_to_result for each in results if each.time_to_result is not None]
+        return {
+            "flows": self.options.flows,
+            "completed": len(times_to_result),
+            "failed": self.options.flows - len(times_to_result),
+            "wall_time": round(wall_time, 3),
+            "throughput": round(len(times_to_result) / wall_time, 3),
+            "time_to_result": percentiles(times_to_result),
+            "upscale_time_to_result": percentiles(
+                [each.upscale_time_to_result for each in results if each.upscale_time_to_result is not None]
+            ),
+            "regenerate_time_to_result": percentiles(
+                [each.regenerate_time_to_result for each in results if each.regenerate_time_to_result is not None]
+            ),
+            "loop_lag": percentiles(monitor.samples),
+            "endpoint_requests": dict(sorted(self.stub.counts.items())),
+            "discord_calls": dict(sorted(self.api.counts.items())),
+            "message_editor": message_editor.stats(),
+            "get_flight": get_flight.stats(),
+            "cache": task_cache.stats(),
+            "admission": admission_controller.stats(),
+        }
+
+
+def quiet_bot_logs() -> None:
+    # the bot logs every request, which would dominate the measured loop lag
+    for name in list(logging.root.manager.loggerDict):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+async def start_bot(stub: StubModelServer, host: str, port: int) -> None:
+    await stub.start(host, port)
+    if webhook_settings.webhook_enabled:
+        webhook_receiver.register(embedded_server)
+        await embedded_server.start()
+
+
+async def close_bot(stub: StubModelServer) -> None:
+    await task_poller.close()
+    await tx_reconciler.close()
+    await http_client.close()
+    generation_index.close()
+    task_store.close()
+    await stub.close()
+    await embedded_server.close()
+
+
+async def run_benchmark(options: BenchmarkOptions, stub: StubModelServer, host: str, port: int) -> Dict:
+    quiet_bot_logs()
+    await start_bot(stub, host, port)
+    try:
+        return await BenchmarkRunner(options, stub).run()
+    finally:
+        await close_bot(stub)
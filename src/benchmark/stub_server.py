@@ -0,0 +1,196 @@
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set
+
+import aiohttp
+from aiohttp import web
+
+
+Distribution = Callable[[random.Random], float]
+
+
+def parse_distribution(spec: str) -> Distribution:
+    # fixed:2 | uniform:1,3 | exp:2 (mean) | lognormal:0.5,0.3 (mu, sigma)
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exp" and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown distribution: {spec}")
+
+
+@dataclass
+class StubTask:
+    created_at: float
+    assigned_at: float
+    completed_at: float
+    tx_at: float
+    params: Dict = field(default_factory=dict)
+    # drawn once, so polls, pushes and cached results of a task agree
+    filtered: List[bool] = field(default_factory=list)
+
+    def status(self, now: float) -> str:
+        if now >= self.completed_at:
+            return "completed"
+        if now >= self.assigned_at:
+            return "assigned"
+        return "pending"
+
+
+class StubModelServer:
+    def __init__(
+        self,
+        latency: Distribution,
+        queue_time: Distribution,
+        run_time: Distribution,
+        tx_time: Distribution,
+        upscale_time: Distribution,
+        nsfw_ratio: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.queue_time = queue_time
+        self.run_time = run_time
+        self.tx_time = tx_time
+        self.upscale_time = upscale_time
+        self.nsfw_ratio = nsfw_ratio
+        self.random = random.Random(seed)
+        self.counts: Counter = Counter()
+        self.tasks: Dict[str, StubTask] = {}
+        self.upscales: Dict[str, float] = {}
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._callbacks: Set[asyncio.Task] = set()
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.router.add_post("/generate", self.generate)
+        self.app.router.add_get("/tasks/{task_id}/images", self.images)
+        self.app.router.add_get("/tasks/{task_id}/params", self.params)
+        self.app.router.add_get("/tasks/{task_id}/tx-hash", self.tx_hash)
+        self.app.router.add_post("/upscale/url", self.upscale)
+        self.app.router.add_get("/result/{task_id}", self.upscale_result)
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        self.counts[f"{request.method} {request.match_info.route.resource.canonical}"] += 1
+        delay = self.latency(self.random)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await handler(request)
+
+    async def start(self, host: str, port: int) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self) -> None:
+        for callback in list(self._callbacks):
+            callback.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _task(self, request: web.Request) -> Optional[StubTask]:
+        return self.tasks.get(request.match_info["task_id"])
+
+    async def generate(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        task_id = f"stub-{next(self._ids)}"
+        now = time.time()
+        assigned_at = now + self.queue_time(self.random)
+        completed_at = assigned_at + self.run_time(self.random)
+        params = body.get("params", {})
+        task = StubTask(
+            created_at=now,
+            assigned_at=assigned_at,
+            completed_at=completed_at,
+            tx_at=completed_at + self.tx_time(self.random),
+            params=params,
+            filtered=[self.random.random() < self.nsfw_ratio for _ in range(params.get("images", 2))],
+        )
+        self.tasks[task_id] = task
+        callback_url = body.get("callback_url")
+        if callback_url:
+            callback = asyncio.ensure_future(self._notify(callback_url, task_id, task))
+            self._callbacks.add(callback)
+            callback.add_done_callback(self._callbacks.discard)
+        return web.json_response({"task_id": task_id})
+
+    async def _notify(self, callback_url: str, task_id: str, task: StubTask) -> None:
+        # pushes every status change and the tx hash the way a model server with webhooks does
+        for at, kind in ((task.assigned_at, "images"), (task.completed_at, "images"), (task.tx_at, "tx-hash")):
+            await asyncio.sleep(max(0.0, at - time.time()))
+            payload = self._images_payload(task_id, task) if kind == "images" else self._tx_payload(task_id, task)
+            await self._post_callback(f"{callback_url}/tasks/{task_id}/{kind}", payload)
+
+    async def _post_callback(self, url: str, payload: Dict) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        self.counts[f"callback {url.rsplit('/', 1)[1]}"] += 1
+        try:
+            async with self._session.post(url, json=payload) as res:
+                await res.read()
+        except aiohttp.ClientError:
+            self.counts["callback failed"] += 1
+
+    async def images(self, request: web.Request) -> web.Response:
+        task = self._task(request)
+        if task is None:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        return web.json_response(self._images_payload(request.match_info["task_id"], task))
+
+    def _images_payload(self, task_id: str, task: StubTask) -> Dict:
+        status = task.status(time.time())
+        result = {}
+        if status == "completed":
+            for index, is_filtered in enumerate(task.filtered, start=1):
+                result[str(index)] = {
+                    "url": f"https://stub.invalid/{task_id}/{index}{'-filtered' if is_filtered else ''}.png",
+                    "origin_url": f"https://stub.invalid/{task_id}/{index}.png",
+                    "is_filtered": is_filtered,
+                }
+            result["grid"] = {"url": f"https://stub.invalid/{task_id}/grid.png", "is_filtered": False}
+        return {"status": status, "result": result, "updated_at": time.time()}
+
+    async def params(self, request: web.Request) -> web.Response:
+        task = self._task(request)
+        if task is None:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        return web.json_response(task.params)
+
+    async def tx_hash(self, request: web.Request) -> web.Response:
+        task = self._task(request)
+        if task is None:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        return web.json_response(self._tx_payload(request.match_info["task_id"], task))
+
+    @staticmethod
+    def _tx_payload(task_id: str, task: StubTask) -> Dict:
+        now = time.time()
+        tx_hash = {"completed": f"0x{task_id.encode().hex()}"} if now >= task.tx_at else {}
+        return {"status": task.status(now), "tx_hash": tx_hash}
+
+    async def upscale(self, request: web.Request) -> web.Response:
+        task_id = f"upscale-{next(self._ids)}"
+        self.upscales[task_id] = time.time() + self.upscale_time(self.random)
+        return web.json_response({"task_id": task_id})
+
+    async def upscale_result(self, request: web.Request) -> web.Response:
+        task_id = request.match_info["task_id"]
+        completed_at = self.upscales.get(task_id)
+        if completed_at is None:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        if time.time() < completed_at:
+            return web.json_response({"status": "assigned"})
+        return web.json_response({"status": "completed", "output": f"https://stub.invalid/{task_id}.png"})
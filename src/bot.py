@@ -4,34 +4,38 @@ from typing import Optional
 
 import discord
 from discord import app_commands
-from discord.ui import Button, View
 from pydantic import ValidationError
 
 from client import TextToImageClient
-from enums import ErrorMessage, ErrorTitle, ModelEnum, ResponseStatusEnum, SchedulerType, WarningMessages
-from schemas import ImageGenerationDiscordParams
-from settings import discord_bot_settings, model_settings
+from enums import ErrorMessage, ErrorTitle, ModelEnum, SchedulerType
+from message_editor import message_editor
+from paginator import PaginatorView
+from recorder import PARAMS, RESULT, traffic_recorder
+from settings import discord_bot_settings, lookup_settings, model_settings, sweep_settings
+from sweep import expand_sweep, parse_scheduler_type, parse_values, run_sweep
 from utils import (
     build_error_message,
-    build_message,
+    build_params_page,
+    build_params_text,
+    build_result_page,
+    gather_with_limit,
+    generate_image,
     get_logger,
-    get_req,
-    get_results,
-    get_twitter_url,
-    get_tx_hash,
-    get_tx_insight_url,
-    individual_image_button,
-    post_req,
+    get_task_images,
+    get_task_params,
+    parse_task_ids,
     preprocess_data,
-    re_generate_button,
 )
+from watchdog import loop_watchdog
 
 
 GUILD = discord.Object(id=discord_bot_settings.guild_id)
 
 logger = get_logger(__name__)
 
-intents = discord.Intents.default()
+# slash commands and components only need guild events
+intents = discord.Intents.none()
+intents.guilds = True
 client = TextToImageClient(intents=intents, guild=GUILD)
 
 
@@ -80,7 +84,6 @@ async def generate(
     scheduler_type: Optional[app_commands.Choice[str]] = SchedulerType.DDIM,
 ):
     logger.info(f"{interaction.user.name} generate image")
-    model_endpoint = model_settings.endpoint
     user_id = str(interaction.user.id)
     guild_id = str(interaction.guild.id)
     channel_id = str(interaction.channel.id)
@@ -122,298 +125,198 @@ async def generate(
             await interaction.response.send_message(embed=error_embed)
             return
         logger.info(f"{interaction.user.name} generate image - request task")
-
-        message_embed = build_message(
-            title=f"Prompt: {image_generation_request.prompt}",
-            description="",
-            colour=discord.Colour.blue(),
-        )
-        mentions = discord.AllowedMentions(users=True)
-        await interaction.response.send_message(
-            embed=message_embed,
-            allowed_mentions=mentions,
-        )
+        await generate_image(interaction, image_generation_request, warning_message_list)
     except Exception as unknown_error:
         error_message = ErrorMessage.UNKNOWN
         error_message += f"Error: {unknown_error}"
         error_embed = build_error_message(title=ErrorTitle.UNKNOWN, description=error_message)
-        await interaction.response.send_message(embed=error_embed)
-        return
-    try:
-        message = await interaction.original_response()
-        message_id = str(message.id)
-        discord_data = ImageGenerationDiscordParams(
-            user_id=user_id,
-            guild_id=guild_id,
-            channel_id=channel_id,
-            message_id=message_id,
-        )
-        request_data = {
-            "discord": discord_data.dict(),
-            "params": image_generation_request.dict(),
-        }
-        logger.info(f"Data : {request_data}")
-        is_success, res = post_req(url=f"{model_endpoint}/generate", data=request_data)
-        if is_success:
-            task_id = res["task_id"]
-            user_mention = interaction.user.mention
-            message_embed = build_message(
-                title=f"Prompt: {image_generation_request.prompt}",
-                description=f"task_id: {task_id}\nmodel_id: {model_id}",
-                colour=discord.Colour.blue(),
-            )
-            await interaction.edit_original_response(
-                embed=message_embed,
-                content=f"{user_mention} Your task is successfully requested.",
-                allowed_mentions=mentions,
-            )
-            is_success, res = await get_results(
-                url=f"{model_endpoint}/tasks/{task_id}/images",
-                n=300,
-                user=user_mention,
-                interaction=interaction,
-                message=message_embed,
-            )
-            if is_success:
-                button_list = [
-                    Button(label=f"#{i + 1}", style=discord.ButtonStyle.gray, row=0)
-                    for i in range(image_generation_request.images)
-                ]
-                view = View(timeout=None)
-                result = res["result"]
-                for i in range(image_generation_request.images):
-                    if result[str(i + 1)]["is_filtered"]:
-                        button_list[i].callback = individual_image_button(
-                            result[str(i + 1)]["origin_url"],
-                            title=f"Prompt: {image_generation_request.prompt}",
-                            description=f"task_id: {task_id}\nmodel_id: {model_id}",
-                        )
-                    else:
-                        button_list[i].callback = individual_image_button(
-                            result[str(i + 1)]["url"],
-                            title=f"Prompt: {image_generation_request.prompt}",
-                            description=f"task_id: {task_id}\nmodel_id: {model_id}",
-                        )
-                    view.add_item(button_list[i])
-                re_gen_button = Button(label="🔄", style=discord.ButtonStyle.gray, row=0)
-                re_gen_button.callback = re_generate_button(image_generation_request)
-                view.add_item(re_gen_button)
-                twitter_url = get_twitter_url(task_id=task_id)
-                share_twitter_button = Button(
-                    label="Share on Twitter", style=discord.ButtonStyle.gray, url=twitter_url, row=1
-                )
-
-                view.add_item(share_twitter_button)
-
-                message_embed.set_image(url=result["grid"]["url"])
-                if sum([each["is_filtered"] for each in result.values()]):
-                    warning_message_list.append(WarningMessages.NSFW)
-                content_message = f"{user_mention} Your task is completed."
-                if len(warning_message_list) != 0:
-                    warning_message_list.insert(0, f"model_id: {model_id}")
-                    warning_message_list.insert(0, f"task_id: {task_id}")
-                    message_embed.colour = discord.Colour.orange()
-                    message_embed.description = "\n".join(warning_message_list)
-                    await interaction.edit_original_response(
-                        content=content_message,
-                        embed=message_embed,
-                        allowed_mentions=mentions,
-                        view=view,
-                    )
-                else:
-                    message_embed.colour = discord.Colour.green()
-                    await interaction.edit_original_response(
-                        content=content_message,
-                        embed=message_embed,
-                        allowed_mentions=mentions,
-                        view=view,
-                    )
-
-                is_success, res = await get_tx_hash(url=f"{model_endpoint}/tasks/{task_id}/tx-hash", n=20)
-                if is_success:
-                    if res["status"] != ResponseStatusEnum.ERROR:
-                        status = res["status"]
-                        tx_hash = res["tx_hash"][status]
-                        tx_insight_url = get_tx_insight_url(tx_hash)
-                        insight_button = Button(
-                            label="View on Insight", style=discord.ButtonStyle.gray, url=tx_insight_url, row=1
-                        )
-                        view.add_item(insight_button)
-
-                        await interaction.edit_original_response(
-                            content=content_message,
-                            embed=message_embed,
-                            allowed_mentions=mentions,
-                            view=view,
-                        )
-                return
-            else:
-                if res:
-                    error_embed = build_error_message(
-                        title=ErrorTitle.UNKNOWN,
-                        description=ErrorMessage.UNKNOWN,
-                    )
-                else:
-                    error_embed = build_error_message(
-                        title=ErrorTitle.TIMEOUT,
-                        description=f"Your task cannot be generated because there are too many tasks on the server.\nIf you want to get your results late, let the community manager know your task id {task_id}.",
-                    )
-                    await interaction.edit_original_response(embed=error_embed)
-                return
+        if interaction.response.is_done():
+            await message_editor.edit_original_response(interaction, embed=error_embed)
         else:
-            error_message = "The request failed.\nPlease try again in a momentarily.\nIf the situation repeats, please let our community manager know."
-            error_embed = build_error_message(title="Request Error", description=error_message)
-            await interaction.edit_original_response(embed=error_embed)
-    except Exception as unknown_error:
-        error_message = ErrorMessage.UNKNOWN
-        error_message += f"Error: {unknown_error}"
-        error_embed = build_error_message(title="Unknown Error", description=error_message)
-        await interaction.edit_original_response(embed=error_embed)
+            await interaction.response.send_message(embed=error_embed)
 
 
-@client.tree.command(guild=GUILD, name="result", description="Get task result using task id")
-@app_commands.describe(task_id="a task id string obtained when generating an image")
+@client.tree.command(guild=GUILD, name="result", description="Get task results using task ids")
+@app_commands.describe(task_ids="one or more task ids obtained when generating images, separated by spaces or commas")
 async def result(
     interaction: discord.Interaction,
-    task_id: str,
+    task_ids: str,
 ):
-    warning_message_list = []
     mentions = discord.AllowedMentions(users=True)
-    model_endpoint = model_settings.endpoint
     try:
         user_mention = interaction.user.mention
-        is_success, res = get_req(url=f"{model_endpoint}/tasks/{task_id}/images")
-        if not is_success:
+        task_id_list = parse_task_ids(task_ids)
+        traffic_recorder.record_interaction(RESULT, interaction, tasks=task_id_list)
+        if len(task_id_list) == 0 or len(task_id_list) > lookup_settings.lookup_max_task_ids:
             error_embed = build_error_message(
-                title=ErrorTitle.WRONG_TASK_ID,
-                description=f"Requested task was not found. Your task id({task_id}) may be wrong. Please input correct task id.",
+                title=ErrorTitle.INPUT_VALIDATION,
+                description=f"Please input between 1 and {lookup_settings.lookup_max_task_ids} task ids.",
             )
             await interaction.response.send_message(embed=error_embed)
             return
 
-        if res["status"] != ResponseStatusEnum.COMPLETED:
-            message_embed = build_message(
-                title="Task is not finished",
-                description=f"Current status : {res['status']}",
-                colour=discord.Colour.blue(),
-            )
-            message_embed.colour = discord.Colour.orange()
-            await interaction.response.send_message(
-                embed=message_embed,
-                content=f"{user_mention} The result of requested task is below.",
-                allowed_mentions=mentions,
-            )
-            return
-
-        result = res["result"]
-
-        is_success, request_params = get_req(url=f"{model_endpoint}/tasks/{task_id}/params")
-        if not is_success:
-            error_embed = build_error_message(
-                title=ErrorTitle.WRONG_TASK_ID,
-                description=f"Requested task was not found. Your task id({task_id}) may be wrong. Please input correct task id.",
-            )
-            await interaction.response.send_message(embed=error_embed)
-            return
-
-        button_list = [
-            Button(label=f"#{i + 1}", style=discord.ButtonStyle.gray) for i in range(request_params["images"])
-        ]
-        view = View(timeout=None)
-        for i in range(request_params["images"]):
-            if result[str(i + 1)]["is_filtered"]:
-                button_list[i].callback = individual_image_button(
-                    result[str(i + 1)]["origin_url"],
-                    title=f"Prompt: {request_params['prompt']}",
-                    description=f"task id: {task_id}",
-                )
-            else:
-                button_list[i].callback = individual_image_button(
-                    result[str(i + 1)]["url"],
-                    title=f"Prompt: {request_params['prompt']}",
-                    description=f"task id: {task_id}",
-                )
-            view.add_item(button_list[i])
-
-        message_embed = build_message(
-            title=f"Prompt: {request_params['prompt']}",
-            description=f"task_id: {task_id}",
-            colour=discord.Colour.blue(),
+        lookups = await gather_with_limit(
+            [get_task_images(task_id) for task_id in task_id_list]
+            + [get_task_params(task_id) for task_id in task_id_list],
+            limit=lookup_settings.lookup_concurrency,
         )
-        message_embed.set_image(url=result["grid"]["url"])
-        if sum([each["is_filtered"] for each in result.values()]):
-            warning_message_list.append(WarningMessages.NSFW)
-
-        if len(warning_message_list) != 0:
-            warning_message_list.insert(0, f"task_id: {task_id}")
-            message_embed.colour = discord.Colour.orange()
-            message_embed.description = "\n".join(warning_message_list)
-            await interaction.response.send_message(
-                content=f"{user_mention} The result of requested task is below.",
-                embed=message_embed,
-                allowed_mentions=mentions,
-                view=view,
+        pages = [
+            build_result_page(task_id, images_lookup, params_lookup)
+            for task_id, images_lookup, params_lookup in zip(
+                task_id_list, lookups[: len(task_id_list)], lookups[len(task_id_list) :]
             )
-        else:
+        ]
+        if len(pages) == 1:
+            view = PaginatorView(pages, timeout=None)
             content_message = f"{user_mention} The result of requested task is below."
-            message_embed.colour = discord.Colour.green()
-            await interaction.response.send_message(
-                content=content_message,
-                embed=message_embed,
-                allowed_mentions=mentions,
-                view=view,
-            )
+        else:
+            view = PaginatorView(pages, timeout=lookup_settings.lookup_page_timeout)
+            content_message = f"{user_mention} The results of {len(pages)} requested tasks are below."
+        await interaction.response.send_message(
+            content=content_message,
+            embed=view.embed,
+            allowed_mentions=mentions,
+            view=view,
+        )
         return
     except Exception as unknown_error:
         error_message = ErrorMessage.UNKNOWN
         error_message += f"Error: {unknown_error}"
-        error_embed = build_error_message(title="Unknown Error", description=error_message)
+        error_embed = build_error_message(title=ErrorTitle.UNKNOWN, description=error_message)
         await interaction.response.send_message(embed=error_embed)
 
 
-@client.tree.command(guild=GUILD, name="params", description="Get task parameters using task id")
-@app_commands.describe(task_id="a task id string obtained when generating an image")
+@client.tree.command(guild=GUILD, name="params", description="Get task parameters using task ids")
+@app_commands.describe(task_ids="one or more task ids obtained when generating images, separated by spaces or commas")
 async def params(
     interaction: discord.Interaction,
-    task_id: str,
+    task_ids: str,
 ):
     mentions = discord.AllowedMentions(users=True)
-    model_endpoint = model_settings.endpoint
     try:
-        is_success, res = get_req(url=f"{model_endpoint}/tasks/{task_id}/params")
-        if not is_success:
+        task_id_list = parse_task_ids(task_ids)
+        traffic_recorder.record_interaction(PARAMS, interaction, tasks=task_id_list)
+        if len(task_id_list) == 0 or len(task_id_list) > lookup_settings.lookup_max_task_ids:
             error_embed = build_error_message(
-                title=ErrorTitle.WRONG_TASK_ID,
-                description=f"Requested task was not found. Your task id({task_id}) may be wrong. Please input correct task id.",
+                title=ErrorTitle.INPUT_VALIDATION,
+                description=f"Please input between 1 and {lookup_settings.lookup_max_task_ids} task ids.",
             )
             await interaction.response.send_message(embed=error_embed)
             return
 
-        is_success, request_params = get_req(url=f"{model_endpoint}/tasks/{task_id}/params")
-        if not is_success:
-            error_embed = build_error_message(
-                title=ErrorTitle.WRONG_TASK_ID,
-                description=f"Requested task was not found. Your task id({task_id}) may be wrong. Please input correct task id.",
+        lookups = await gather_with_limit(
+            [get_task_params(task_id) for task_id in task_id_list],
+            limit=lookup_settings.lookup_concurrency,
+        )
+        if len(task_id_list) == 1:
+            is_success, request_params = lookups[0]
+            if not is_success:
+                error_embed = build_error_message(
+                    title=ErrorTitle.WRONG_TASK_ID,
+                    description=f"Requested task was not found. Your task id({task_id_list[0]}) may be wrong. Please input correct task id.",
+                )
+                await interaction.response.send_message(embed=error_embed)
+                return
+            await interaction.response.send_message(
+                content=build_params_text(request_params),
+                allowed_mentions=mentions,
             )
-            await interaction.response.send_message(embed=error_embed)
             return
 
-        params_text = ""
-        for param_name, param_val in request_params.items():
-            params_text += f"> **{param_name}**\n> {param_val}\n"
-
+        pages = [build_params_page(task_id, params_lookup) for task_id, params_lookup in zip(task_id_list, lookups)]
+        view = PaginatorView(pages, timeout=lookup_settings.lookup_page_timeout)
         await interaction.response.send_message(
-            content=params_text,
+            embed=view.embed,
             allowed_mentions=mentions,
+            view=view,
         )
         return
     except Exception as unknown_error:
         error_message = ErrorMessage.UNKNOWN
         error_message += f"Error: {unknown_error}"
-        error_embed = build_error_message(title="Unknown Error", description=error_message)
+        error_embed = build_error_message(title=ErrorTitle.UNKNOWN, description=error_message)
         await interaction.response.send_message(embed=error_embed)
 
 
+@client.tree.command(guild=GUILD, name="sweep", description="Generate one prompt over several parameter values")
+@app_commands.describe(
+    prompt="Try adding increments to your prompt such as 'a photo of an astronaut riding a horse on mars'",
+    seeds="Seeds to try, separated by spaces or commas",
+    scheduler_types="Diffusers scheduler types to try, separated by spaces or commas",
+    guidance_scales="Guidance scales to try, separated by spaces or commas",
+    steps="Step counts to try, separated by spaces or commas",
+    model_ids="Diffusion models to try, separated by spaces or commas",
+    width="Image width",
+    height="Image Height",
+    images="How many images each task generates",
+    negative_prompt="prompt value that you do not want to see in the resulting image",
+)
+async def sweep(
+    interaction: discord.Interaction,
+    prompt: str,
+    seeds: Optional[str] = None,
+    scheduler_types: Optional[str] = None,
+    guidance_scales: Optional[str] = None,
+    steps: Optional[str] = None,
+    model_ids: Optional[str] = None,
+    width: Optional[int] = 768,
+    height: Optional[int] = 768,
+    images: Optional[int] = 1,
+    negative_prompt: Optional[str] = "",
+):
+    logger.info(f"{interaction.user.name} sweep")
+    try:
+        axes = {
+            "seed": parse_values(seeds, int, "seeds") or [random.randint(0, 4294967295)],
+            "scheduler_type": parse_values(scheduler_types, parse_scheduler_type, "scheduler_types")
+            or [SchedulerType.DDIM],
+            "guidance_scale": parse_values(guidance_scales, float, "guidance_scales") or [7.0],
+            "steps": parse_values(steps, int, "steps") or [50],
+            "model_id": parse_values(model_ids, ModelEnum, "model_ids") or [ModelEnum.STABLE_DIFFUSION_V2_1_768],
+        }
+        jobs = expand_sweep(
+            prompt,
+            axes,
+            fixed={"width": width, "height": height, "images": images, "negative_prompt": negative_prompt},
+        )
+    except ValidationError as validation_error:
+        error_message = "\n".join(
+            [f"{error['loc'][0]} : {error['msg']}" for error in json.loads(validation_error.json())]
+        )
+        error_embed = build_error_message(title=ErrorTitle.INPUT_VALIDATION, description=error_message)
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+    except ValueError as value_error:
+        error_embed = build_error_message(title=ErrorTitle.INPUT_VALIDATION, description=str(value_error))
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+    try:
+        await run_sweep(interaction, jobs)
+    except Exception as unknown_error:
+        error_message = ErrorMessage.UNKNOWN
+        error_message += f"Error: {unknown_error}"
+        error_embed = build_error_message(title=ErrorTitle.UNKNOWN, description=error_message)
+        if interaction.response.is_done():
+            await message_editor.edit_original_response(interaction, embed=error_embed)
+        else:
+            await interaction.response.send_message(embed=error_embed)
+
+
+@client.tree.command(guild=GUILD, name="lag", description="Show the longest event loop stalls")
+@app_commands.describe(count="How many stalls to show", clear="Forget the shown stalls")
+@app_commands.default_permissions(administrator=True)
+async def lag(interaction: discord.Interaction, count: Optional[int] = 3, clear: Optional[bool] = False):
+    stalls = loop_watchdog.worst(count)
+    if not stalls:
+        await interaction.response.send_message(content="No event loop stalls were captured.", ephemeral=True)
+        return
+    # a message holds at most 2000 characters, so each stall keeps only its innermost frames
+    content = "\n".join(f"```\n{stall.format(stack_depth=4)[:1800 // len(stalls)]}```" for stall in stalls)
+    if clear:
+        loop_watchdog.clear()
+    await interaction.response.send_message(content=content, ephemeral=True)
+
+
 # TODO: Find Better way
 @client.tree.command(guild=GUILD, name="help", description="Show help for bot")
 async def help(interaction: discord.Interaction):
@@ -477,34 +380,56 @@ async def help(interaction: discord.Interaction):
 
     result_parameters = [
         {
-            "name": "task_id",
-            "value": "A task id string obtained when generating an image",
-            "condition": "required | string",
+            "name": "task_ids",
+            "value": "One or more task ids obtained when generating images, separated by spaces or commas",
+            "condition": f"required | string | max: {lookup_settings.lookup_max_task_ids} task ids",
         }
     ]
     result_title = "/result"
-    result_info = "Shows generating results from task id."
+    result_info = "Shows generating results from task ids."
     result_description = "\n>".join(
         [f" - `{each['name']}` \n> {each['value']}\n> {each['condition']}" for each in result_parameters]
     )
 
     params_parameters = [
         {
-            "name": "task_id",
-            "value": "A task id string obtained when generating an image",
-            "condition": "required | string",
+            "name": "task_ids",
+            "value": "One or more task ids obtained when generating images, separated by spaces or commas",
+            "condition": f"required | string | max: {lookup_settings.lookup_max_task_ids} task ids",
         }
     ]
     params_title = "/params"
-    params_info = "Shows request parameters from task id."
+    params_info = "Shows request parameters from task ids."
     params_description = "\n>".join(
         [f" - `{each['name']}` \n> {each['value']}\n> {each['condition']}" for each in params_parameters]
     )
 
+    sweep_parameters = [
+        {
+            "name": "seeds, scheduler_types, guidance_scales, steps, model_ids",
+            "value": "Values to try, separated by spaces or commas. Every combination becomes one task.",
+            "condition": f"string | max: {sweep_settings.sweep_max_jobs} combinations",
+        },
+        {
+            "name": "width, height, images, negative_prompt",
+            "value": "Shared by every task of the sweep.",
+            "condition": "same as /generate | images default: 1",
+        },
+    ]
+    sweep_title = "/sweep"
+    sweep_info = "Generates one prompt over every combination of the given values."
+    sweep_description = "\n>".join(
+        [f" - `{each['name']}` \n> {each['value']}\n> {each['condition']}" for each in sweep_parameters]
+    )
+
     content = f"**{generate_title}** \n {generate_info} \n>{generate_description}\n"
     content += f"**{result_title}** \n {result_info} \n>{result_description}\n"
-    content += f"**{params_title}** \n {params_info} \n>{params_description}"
+    content += f"**{params_title}** \n {params_info} \n>{params_description}\n"
+    content += f"**{sweep_title}** \n {sweep_info} \n>{sweep_description}"
     await interaction.response.send_message(content=content)
 
 
-client.run(discord_bot_settings.bot_token)
+if __name__ == "__main__":
+    # discord.py logs through the bot's logging pipeline instead of its own handler
+    get_logger("discord")
+    client.run(discord_bot_settings.bot_token, log_handler=None)
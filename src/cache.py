@@ -0,0 +1,93 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from enums import ResponseStatusEnum
+from metrics import cache_bytes, cache_entries, cache_evictions_total, cache_lookups_total
+from settings import cache_settings
+
+
+class TaskCache:
+    def __init__(self, max_entries: int, max_bytes: int, completed_ttl: float, pending_ttl: float) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.completed_ttl = completed_ttl
+        self.pending_ttl = pending_ttl
+        # key -> (expires_at, size, value), ordered from least to most recently used
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_for(self, res: Dict) -> float:
+        status = res.get("status")
+        if status in (ResponseStatusEnum.PENDING, ResponseStatusEnum.ASSIGNED):
+            return self.pending_ttl
+        # completed or error results and task params never change
+        return self.completed_ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            cache_lookups_total.inc(outcome="miss")
+            return None
+        expires_at, _, value = item
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            cache_lookups_total.inc(outcome="miss")
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        cache_lookups_total.inc(outcome="hit")
+        return value
+
+    def set(self, key: str, value: Dict, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.ttl_for(value)
+        if ttl <= 0:
+            return
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+            cache_evictions_total.inc()
+        cache_entries.set(len(self._entries))
+        cache_bytes.set(self._bytes)
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        cache_entries.set(len(self._entries))
+        cache_bytes.set(self._bytes)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else None,
+        }
+
+
+task_cache = TaskCache(
+    max_entries=cache_settings.cache_max_entries,
+    max_bytes=cache_settings.cache_max_bytes,
+    completed_ttl=cache_settings.cache_completed_ttl,
+    pending_ttl=cache_settings.cache_pending_ttl,
+)
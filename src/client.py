@@ -1,21 +1,103 @@
+import time
+from typing import List, Optional
+
 import discord
 from discord import app_commands
 
-from utils import get_logger
+from command_sync import command_sync_state
+from components import component_dispatcher
+from dedupe import generation_index
+from health import health_reporter
+from http_client import http_client
+from lease import lease_coordinator
+from logs import bind_log_context, get_logger
+from metrics import metrics_registry
+from poller import task_poller
+from server import embedded_server
+from settings import command_sync_settings, server_settings, shard_settings, watchdog_settings, webhook_settings
+from task_store import task_store
+from tx_reconciler import tx_reconciler
+from utils import resume_generations
+from watchdog import loop_watchdog
+from webhook import webhook_receiver
 
 
 logger = get_logger(__name__)
 
 
-class TextToImageClient(discord.Client):
+def parse_shard_ids(shard_ids: Optional[str]) -> Optional[List[int]]:
+    if not shard_ids:
+        return None
+    return [int(shard_id) for shard_id in shard_ids.split(",") if shard_id.strip()]
+
+
+class TextToImageCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # runs in the task of the command, so stalls caused by the command carry its name
+        loop_watchdog.tag(command=interaction.data.get("name"))
+        bind_log_context(command=interaction.data.get("name"), user_id=interaction.user.id)
+        return await lease_coordinator.claim_interaction(interaction.id)
+
+
+class TextToImageClient(discord.AutoShardedClient):
     def __init__(self, *, intents: discord.Intents, guild: discord.Object) -> None:
-        super().__init__(intents=intents)
-        self.tree = app_commands.CommandTree(self)
+        # the bot only answers interactions, so members and messages are not cached
+        super().__init__(
+            intents=intents,
+            shard_count=shard_settings.shard_count,
+            shard_ids=parse_shard_ids(shard_settings.shard_ids),
+            max_messages=shard_settings.message_cache_size or None,
+            member_cache_flags=discord.MemberCacheFlags.none(),
+            chunk_guilds_at_startup=False,
+        )
+        self.tree = TextToImageCommandTree(self)
         self.guild = guild
 
     async def on_ready(self):
-        logger.info(f"Logged in as {self.user} (ID: {self.user.id})")
+        logger.info(
+            f"Logged in as {self.user} (ID: {self.user.id}, shards: {self.shard_ids or 'all'}/{self.shard_count})"
+        )
+
+    async def on_shard_disconnect(self, shard_id: int):
+        logger.warning(f"Shard {shard_id} disconnected")
+
+    async def on_interaction(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.component:
+            return
+        if await lease_coordinator.claim_interaction(interaction.id):
+            await component_dispatcher.dispatch(interaction)
 
     async def setup_hook(self):
+        started_at = time.perf_counter()
+        if watchdog_settings.watchdog_enabled:
+            loop_watchdog.start()
         self.tree.copy_global_to(guild=self.guild)
-        await self.tree.sync(guild=self.guild)
+        synced = await command_sync_state.sync(self.tree, self.guild, force=command_sync_settings.command_sync_force)
+        synced_at = time.perf_counter()
+        if webhook_settings.webhook_enabled:
+            webhook_receiver.register(embedded_server)
+        if server_settings.health_enabled:
+            health_reporter.register(embedded_server, self)
+        if server_settings.metrics_enabled:
+            metrics_registry.register(embedded_server)
+        await embedded_server.start()
+        server_started_at = time.perf_counter()
+        self.loop.create_task(resume_generations(self))
+        # with several replicas, tasks of a replica that stopped heartbeating are resumed here
+        lease_coordinator.start(lambda: resume_generations(self, takeover=True))
+        logger.info(
+            f"Setup took {server_started_at - started_at:.3f}s "
+            f"(command tree {'synced' if synced else 'skipped'}: {synced_at - started_at:.3f}s, "
+            f"embedded server: {server_started_at - synced_at:.3f}s)"
+        )
+
+    async def close(self):
+        loop_watchdog.stop()
+        await lease_coordinator.close()
+        await embedded_server.close()
+        await task_poller.close()
+        await tx_reconciler.close()
+        await http_client.close()
+        generation_index.close()
+        task_store.close()
+        await super().close()
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+from logs import get_logger
+from settings import command_sync_settings
+
+
+logger = get_logger(__name__)
+
+
+def command_tree_fingerprint(tree: app_commands.CommandTree, guild: discord.Object) -> str:
+    # to_dict covers names, descriptions, options and choices, i.e. everything Discord stores
+    commands = sorted((command.to_dict() for command in tree.get_commands(guild=guild)), key=lambda each: each["name"])
+    payload = {"application_id": tree.client.application_id, "guild_id": guild.id, "commands": commands}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class CommandSyncState:
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+
+    def load(self) -> Optional[str]:
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as state_file:
+            return state_file.read().strip() or None
+
+    def save(self, fingerprint: str) -> None:
+        if self.path is None:
+            return
+        # replace atomically so a crash mid write never leaves a half written fingerprint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as state_file:
+            state_file.write(fingerprint)
+        os.replace(tmp_path, self.path)
+
+    async def sync(self, tree: app_commands.CommandTree, guild: discord.Object, force: bool = False) -> bool:
+        fingerprint = command_tree_fingerprint(tree, guild)
+        if not force and fingerprint == self.load():
+            logger.info(f"Command tree is unchanged ({fingerprint[:12]}), skip sync")
+            return False
+        await tree.sync(guild=guild)
+        self.save(fingerprint)
+        logger.info(f"Synced command tree ({fingerprint[:12]})")
+        return True
+
+
+command_sync_state = CommandSyncState(command_sync_settings.command_sync_state_path)
@@ -0,0 +1,80 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import discord
+from discord.ui import Item, View
+
+from enums import ComponentAction
+from logs import bind_log_context, get_logger
+from recorder import BUTTON, traffic_recorder
+from watchdog import loop_watchdog
+
+
+logger = get_logger(__name__)
+
+CUSTOM_ID_PREFIX = "tti"
+
+ComponentHandler = Callable[..., Awaitable[None]]
+
+
+def build_custom_id(action: ComponentAction, *args: object) -> str:
+    return ":".join([CUSTOM_ID_PREFIX, str(action), *[str(arg) for arg in args]])
+
+
+def parse_custom_id(custom_id: str) -> Optional[Tuple[ComponentAction, List[str]]]:
+    prefix, _, rest = custom_id.partition(":")
+    if prefix != CUSTOM_ID_PREFIX or not rest:
+        return None
+    action, *args = rest.split(":")
+    try:
+        return ComponentAction(action), args
+    except ValueError:
+        return None
+
+
+def build_static_view(items: List[Item]) -> View:
+    # a finished view is rendered into the message but never kept in the client's view store,
+    # its custom_id components are handled by the component dispatcher instead
+    view = View(timeout=None)
+    for item in items:
+        view.add_item(item)
+    view.stop()
+    return view
+
+
+class ComponentDispatcher:
+    def __init__(self) -> None:
+        self._handlers: Dict[ComponentAction, ComponentHandler] = {}
+        self.dispatched = 0
+        self.failed = 0
+
+    def register(self, action: ComponentAction, handler: ComponentHandler) -> None:
+        self._handlers[action] = handler
+
+    async def dispatch(self, interaction: discord.Interaction) -> bool:
+        if interaction.type != discord.InteractionType.component or interaction.data is None:
+            return False
+        parsed = parse_custom_id(interaction.data.get("custom_id", ""))
+        if parsed is None:
+            return False
+        action, args = parsed
+        handler = self._handlers.get(action)
+        if handler is None:
+            logger.warning(f"No component handler for {action}")
+            return False
+        self.dispatched += 1
+        if args:
+            traffic_recorder.record_interaction(BUTTON, interaction, a=action, task=args[0], args=args[1:])
+        loop_watchdog.tag(command=f"button:{action}")
+        bind_log_context(command=f"button:{action}", user_id=interaction.user.id)
+        try:
+            await handler(interaction, *args)
+        except Exception as unknown_error:
+            self.failed += 1
+            logger.error(f"Component {action} failed: {unknown_error}")
+        return True
+
+    def stats(self) -> Dict:
+        return {"dispatched": self.dispatched, "failed": self.failed, "handlers": len(self._handlers)}
+
+
+component_dispatcher = ComponentDispatcher()
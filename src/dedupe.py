@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from logs import get_logger
+from metrics import dedupe_lookups_total
+from schemas import ImageGenerationParams
+from settings import dedupe_settings
+from sqlite_store import SQLiteStore
+
+
+logger = get_logger(__name__)
+
+
+def params_key(params: ImageGenerationParams) -> str:
+    canonical = {
+        "prompt": " ".join(params.prompt.split()),
+        "negative_prompt": " ".join((params.negative_prompt or "").split()),
+        "seed": params.seed,
+        "steps": params.steps,
+        "width": params.width,
+        "height": params.height,
+        "images": params.images,
+        "guidance_scale": round(float(params.guidance_scale), 4),
+        "model_id": str(params.model_id),
+        "scheduler_type": str(params.scheduler_type),
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class GenerationIndex(SQLiteStore):
+    def __init__(self, max_entries: int, db_path: Optional[str] = None) -> None:
+        super().__init__(db_path)
+        self.max_entries = max_entries
+        # params key -> task_id of an in-flight or completed task
+        self._task_ids: OrderedDict = OrderedDict()
+        self._submissions: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.attached = 0
+        self.misses = 0
+
+    def create_tables(self, connection: sqlite3.Connection) -> None:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS generations (params_key TEXT PRIMARY KEY, task_id TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def _select(self, key: str) -> Optional[str]:
+        row = self.connection().execute("SELECT task_id FROM generations WHERE params_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _upsert(self, key: str, task_id: str) -> None:
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO generations (params_key, task_id, created_at) VALUES (?, ?, ?)",
+                (key, task_id, time.time()),
+            )
+
+    def _delete(self, key: str) -> None:
+        with self.connection() as connection:
+            connection.execute("DELETE FROM generations WHERE params_key = ?", (key,))
+
+    def _remember(self, key: str, task_id: str) -> None:
+        self._task_ids[key] = task_id
+        self._task_ids.move_to_end(key)
+        while len(self._task_ids) > self.max_entries:
+            self._task_ids.popitem(last=False)
+
+    async def lookup(self, params: ImageGenerationParams) -> Optional[str]:
+        key = params_key(params)
+        task_id = self._task_ids.get(key)
+        if task_id is None:
+            task_id = await self.run(self._select, key)
+            if task_id is not None:
+                self._remember(key, task_id)
+        else:
+            self._task_ids.move_to_end(key)
+        return task_id
+
+    async def submit(
+        self, params: ImageGenerationParams, submit: Callable[[], Awaitable[Tuple[bool, Dict]]]
+    ) -> Tuple[bool, Dict]:
+        task_id = await self.lookup(params)
+        if task_id is not None:
+            self.hits += 1
+            dedupe_lookups_total.inc(outcome="hit")
+            logger.info(f"Reuse task {task_id} for identical params")
+            return True, {"task_id": task_id}
+        key = params_key(params)
+        submission = self._submissions.get(key)
+        if submission is not None:
+            # an identical request is being submitted right now
+            self.attached += 1
+            dedupe_lookups_total.inc(outcome="attached")
+            return await asyncio.shield(submission)
+        self.misses += 1
+        dedupe_lookups_total.inc(outcome="miss")
+        submission = asyncio.ensure_future(submit())
+        self._submissions[key] = submission
+        try:
+            is_success, res = await asyncio.shield(submission)
+        finally:
+            del self._submissions[key]
+        if is_success:
+            self._remember(key, res["task_id"])
+        return is_success, res
+
+    async def complete(self, params: ImageGenerationParams, task_id: str) -> None:
+        key = params_key(params)
+        self._remember(key, task_id)
+        await self.run(self._upsert, key, task_id)
+
+    async def forget(self, params: ImageGenerationParams, task_id: str) -> None:
+        key = params_key(params)
+        if self._task_ids.get(key) == task_id:
+            del self._task_ids[key]
+            await self.run(self._delete, key)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._task_ids),
+            "in_flight_submissions": len(self._submissions),
+            "hits": self.hits,
+            "attached": self.attached,
+            "misses": self.misses,
+        }
+
+
+generation_index = GenerationIndex(
+    max_entries=dedupe_settings.dedupe_max_entries,
+    db_path=dedupe_settings.dedupe_db_path,
+)
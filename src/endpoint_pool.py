@@ -0,0 +1,219 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from enums import CircuitState
+from http_client import CONNECT_FAILED, http_client
+from logs import get_logger
+from metrics import replica_circuit_open, replica_outstanding, replica_retries_total
+from settings import endpoint_pool_settings, model_settings
+
+
+logger = get_logger(__name__)
+
+TASK_PATH = re.compile(r"^/(?:tasks|result)/([^/?]+)")
+# the replica rejected the request before doing any work, so even a submission can go elsewhere
+UNAVAILABLE_STATUSES = (CONNECT_FAILED, 502, 503)
+
+
+def _split_urls(urls: Optional[str]) -> List[str]:
+    return [url.strip() for url in (urls or "").split(",") if url.strip()]
+
+
+class Replica:
+    def __init__(self, pool: str, url: str) -> None:
+        self.pool = pool
+        self.url = url
+        self.outstanding = 0
+        self.latency = 0.0
+        self.failures = 0
+        self.state = CircuitState.CLOSED
+        self.opened_at = 0.0
+
+    def probe_due(self, now: float, reset_timeout: float) -> bool:
+        return self.state == CircuitState.OPEN and now - self.opened_at >= reset_timeout
+
+    def load(self) -> Tuple[int, float]:
+        return self.outstanding, self.latency
+
+
+class EndpointPool:
+    def __init__(
+        self,
+        name: str,
+        urls: List[str],
+        failure_threshold: int,
+        reset_timeout: float,
+        latency_smoothing: float,
+        affinity_size: int,
+    ) -> None:
+        self.name = name
+        # the first url identifies the pool, the rest of the bot builds its urls from it
+        self.primary_url = urls[0]
+        self.replicas = [Replica(name, url) for url in dict.fromkeys(urls)]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_smoothing = latency_smoothing
+        self.affinity_size = affinity_size
+        self._affinity: OrderedDict = OrderedDict()
+
+    def candidates(self, task_id: Optional[str]) -> List[Replica]:
+        now = time.monotonic()
+        # an open circuit gets one probe per reset timeout, half open replicas wait for their probe
+        probes = [replica for replica in self.replicas if replica.probe_due(now, self.reset_timeout)]
+        closed = sorted(
+            (replica for replica in self.replicas if replica.state == CircuitState.CLOSED), key=Replica.load
+        )
+        candidates = probes[:1] + closed
+        owner = self._affinity.get(task_id) if task_id is not None else None
+        if owner is not None and owner in candidates:
+            # the other replicas never saw the task, they are only asked while the owner's circuit is open
+            return [owner]
+        return candidates
+
+    def _remember(self, task_id: str, replica: Replica) -> None:
+        self._affinity[task_id] = replica
+        self._affinity.move_to_end(task_id)
+        while len(self._affinity) > self.affinity_size:
+            self._affinity.popitem(last=False)
+
+    def _record(self, replica: Replica, status: int, elapsed: float) -> None:
+        if status in UNAVAILABLE_STATUSES or status < 0 or status >= 500:
+            replica.failures += 1
+            if replica.state == CircuitState.HALF_OPEN or replica.failures >= self.failure_threshold:
+                if replica.state != CircuitState.OPEN:
+                    logger.warning(f"Circuit of {self.name} replica {replica.url} is open")
+                replica.state = CircuitState.OPEN
+                replica.opened_at = time.monotonic()
+                replica_circuit_open.set(1, pool=self.name, replica=replica.url)
+            return
+        if replica.state != CircuitState.CLOSED:
+            logger.info(f"Circuit of {self.name} replica {replica.url} is closed")
+            replica_circuit_open.set(0, pool=self.name, replica=replica.url)
+        replica.failures = 0
+        replica.state = CircuitState.CLOSED
+        if replica.latency == 0.0:
+            replica.latency = elapsed
+        else:
+            replica.latency += self.latency_smoothing * (elapsed - replica.latency)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[Dict] = None,
+        data: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[bool, Dict]:
+        match = TASK_PATH.match(path)
+        task_id = match.group(1) if match else None
+        idempotent = method == "GET"
+        candidates = self.candidates(task_id)
+        if not candidates:
+            return False, f"No {self.name} replica is available"
+        status, res = CONNECT_FAILED, ""
+        for attempt, replica in enumerate(candidates):
+            if attempt > 0:
+                replica_retries_total.inc(pool=self.name)
+            probing = replica.state == CircuitState.OPEN
+            if probing:
+                replica.state = CircuitState.HALF_OPEN
+            replica.outstanding += 1
+            replica_outstanding.set(replica.outstanding, pool=self.name, replica=replica.url)
+            started_at = time.monotonic()
+            recorded = False
+            try:
+                status, res = await http_client.send(
+                    method, f"{replica.url}{path}", headers=headers, data=data, timeout=timeout
+                )
+                self._record(replica, status, time.monotonic() - started_at)
+                recorded = True
+            finally:
+                replica.outstanding -= 1
+                replica_outstanding.set(replica.outstanding, pool=self.name, replica=replica.url)
+                if probing and not recorded:
+                    # a cancelled or crashed probe tells nothing, the replica waits for the next one
+                    replica.state = CircuitState.OPEN
+                    replica.opened_at = time.monotonic()
+            if status == 200:
+                if task_id is not None:
+                    self._remember(task_id, replica)
+                elif isinstance(res, dict) and "task_id" in res:
+                    self._remember(res["task_id"], replica)
+                return True, res
+            # a lookup can be answered by any replica, a submission only moves on if it never started
+            retryable = status in UNAVAILABLE_STATUSES or (
+                idempotent and (status < 0 or status >= 500 or status == 404)
+            )
+            if not retryable:
+                break
+        return False, res
+
+    def stats(self) -> List[Dict]:
+        return [
+            {
+                "url": replica.url,
+                "state": replica.state,
+                "outstanding": replica.outstanding,
+                "latency": round(replica.latency, 4),
+                "failures": replica.failures,
+            }
+            for replica in self.replicas
+        ]
+
+
+class EndpointRouter:
+    def __init__(self, pools: List[EndpointPool]) -> None:
+        self.pools = pools
+
+    def _pool_for(self, url: str) -> Optional[EndpointPool]:
+        for pool in self.pools:
+            if url.startswith(pool.primary_url) and url[len(pool.primary_url) : len(pool.primary_url) + 1] in "/?":
+                return pool
+        return None
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict] = None,
+        data: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[bool, Dict]:
+        pool = self._pool_for(url)
+        if pool is None:
+            return await http_client.request(method, url, headers=headers, data=data, timeout=timeout)
+        return await pool.request(method, url[len(pool.primary_url) :], headers=headers, data=data, timeout=timeout)
+
+    async def get(
+        self, url: str, headers: Optional[Dict] = None, timeout: Optional[float] = None
+    ) -> Tuple[bool, Dict]:
+        return await self.request("GET", url, headers=headers, timeout=timeout)
+
+    async def post(
+        self,
+        url: str,
+        data: Optional[str] = None,
+        headers: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[bool, Dict]:
+        return await self.request("POST", url, headers=headers, data=data, timeout=timeout)
+
+
+def _build_pool(name: str, primary_url: str, replicas: Optional[str]) -> EndpointPool:
+    return EndpointPool(
+        name=name,
+        urls=[primary_url] + _split_urls(replicas),
+        failure_threshold=endpoint_pool_settings.breaker_failure_threshold,
+        reset_timeout=endpoint_pool_settings.breaker_reset_timeout,
+        latency_smoothing=endpoint_pool_settings.replica_latency_smoothing,
+        affinity_size=endpoint_pool_settings.task_affinity_size,
+    )
+
+
+model_pool = _build_pool("model", str(model_settings.endpoint), endpoint_pool_settings.endpoint_replicas)
+upscale_pool = _build_pool(
+    "upscale", str(model_settings.upscale_endpoint), endpoint_pool_settings.upscale_endpoint_replicas
+)
+endpoint_router = EndpointRouter([model_pool, upscale_pool])
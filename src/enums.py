@@ -26,6 +26,10 @@ class ErrorTitle(StrEnum):
     INPUT_VALIDATION: str = "Input Validation Error"
     TIMEOUT: str = "TimeOut Error"
     WRONG_TASK_ID: str = "Wrong Task ID Error"
+    RATE_LIMIT: str = "Rate Limit Error"
+    QUEUE_FULL: str = "Queue Full Error"
+    REQUEST: str = "Request Error"
+    UPSCALE_REQUEST: str = "Upscale Request Error"
 
 
 class ModelEnum(StrEnum):
@@ -50,3 +54,25 @@ class SchedulerType(StrEnum):
     K_DPM_2_DISCRETE = "k_dpm_2_discrete"  # KDPM2DiscreteScheduler
     K_DPM_2_ANCESTRAL_DISCRETE = "k_dpm_2_ancestral_discrete"  # KDPM2AncestralDiscreteScheduler
     LMS_DISCRETE = "lms_discrete"  # LMSDiscreteScheduler
+
+
+class ComponentAction(StrEnum):
+    IMAGE: str = "image"
+    UPSCALE: str = "upscale"
+    REGENERATE: str = "regen"
+
+
+class LogFormat(StrEnum):
+    TEXT: str = "text"
+    JSON: str = "json"
+
+
+class CircuitState(StrEnum):
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half_open"
+
+
+class LeaseBackend(StrEnum):
+    MEMORY: str = "memory"
+    SQLITE: str = "sqlite"
@@ -0,0 +1,115 @@
+import random
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from enums import ResponseStatusEnum, SchedulerType
+from logs import get_logger
+from metrics import eta_seconds_per_unit
+from schemas import ImageGenerationParams
+from settings import estimator_settings, poller_settings
+
+
+logger = get_logger(__name__)
+
+# second order schedulers evaluate the model twice per step
+SCHEDULER_STEP_WEIGHT: Dict[SchedulerType, float] = {
+    SchedulerType.HEUN_DISCRETE: 2.0,
+    SchedulerType.K_DPM_2_DISCRETE: 2.0,
+    SchedulerType.K_DPM_2_ANCESTRAL_DISCRETE: 2.0,
+}
+BASE_PIXELS = 512 * 512
+
+
+class CompletionEstimator:
+    def __init__(self, seconds_per_unit: float, overhead: float, smoothing: float, history_size: int) -> None:
+        self.default_seconds_per_unit = seconds_per_unit
+        self.overhead = overhead
+        self.smoothing = smoothing
+        self.seconds_per_unit: Dict[str, float] = {}
+        # (model_id, scheduler_type, estimated seconds, actual seconds)
+        self.history: Deque[Tuple[str, str, float, float]] = deque(maxlen=history_size)
+
+    @staticmethod
+    def cost(params: ImageGenerationParams) -> float:
+        step_weight = SCHEDULER_STEP_WEIGHT.get(params.scheduler_type, 1.0)
+        return params.steps * step_weight * (params.width * params.height / BASE_PIXELS) * params.images
+
+    def is_calibrated(self, params: ImageGenerationParams) -> bool:
+        return params.model_id in self.seconds_per_unit
+
+    def estimate(self, params: ImageGenerationParams) -> float:
+        seconds_per_unit = self.seconds_per_unit.get(params.model_id, self.default_seconds_per_unit)
+        return self.overhead + self.cost(params) * seconds_per_unit
+
+    def observe(self, params: ImageGenerationParams, elapsed: float) -> None:
+        estimated = self.estimate(params)
+        self.history.append((params.model_id, params.scheduler_type, estimated, elapsed))
+        observed_seconds_per_unit = max(elapsed - self.overhead, 0.0) / self.cost(params)
+        prev_seconds_per_unit = self.seconds_per_unit.get(params.model_id)
+        if prev_seconds_per_unit is None:
+            # the default is only a guess, the first sample of a model replaces it
+            self.seconds_per_unit[params.model_id] = observed_seconds_per_unit
+        else:
+            self.seconds_per_unit[params.model_id] = (
+                1 - self.smoothing
+            ) * prev_seconds_per_unit + self.smoothing * observed_seconds_per_unit
+        eta_seconds_per_unit.set(self.seconds_per_unit[params.model_id], model_id=params.model_id)
+        logger.info(
+            f"ETA {params.model_id}/{params.scheduler_type} : estimated {estimated:.1f}s, actual {elapsed:.1f}s"
+        )
+
+    def snapshot(self) -> Dict:
+        errors = [abs(estimated - actual) for _, _, estimated, actual in self.history]
+        ratios = [actual / estimated for _, _, estimated, actual in self.history if estimated > 0]
+        return {
+            "seconds_per_unit": dict(self.seconds_per_unit),
+            "samples": len(self.history),
+            "mean_absolute_error": sum(errors) / len(errors) if errors else None,
+            "mean_actual_to_estimated": sum(ratios) / len(ratios) if ratios else None,
+        }
+
+
+class PollSchedule:
+    def __init__(
+        self, min_interval: float, max_interval: float, cold_max_interval: float, backoff_factor: float, jitter: float
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cold_max_interval = cold_max_interval
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_interval, self.min_interval * self.backoff_factor**attempts)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_delay(
+        self, status: Optional[str], attempts: int, running_for: float, eta: Optional[float], calibrated: bool = True
+    ) -> float:
+        if status == ResponseStatusEnum.ASSIGNED and eta is not None:
+            # poll rarely at first and converge on the expected finish time
+            remaining = eta - running_for
+            if remaining > 2 * self.min_interval:
+                delay = remaining / 2
+            else:
+                # past the estimate, back off in proportion to how late the task is
+                delay = max(self.min_interval, -remaining / 4)
+            # the default estimate may be far off, trust it only once the model has samples
+            return min(self.max_interval if calibrated else self.cold_max_interval, delay)
+        # waiting in the queue or no estimate available
+        return self._backoff(attempts)
+
+
+completion_estimator = CompletionEstimator(
+    seconds_per_unit=estimator_settings.eta_seconds_per_unit,
+    overhead=estimator_settings.eta_overhead,
+    smoothing=estimator_settings.eta_smoothing,
+    history_size=estimator_settings.eta_history_size,
+)
+poll_schedule = PollSchedule(
+    min_interval=poller_settings.poll_min_interval,
+    max_interval=poller_settings.poll_max_interval,
+    cold_max_interval=poller_settings.poll_cold_max_interval,
+    backoff_factor=poller_settings.poll_backoff_factor,
+    jitter=poller_settings.poll_jitter,
+)
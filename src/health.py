@@ -0,0 +1,59 @@
+import math
+import os
+import time
+from typing import Dict, Optional
+
+import discord
+from aiohttp import web
+
+from cache import task_cache
+from endpoint_pool import endpoint_router
+from estimator import completion_estimator
+from logs import get_logger
+from server import EmbeddedServer
+
+
+logger = get_logger(__name__)
+
+
+class HealthReporter:
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.client: Optional[discord.AutoShardedClient] = None
+
+    def register(self, server: EmbeddedServer, client: discord.AutoShardedClient) -> None:
+        self.client = client
+        server.add_route("GET", "/health", self.handle_health)
+        logger.info("Health report is enabled on /health")
+
+    def report(self) -> Dict:
+        shards = {}
+        for shard_id, shard in self.client.shards.items():
+            latency = shard.latency
+            shards[str(shard_id)] = {
+                "closed": shard.is_closed(),
+                "latency": None if math.isinf(latency) else round(latency, 4),
+            }
+        healthy = (
+            self.client.is_ready()
+            and not self.client.is_closed()
+            and not any(shard["closed"] for shard in shards.values())
+        )
+        return {
+            "status": "ok" if healthy else "unavailable",
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 1),
+            "shard_count": self.client.shard_count,
+            "shards": shards,
+            "guilds": len(self.client.guilds),
+            "endpoints": {pool.name: pool.stats() for pool in endpoint_router.pools},
+            "estimator": completion_estimator.snapshot(),
+            "cache": task_cache.stats(),
+        }
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        report = self.report()
+        return web.json_response(report, status=200 if report["status"] == "ok" else 503)
+
+
+health_reporter = HealthReporter()
@@ -0,0 +1,139 @@
+import asyncio
+import re
+import time
+from typing import Dict, Optional, Tuple
+from urllib import parse
+
+import aiohttp
+
+from logs import get_logger
+from metrics import endpoint_request_seconds
+from recorder import ENDPOINT, traffic_recorder
+from settings import http_client_settings
+
+
+logger = get_logger(__name__)
+
+# task ids in paths would make one metric series per task
+ID_SEGMENT = re.compile(r"/(tasks|result|callbacks)/[^/]+")
+# pseudo statuses of requests without an http response, nothing was sent when the connection failed
+CONNECT_FAILED = 0
+REQUEST_FAILED = -1
+
+
+class HTTPClient:
+    def __init__(
+        self,
+        request_timeout: float,
+        connect_timeout: float,
+        pool_size: int,
+        keepalive_timeout: float,
+    ) -> None:
+        self.timeout = aiohttp.ClientTimeout(total=request_timeout, connect=connect_timeout)
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        split_url = parse.urlsplit(url)
+        return f"{split_url.scheme}://{split_url.netloc}"
+
+    @staticmethod
+    def route(url: str) -> str:
+        return ID_SEGMENT.sub(r"/\1/{id}", parse.urlsplit(url).path)
+
+    def _get_session(self, url: str) -> aiohttp.ClientSession:
+        # one keep-alive pool per endpoint (model endpoint, upscale endpoint, ...)
+        origin = self._origin(url)
+        session = self._sessions.get(origin)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Accept-Encoding": "gzip, deflate"},
+            )
+            self._sessions[origin] = session
+        return session
+
+    async def send(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict] = None,
+        data: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[int, Dict]:
+        # returns the http status, CONNECT_FAILED or REQUEST_FAILED with the parsed body or an error message
+        session = self._get_session(url)
+        request_timeout = self.timeout if timeout is None else aiohttp.ClientTimeout(total=timeout)
+        started_at = time.perf_counter()
+        outcome = "error"
+        try:
+            async with session.request(method, url, headers=headers, data=data, timeout=request_timeout) as res:
+                outcome = "ok" if res.status == 200 else str(res.status)
+                if res.status == 200:
+                    return res.status, await res.json(content_type=None)
+                else:
+                    return res.status, await res.text()
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.error(f"Request Timeout : {method} {url}", extra={"sample_key": f"{method} {self.route(url)}"})
+            return REQUEST_FAILED, "Request Timeout"
+        except aiohttp.ClientError as client_error:
+            logger.error(
+                f"Request Failed : {method} {url} {client_error}", extra={"sample_key": f"{method} {self.route(url)}"}
+            )
+            if isinstance(client_error, aiohttp.ClientConnectorError):
+                outcome = "connect_error"
+                return CONNECT_FAILED, str(client_error)
+            return REQUEST_FAILED, str(client_error)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            endpoint_request_seconds.observe(elapsed, method=method, route=self.route(url), outcome=outcome)
+            traffic_recorder.record(ENDPOINT, m=method, r=self.route(url), o=outcome, d=round(elapsed, 4))
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict] = None,
+        data: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[bool, Dict]:
+        status, res = await self.send(method, url, headers=headers, data=data, timeout=timeout)
+        return status == 200, res
+
+    async def get(
+        self, url: str, headers: Optional[Dict] = None, timeout: Optional[float] = None
+    ) -> Tuple[bool, Dict]:
+        return await self.request("GET", url, headers=headers, timeout=timeout)
+
+    async def post(
+        self,
+        url: str,
+        data: Optional[str] = None,
+        headers: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[bool, Dict]:
+        return await self.request("POST", url, headers=headers, data=data, timeout=timeout)
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        logger.info(f"Closed {len(sessions)} http sessions")
+
+
+http_client = HTTPClient(
+    request_timeout=http_client_settings.request_timeout,
+    connect_timeout=http_client_settings.connect_timeout,
+    pool_size=http_client_settings.pool_size,
+    keepalive_timeout=http_client_settings.keepalive_timeout,
+)
@@ -0,0 +1,277 @@
+import abc
+import asyncio
+import sqlite3
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from enums import LeaseBackend
+from logs import get_logger
+from metrics import leases_held
+from settings import lease_settings
+from sqlite_store import SQLiteStore
+
+
+logger = get_logger(__name__)
+
+# sqlite limits the number of bound parameters per statement
+KEY_CHUNK_SIZE = 500
+
+
+def task_key(task_id: str, message_id: str) -> str:
+    # one lease per journaled message, identical requests may share a task id
+    return f"task:{task_id}:{message_id}"
+
+
+def interaction_key(interaction_id: int) -> str:
+    return f"interaction:{interaction_id}"
+
+
+class LeaseStore(abc.ABC):
+    # a lease is owned by one replica until it expires, renewing or re-acquiring it as the owner extends it
+    @abc.abstractmethod
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def renew(self, keys: List[str], owner: str, ttl: float) -> List[str]:
+        # returns the keys that are still owned
+        ...
+
+    @abc.abstractmethod
+    async def release(self, keys: List[str], owner: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def prune(self) -> int:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryLeaseStore(LeaseStore):
+    # replicas sharing this store have to live in one process, it stands in for a shared store in tests
+    def __init__(self) -> None:
+        self._leases: Dict[str, Tuple[str, float]] = {}
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        lease = self._leases.get(key)
+        if lease is not None and lease[0] != owner and lease[1] > now:
+            return False
+        self._leases[key] = (owner, now + ttl)
+        return True
+
+    async def renew(self, keys: List[str], owner: str, ttl: float) -> List[str]:
+        expires_at = time.time() + ttl
+        renewed = []
+        for key in keys:
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] == owner:
+                self._leases[key] = (owner, expires_at)
+                renewed.append(key)
+        return renewed
+
+    async def release(self, keys: List[str], owner: str) -> None:
+        for key in keys:
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] == owner:
+                del self._leases[key]
+
+    async def prune(self) -> int:
+        now = time.time()
+        expired = [key for key, (_, expires_at) in self._leases.items() if expires_at <= now]
+        for key in expired:
+            del self._leases[key]
+        return len(expired)
+
+
+class SQLiteLeaseStore(SQLiteStore, LeaseStore):
+    # every replica on the host opens the same file, sqlite serializes the writes between processes
+    def create_tables(self, connection: sqlite3.Connection) -> None:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self.connection() as connection:
+            cursor = connection.execute(
+                "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+                (key, owner, now + ttl, now),
+            )
+        return cursor.rowcount == 1
+
+    def _renew(self, keys: List[str], owner: str, ttl: float) -> List[str]:
+        renewed = []
+        with self.connection() as connection:
+            for i in range(0, len(keys), KEY_CHUNK_SIZE):
+                chunk = keys[i : i + KEY_CHUNK_SIZE]
+                placeholders = ", ".join("?" for _ in chunk)
+                connection.execute(
+                    f"UPDATE leases SET expires_at = ? WHERE owner = ? AND key IN ({placeholders})",
+                    [time.time() + ttl, owner] + chunk,
+                )
+                rows = connection.execute(
+                    f"SELECT key FROM leases WHERE owner = ? AND key IN ({placeholders})", [owner] + chunk
+                )
+                renewed.extend(key for key, in rows)
+        return renewed
+
+    def _release(self, keys: List[str], owner: str) -> None:
+        with self.connection() as connection:
+            for i in range(0, len(keys), KEY_CHUNK_SIZE):
+                chunk = keys[i : i + KEY_CHUNK_SIZE]
+                placeholders = ", ".join("?" for _ in chunk)
+                connection.execute(f"DELETE FROM leases WHERE owner = ? AND key IN ({placeholders})", [owner] + chunk)
+
+    def _prune(self) -> int:
+        with self.connection() as connection:
+            cursor = connection.execute("DELETE FROM leases WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        return await self.run(self._acquire, key, owner, ttl)
+
+    async def renew(self, keys: List[str], owner: str, ttl: float) -> List[str]:
+        return await self.run(self._renew, keys, owner, ttl)
+
+    async def release(self, keys: List[str], owner: str) -> None:
+        await self.run(self._release, keys, owner)
+
+    async def prune(self) -> int:
+        return await self.run(self._prune)
+
+
+class LeaseCoordinator:
+    def __init__(
+        self,
+        store: LeaseStore,
+        owner: str,
+        enabled: bool,
+        ttl: float,
+        heartbeat_interval: float,
+        takeover_interval: float,
+        interaction_ttl: float,
+    ) -> None:
+        self.store = store
+        self.owner = owner
+        self.enabled = enabled
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.takeover_interval = takeover_interval
+        self.interaction_ttl = interaction_ttl
+        # several waits of this replica may share a task, the lease is released after the last one
+        self._held: Counter = Counter()
+        self._holders: Dict[str, Set[asyncio.Future]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._takeovers: Set[asyncio.Task] = set()
+        self.lost = 0
+
+    def holds(self, key: str) -> bool:
+        return key in self._held
+
+    async def claim(self, key: str, holder: Optional[asyncio.Future] = None) -> bool:
+        # the holder, the current task by default, is cancelled when the lease is lost
+        if key not in self._held and self.enabled and not await self.store.acquire(key, self.owner, self.ttl):
+            return False
+        self._held[key] += 1
+        task = holder or asyncio.current_task()
+        if task is not None:
+            self._holders.setdefault(key, set()).add(task)
+        leases_held.set(len(self._held))
+        return True
+
+    async def release(self, key: str) -> None:
+        if key not in self._held:
+            return
+        task = asyncio.current_task()
+        if task is not None and key in self._holders:
+            self._holders[key].discard(task)
+        self._held[key] -= 1
+        if self._held[key] > 0:
+            return
+        del self._held[key]
+        self._holders.pop(key, None)
+        leases_held.set(len(self._held))
+        if self.enabled:
+            await self.store.release([key], self.owner)
+
+    async def claim_interaction(self, interaction_id: int) -> bool:
+        # every replica connected to a shard receives its interactions, only the first claim answers
+        if not self.enabled:
+            return True
+        return await self.store.acquire(interaction_key(interaction_id), self.owner, self.interaction_ttl)
+
+    def start(self, takeover: Callable[[], Awaitable[None]]) -> None:
+        if not self.enabled or self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._heartbeat()), asyncio.create_task(self._take_over(takeover))]
+        logger.info(f"Lease coordination is enabled as {self.owner}")
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                keys = list(self._held)
+                renewed = set(await self.store.renew(keys, self.owner, self.ttl)) if keys else set()
+                for key in keys:
+                    if key not in renewed and key in self._held:
+                        self._lose(key)
+                await self.store.prune()
+            except Exception as unknown_error:
+                logger.error(f"Lease Heartbeat Failed : {unknown_error}", extra={"sample_key": "lease_heartbeat"})
+
+    def _lose(self, key: str) -> None:
+        # another replica took the lease over while this one stalled, so it stops updating the task
+        self.lost += 1
+        logger.warning(f"Lost lease {key}")
+        del self._held[key]
+        for task in self._holders.pop(key, set()):
+            task.cancel()
+        leases_held.set(len(self._held))
+
+    async def _take_over(self, takeover: Callable[[], Awaitable[None]]) -> None:
+        while True:
+            await asyncio.sleep(self.takeover_interval)
+            # a pass waits for the tasks it resumed, so passes run side by side
+            task = asyncio.create_task(takeover())
+            self._takeovers.add(task)
+            task.add_done_callback(self._takeovers.discard)
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "owner": self.owner, "held": len(self._held), "lost": self.lost}
+
+    async def close(self) -> None:
+        for task in self._tasks + list(self._takeovers):
+            task.cancel()
+        self._tasks = []
+        if self.enabled and self._held:
+            # hand the tasks over right away instead of after the leases expire
+            await self.store.release(list(self._held), self.owner)
+        self._held.clear()
+        self._holders.clear()
+        self.store.close()
+
+
+def build_lease_store(backend: LeaseBackend, path: Optional[str], enabled: bool) -> LeaseStore:
+    if backend == LeaseBackend.SQLITE:
+        return SQLiteLeaseStore(db_path=path)
+    if enabled:
+        # replicas are separate processes, a memory store would let each of them own every lease
+        raise ValueError("LEASE_BACKEND=memory cannot coordinate replicas, use sqlite with LEASE_ENABLED")
+    return MemoryLeaseStore()
+
+
+lease_coordinator = LeaseCoordinator(
+    store=build_lease_store(lease_settings.lease_backend, lease_settings.lease_path, lease_settings.lease_enabled),
+    owner=lease_settings.replica_id,
+    enabled=lease_settings.lease_enabled,
+    ttl=lease_settings.lease_ttl,
+    heartbeat_interval=lease_settings.lease_heartbeat_interval,
+    takeover_interval=lease_settings.lease_takeover_interval,
+    interaction_ttl=lease_settings.lease_interaction_ttl,
+)
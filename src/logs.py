@@ -0,0 +1,133 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from enums import LogFormat
+from settings import logging_settings
+
+
+CONTEXT_FIELDS = ("task_id", "user_id", "guild_id", "command")
+TEXT_FORMAT = "[{asctime}] [{levelname:<8}] {name}: {message}"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_log_context: contextvars.ContextVar = contextvars.ContextVar("log_context", default={})
+_configure_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def bind_log_context(**fields: object) -> None:
+    # every record logged afterwards by the current task carries these fields
+    _log_context.set({**_log_context.get(), **{name: str(value) for name, value in fields.items()}})
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in _log_context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    # records logged with extra={"sample_key": ...} pass at most once per interval and key
+    def __init__(self, interval: float, max_keys: int = 10000) -> None:
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._last_passed_at: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample_key", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        if now - self._last_passed_at.get(key, -self.interval) < self.interval:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+        if len(self._last_passed_at) >= self.max_keys and key not in self._last_passed_at:
+            self._last_passed_at.clear()
+        self._last_passed_at[key] = now
+        record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # logging must never block the event loop, so a full queue drops the record
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__(TEXT_FORMAT, DATE_FORMAT, style="{")
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" ({suppressed} similar records suppressed)"
+        return message
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                payload[name] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            payload["suppressed"] = suppressed
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging() -> None:
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        stream_handler = logging.StreamHandler(sys.stderr)
+        if logging_settings.log_format == LogFormat.JSON:
+            stream_handler.setFormatter(JSONFormatter())
+        else:
+            stream_handler.setFormatter(TextFormatter())
+        # records are formatted and written by the listener thread, off the event loop
+        queue_handler = DroppingQueueHandler(queue.Queue(maxsize=logging_settings.log_queue_size))
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(SamplingFilter(logging_settings.log_sample_interval))
+        root_logger = logging.getLogger()
+        root_logger.addHandler(queue_handler)
+        root_logger.setLevel(logging.WARNING)
+        _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    configure_logging()
+    logger = logging.getLogger(name)
+    logger.setLevel(logging_settings.log_level)
+    return logger
@@ -0,0 +1,163 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import discord
+
+from admission import TokenBucket
+from logs import get_logger
+from metrics import discord_edit_seconds, edit_requests_total
+from settings import message_editor_settings
+
+
+logger = get_logger(__name__)
+
+EditFunction = Callable[..., Awaitable[Any]]
+
+
+class _PendingEdit:
+    def __init__(self, edit: EditFunction, kwargs: Dict, due_at: float) -> None:
+        self.edit = edit
+        self.kwargs = kwargs
+        self.due_at = due_at
+        self.futures: List[asyncio.Future] = []
+
+
+class MessageEditor:
+    def __init__(
+        self,
+        merge_window: float,
+        message_interval: float,
+        global_rate: float,
+        global_burst: float,
+        max_tracked_messages: int = 10000,
+    ) -> None:
+        self.merge_window = merge_window
+        self.message_interval = message_interval
+        self.max_tracked_messages = max_tracked_messages
+        self._bucket = TokenBucket(global_rate, global_burst)
+        # only the latest desired state of each message is kept
+        self._pending: Dict[str, _PendingEdit] = {}
+        self._sending: Dict[str, asyncio.Task] = {}
+        self._last_sent_at: OrderedDict = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.requested = 0
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+
+    async def edit(self, key: str, edit: EditFunction, wait: bool = True, **kwargs) -> None:
+        # intermediate updates pass wait=False and return at once, so a newer state can replace them
+        loop = asyncio.get_running_loop()
+        self.requested += 1
+        # an edit in flight counts as sent now
+        last_sent_at = loop.time() if key in self._sending else self._last_sent_at.get(key)
+        if last_sent_at is not None:
+            due_at = last_sent_at + self.message_interval
+            if not wait:
+                due_at = max(due_at, loop.time() + self.merge_window)
+        else:
+            # nothing to merge with yet, the first edit of a message goes out right away
+            due_at = loop.time()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = _PendingEdit(edit=edit, kwargs=dict(kwargs), due_at=due_at)
+            self._pending[key] = pending
+            edit_requests_total.inc(outcome="queued")
+        else:
+            if set(kwargs) >= set(pending.kwargs):
+                self.dropped += 1
+                edit_requests_total.inc(outcome="dropped")
+            else:
+                self.merged += 1
+                edit_requests_total.inc(outcome="merged")
+            pending.edit = edit
+            pending.kwargs.update(kwargs)
+            pending.due_at = min(pending.due_at, due_at)
+        self._ensure_running()
+        if not wait:
+            return
+        future = loop.create_future()
+        pending.futures.append(future)
+        await future
+
+    async def edit_original_response(self, interaction: discord.Interaction, wait: bool = True, **kwargs) -> None:
+        await self.edit(f"interaction:{interaction.id}", interaction.edit_original_response, wait=wait, **kwargs)
+
+    async def edit_message(self, message: discord.PartialMessage, wait: bool = True, **kwargs) -> None:
+        await self.edit(f"message:{message.id}", message.edit, wait=wait, **kwargs)
+
+    def _ensure_running(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            # a message is edited by one request at a time so edits land in order
+            ready = [(pending.due_at, key) for key, pending in self._pending.items() if key not in self._sending]
+            delay = None
+            if ready:
+                due_at, key = min(ready)
+                delay = max(due_at - loop.time(), self._bucket.retry_after())
+                if delay <= 0:
+                    self._bucket.consume()
+                    self._sending[key] = asyncio.create_task(self._send(key, self._pending.pop(key)))
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self._task = None
+
+    async def _send(self, key: str, pending: _PendingEdit) -> None:
+        started_at = asyncio.get_running_loop().time()
+        try:
+            await pending.edit(**pending.kwargs)
+        except Exception as error:
+            discord_edit_seconds.observe(asyncio.get_running_loop().time() - started_at, outcome="error")
+            self.failed += 1
+            logger.error(f"Failed To Edit Message {key} : {error}")
+            for future in pending.futures:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            discord_edit_seconds.observe(asyncio.get_running_loop().time() - started_at, outcome="ok")
+            self.sent += 1
+            for future in pending.futures:
+                if not future.done():
+                    future.set_result(None)
+        finally:
+            del self._sending[key]
+            self._last_sent_at[key] = asyncio.get_running_loop().time()
+            self._last_sent_at.move_to_end(key)
+            while len(self._last_sent_at) > self.max_tracked_messages:
+                self._last_sent_at.popitem(last=False)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def stats(self) -> Dict:
+        return {
+            "pending": len(self._pending),
+            "sending": len(self._sending),
+            "requested": self.requested,
+            "sent": self.sent,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+message_editor = MessageEditor(
+    merge_window=message_editor_settings.edit_merge_window,
+    message_interval=message_editor_settings.edit_message_interval,
+    global_rate=message_editor_settings.edit_global_rate,
+    global_burst=message_editor_settings.edit_global_burst,
+)
@@ -0,0 +1,252 @@
+import abc
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from logs import get_logger
+from server import EmbeddedServer
+
+
+logger = get_logger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TIME_TO_RESULT_BUCKETS = (5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0, 300.0, 600.0)
+POLL_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def _label_values(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels: object) -> float:
+        return self._values.get(self._label_values(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: object) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: object) -> None:
+        self._values[self._label_values(labels)] = value
+
+    @contextmanager
+    def track(self, **labels: object) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: bucket counts (the last one is +Inf), sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._label_values(labels)
+        if key not in self._values:
+            self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self._values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names + ("le",), key + (_format_value(upper_bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, documentation, label_names, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+    def register(self, server: EmbeddedServer) -> None:
+        server.add_route("GET", "/metrics", self.handle_metrics)
+        logger.info("Metrics are exposed on /metrics")
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+metrics_registry = MetricsRegistry()
+
+endpoint_request_seconds = metrics_registry.histogram(
+    "tti_endpoint_request_seconds",
+    "Latency of requests to the model and upscale endpoints",
+    ("method", "route", "outcome"),
+)
+polls_total = metrics_registry.counter("tti_polls_total", "Status lookups sent by the task poller", ("route",))
+polls_per_task = metrics_registry.histogram(
+    "tti_polls_per_task", "Status lookups needed until a task finished", ("route",), buckets=POLL_COUNT_BUCKETS
+)
+waits_in_flight = metrics_registry.gauge("tti_waits_in_flight", "Tasks currently being waited for", ("kind",))
+time_to_result_seconds = metrics_registry.histogram(
+    "tti_time_to_result_seconds",
+    "Seconds from a /generate request until its images are shown",
+    ("model_id", "scheduler_type"),
+    buckets=TIME_TO_RESULT_BUCKETS,
+)
+discord_edit_seconds = metrics_registry.histogram(
+    "tti_discord_edit_seconds", "Latency of Discord message edits", ("outcome",)
+)
+eta_seconds_per_unit = metrics_registry.gauge(
+    "tti_eta_seconds_per_unit", "Learned seconds per 512x512 image step used for completion estimates", ("model_id",)
+)
+cache_lookups_total = metrics_registry.counter(
+    "tti_cache_lookups_total", "Task result and params cache lookups", ("outcome",)
+)
+cache_evictions_total = metrics_registry.counter(
+    "tti_cache_evictions_total", "Cache entries evicted to stay within the size limits"
+)
+cache_entries = metrics_registry.gauge("tti_cache_entries", "Entries in the task result and params cache")
+cache_bytes = metrics_registry.gauge("tti_cache_bytes", "Serialized size of the task result and params cache")
+singleflight_calls_total = metrics_registry.counter(
+    "tti_singleflight_calls_total", "Endpoint GETs by whether they were sent or joined an identical one", ("outcome",)
+)
+dedupe_lookups_total = metrics_registry.counter(
+    "tti_dedupe_lookups_total",
+    "Generation submissions by whether they reused a task, attached to one or were sent",
+    ("outcome",),
+)
+edit_requests_total = metrics_registry.counter(
+    "tti_edit_requests_total",
+    "Discord message edit requests by whether they were queued or merged into or replaced a pending edit",
+    ("outcome",),
+)
+errors_total = metrics_registry.counter("tti_errors_total", "Error messages shown to users", ("title",))
+loop_lag_seconds = metrics_registry.histogram("tti_loop_lag_seconds", "Event loop scheduling lag")
+loop_stalls_total = metrics_registry.counter(
+    "tti_loop_stalls_total", "Event loop stalls longer than the watchdog threshold", ("command",)
+)
+replica_outstanding = metrics_registry.gauge(
+    "tti_replica_outstanding_requests", "Requests in flight per endpoint replica", ("pool", "replica")
+)
+replica_circuit_open = metrics_registry.gauge(
+    "tti_replica_circuit_open", "1 while a replica's circuit breaker is open", ("pool", "replica")
+)
+replica_retries_total = metrics_registry.counter(
+    "tti_replica_retries_total", "Requests retried on another replica", ("pool",)
+)
+tx_pending = metrics_registry.gauge("tti_tx_pending", "Tasks whose transaction hash is still being looked for")
+tx_reconciled_total = metrics_registry.counter(
+    "tti_tx_reconciled_total", "Tasks whose transaction hash lookup ended", ("outcome",)
+)
+leases_held = metrics_registry.gauge("tti_leases_held", "Task leases held by this replica")
+lease_takeovers_total = metrics_registry.counter(
+    "tti_lease_takeovers_total", "Unfinished tasks of stopped replicas this replica took over"
+)
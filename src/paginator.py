@@ -0,0 +1,50 @@
+from typing import List, Optional, Tuple
+
+import discord
+from discord.ui import Button, Item, View
+
+
+Page = Tuple[discord.Embed, List[Item]]
+
+
+class PaginatorView(View):
+    def __init__(self, pages: List[Page], timeout: Optional[float] = None) -> None:
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.index = 0
+        self.prev_button = Button(label="◀", style=discord.ButtonStyle.gray, row=4)
+        self.prev_button.callback = self._go_prev
+        self.page_button = Button(label="", style=discord.ButtonStyle.gray, disabled=True, row=4)
+        self.next_button = Button(label="▶", style=discord.ButtonStyle.gray, row=4)
+        self.next_button.callback = self._go_next
+        self._render()
+        if len(pages) <= 1:
+            # nothing to page through, the page's own components are dispatched by custom_id
+            self.stop()
+
+    @property
+    def embed(self) -> discord.Embed:
+        return self.pages[self.index][0]
+
+    def _render(self) -> None:
+        self.clear_items()
+        for item in self.pages[self.index][1]:
+            self.add_item(item)
+        if len(self.pages) > 1:
+            self.prev_button.disabled = self.index == 0
+            self.next_button.disabled = self.index == len(self.pages) - 1
+            self.page_button.label = f"{self.index + 1}/{len(self.pages)}"
+            self.add_item(self.prev_button)
+            self.add_item(self.page_button)
+            self.add_item(self.next_button)
+
+    async def _go(self, interaction: discord.Interaction, offset: int) -> None:
+        self.index = min(max(self.index + offset, 0), len(self.pages) - 1)
+        self._render()
+        await interaction.response.edit_message(embed=self.embed, view=self)
+
+    async def _go_prev(self, interaction: discord.Interaction) -> None:
+        await self._go(interaction, -1)
+
+    async def _go_next(self, interaction: discord.Interaction) -> None:
+        await self._go(interaction, 1)
@@ -0,0 +1,280 @@
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from endpoint_pool import endpoint_router
+from enums import ResponseStatusEnum
+from estimator import CompletionEstimator, PollSchedule, completion_estimator, poll_schedule
+from http_client import http_client
+from logs import get_logger
+from metrics import polls_per_task, polls_total
+from schemas import ImageGenerationParams
+from settings import poller_settings
+from singleflight import get_flight
+
+
+logger = get_logger(__name__)
+
+StatusCheck = Callable[[Dict], Optional[bool]]
+StatusListener = Callable[[str, str], Awaitable[None]]
+
+
+class _Waiter:
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+
+class _PollEntry:
+    def __init__(
+        self,
+        url: str,
+        check: StatusCheck,
+        task_id: Optional[str],
+        params: Optional[ImageGenerationParams],
+        push: bool,
+        now: float,
+    ) -> None:
+        self.url = url
+        self.check = check
+        self.task_id = task_id
+        self.params = params
+        self.push = push
+        self.status: Optional[str] = None
+        self.status_since = now
+        self.attempts = 0
+        self.polls = 0
+        self.route = http_client.route(url)
+        self.next_poll_at = now
+        self.waiters: List[_Waiter] = []
+
+
+class TaskPoller:
+    def __init__(
+        self,
+        schedule: PollSchedule,
+        estimator: CompletionEstimator,
+        concurrency: int,
+        bulk_status_url: Optional[str] = None,
+        bulk_batch_size: int = 100,
+        bulk_retry_interval: float = 5.0,
+        bulk_retry_max_interval: float = 300.0,
+        early_result_size: int = 1000,
+    ) -> None:
+        self.schedule = schedule
+        self.estimator = estimator
+        self.concurrency = concurrency
+        self.bulk_status_url = bulk_status_url
+        self.bulk_batch_size = bulk_batch_size
+        self.bulk_retry_interval = bulk_retry_interval
+        self.bulk_retry_max_interval = bulk_retry_max_interval
+        # a failed bulk request pauses bulk lookups with backoff instead of disabling them
+        self._bulk_failures = 0
+        self._bulk_retry_at = 0.0
+        self.early_result_size = early_result_size
+        # set when completion notifications are pushed, polling becomes a slow fallback
+        self.push_fallback_interval: Optional[float] = None
+        self._early_results: OrderedDict = OrderedDict()
+        self._entries: Dict[str, _PollEntry] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def wait(
+        self,
+        url: str,
+        timeout: float,
+        check: StatusCheck,
+        on_status_change: Optional[StatusListener] = None,
+        task_id: Optional[str] = None,
+        params: Optional[ImageGenerationParams] = None,
+        push: bool = False,
+    ) -> Tuple[bool, Dict]:
+        loop = asyncio.get_running_loop()
+        entry = self._entries.get(url)
+        if entry is None:
+            entry = _PollEntry(url=url, check=check, task_id=task_id, params=params, push=push, now=loop.time())
+            entry.next_poll_at = loop.time() + self._next_delay(entry)
+            self._entries[url] = entry
+        waiter = _Waiter()
+        entry.waiters.append(waiter)
+        early_result = self._early_results.pop(url, None)
+        if early_result is not None:
+            self._update(entry, early_result)
+        if self._entries.get(url) is entry:
+            self._ensure_running()
+
+        deadline = loop.time() + timeout
+        prev_status = entry.status or ResponseStatusEnum.PENDING
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False, {}
+                try:
+                    is_final, payload = await asyncio.wait_for(waiter.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    return False, {}
+                if is_final:
+                    return payload
+                if payload != prev_status and on_status_change is not None:
+                    await on_status_change(prev_status, payload)
+                prev_status = payload
+        finally:
+            if waiter in entry.waiters:
+                entry.waiters.remove(waiter)
+            if not entry.waiters and self._entries.get(url) is entry:
+                del self._entries[url]
+
+    def _ensure_running(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._entries:
+            now = loop.time()
+            due_entries = [entry for entry in self._entries.values() if entry.next_poll_at <= now]
+            if due_entries:
+                try:
+                    await self._poll(due_entries)
+                except Exception as unknown_error:
+                    logger.error(f"Poll Failed : {unknown_error}", extra={"sample_key": "poll"})
+                    for entry in due_entries:
+                        self._reschedule(entry)
+            if not self._entries:
+                break
+            next_poll_at = min(entry.next_poll_at for entry in self._entries.values())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, next_poll_at - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+        self._task = None
+
+    def _next_delay(self, entry: _PollEntry) -> float:
+        running_for = asyncio.get_running_loop().time() - entry.status_since
+        # estimated on every reschedule, other tasks may have calibrated the model since this one started
+        eta, calibrated = None, False
+        if entry.params is not None:
+            eta, calibrated = self.estimator.estimate(entry.params), self.estimator.is_calibrated(entry.params)
+        delay = self.schedule.next_delay(entry.status, entry.attempts, running_for, eta, calibrated)
+        if entry.push and self.push_fallback_interval is not None:
+            delay = max(delay, self.push_fallback_interval)
+        return delay
+
+    def _reschedule(self, entry: _PollEntry) -> None:
+        entry.attempts += 1
+        entry.next_poll_at = asyncio.get_running_loop().time() + self._next_delay(entry)
+
+    def push(self, url: str, res: Dict) -> bool:
+        entry = self._entries.get(url)
+        if entry is None:
+            # the notification may arrive before anyone waits for the task
+            self._early_results[url] = res
+            self._early_results.move_to_end(url)
+            while len(self._early_results) > self.early_result_size:
+                self._early_results.popitem(last=False)
+            return False
+        self._update(entry, res)
+        return True
+
+    async def _poll(self, entries: List[_PollEntry]) -> None:
+        if self.bulk_status_url is not None and asyncio.get_running_loop().time() >= self._bulk_retry_at:
+            bulk_entries = [entry for entry in entries if entry.task_id is not None]
+            entries = [entry for entry in entries if entry.task_id is None]
+            for i in range(0, len(bulk_entries), self.bulk_batch_size):
+                entries.extend(await self._poll_bulk(bulk_entries[i : i + self.bulk_batch_size]))
+        if entries:
+            await asyncio.gather(*[self._poll_single(entry) for entry in entries])
+
+    async def _poll_bulk(self, entries: List[_PollEntry]) -> List[_PollEntry]:
+        # returns the entries that still need a single lookup
+        is_success, res = await http_client.post(
+            self.bulk_status_url,
+            headers={"Content-Type": "application/json", "accept": "application/json"},
+            data=json.dumps({"task_ids": [entry.task_id for entry in entries]}),
+        )
+        if not is_success or not isinstance(res, dict):
+            pause = min(self.bulk_retry_interval * 2**self._bulk_failures, self.bulk_retry_max_interval)
+            self._bulk_failures += 1
+            self._bulk_retry_at = asyncio.get_running_loop().time() + pause
+            logger.warning(f"Bulk status lookup failed, using single lookups for {pause:.0f}s : {res}")
+            return entries
+        self._bulk_failures = 0
+        missing = []
+        for entry in entries:
+            self._count_poll(entry)
+            if entry.task_id in res:
+                self._update(entry, res[entry.task_id])
+            else:
+                missing.append(entry)
+        return missing
+
+    async def _poll_single(self, entry: _PollEntry) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._count_poll(entry)
+        async with self._semaphore:
+            is_success, res = await get_flight.do(
+                entry.url, lambda: endpoint_router.get(entry.url, headers={"accept": "application/json"})
+            )
+        if not is_success:
+            logger.error(f"Failed To Get Req : {res}", extra={"task_id": entry.task_id, "sample_key": entry.route})
+            self._reschedule(entry)
+            return
+        self._update(entry, res)
+
+    @staticmethod
+    def _count_poll(entry: _PollEntry) -> None:
+        entry.polls += 1
+        polls_total.inc(route=entry.route)
+
+    def _update(self, entry: _PollEntry, res: Dict) -> None:
+        result = entry.check(res)
+        if result is not None:
+            if self._entries.get(entry.url) is entry:
+                del self._entries[entry.url]
+                polls_per_task.observe(entry.polls, route=entry.route)
+            if result and entry.params is not None and entry.status == ResponseStatusEnum.ASSIGNED:
+                # only the time since assignment depends on the params, not the time spent in the queue
+                running_for = asyncio.get_running_loop().time() - entry.status_since
+                self.estimator.observe(entry.params, running_for)
+            for waiter in entry.waiters:
+                waiter.queue.put_nowait((True, (result, res)))
+            return
+        status = res["status"]
+        if status != entry.status:
+            entry.status = status
+            entry.status_since = asyncio.get_running_loop().time()
+            entry.attempts = 0
+            for waiter in entry.waiters:
+                waiter.queue.put_nowait((False, status))
+        self._reschedule(entry)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._entries.clear()
+        self._early_results.clear()
+
+
+task_poller = TaskPoller(
+    schedule=poll_schedule,
+    estimator=completion_estimator,
+    concurrency=poller_settings.poll_concurrency,
+    bulk_status_url=poller_settings.bulk_status_url,
+    bulk_batch_size=poller_settings.bulk_batch_size,
+    bulk_retry_interval=poller_settings.bulk_retry_interval,
+    bulk_retry_max_interval=poller_settings.bulk_retry_max_interval,
+)
@@ -0,0 +1,131 @@
+import atexit
+import gzip
+import hashlib
+import json
+import queue
+import threading
+import time
+from typing import IO, Dict, Optional
+
+import discord
+
+from logs import get_logger
+from schemas import ImageGenerationParams
+from settings import recorder_settings
+
+
+logger = get_logger(__name__)
+
+# record kinds, every record also carries "t" (unix time) and "k" (kind)
+GENERATE = "generate"
+RESULT = "result"
+PARAMS = "params"
+BUTTON = "button"
+TASK = "task"
+STATUS = "status"
+ENDPOINT = "endpoint"
+
+# fields holding ids are replaced by their hashes before they are written
+ANONYMIZED_FIELDS = ("i", "u", "g", "task", "tasks")
+
+_STOP = object()
+
+
+class TrafficRecorder:
+    # appends one compact json line per event, written by a thread so recording never blocks the event loop
+    def __init__(self, path: Optional[str], salt: str, queue_size: int, flush_interval: float) -> None:
+        self.path = path
+        self.salt = salt
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def anonymize(self, value: object) -> str:
+        # stable within one salt, so records of the same user, guild or task can still be linked
+        return hashlib.sha256(f"{self.salt}:{value}".encode()).hexdigest()[:16]
+
+    def anonymize_params(self, params: ImageGenerationParams) -> Dict:
+        data = params.dict()
+        data["prompt"] = self.anonymize(params.prompt)
+        if params.negative_prompt:
+            data["negative_prompt"] = self.anonymize(params.negative_prompt)
+        return data
+
+    def record(self, kind: str, **fields: object) -> None:
+        if not self.enabled:
+            return
+        for name in ANONYMIZED_FIELDS:
+            if isinstance(fields.get(name), list):
+                fields[name] = [self.anonymize(value) for value in fields[name]]
+            elif name in fields:
+                fields[name] = self.anonymize(fields[name])
+        if isinstance(fields.get("p"), ImageGenerationParams):
+            fields["p"] = self.anonymize_params(fields["p"])
+        self._ensure_running()
+        line = json.dumps({"t": round(time.time(), 3), "k": kind, **fields}, separators=(",", ":"))
+        try:
+            self._queue.put_nowait(line)
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def record_interaction(self, kind: str, interaction: discord.Interaction, **fields: object) -> None:
+        guild_id = interaction.guild.id if interaction.guild is not None else None
+        self.record(kind, i=interaction.id, u=interaction.user.id, g=guild_id, **fields)
+
+    def _ensure_running(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write, name="traffic-recorder", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+                logger.info(f"Recording traffic to {self.path}")
+
+    def _open(self) -> IO[str]:
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, "at")
+        return open(self.path, "a")
+
+    def _write(self) -> None:
+        with self._open() as trace_file:
+            flushed_at = time.monotonic()
+            while True:
+                try:
+                    line = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    line = None
+                if line is _STOP:
+                    break
+                if line is not None:
+                    trace_file.write(line + "\n")
+                if time.monotonic() - flushed_at >= self.flush_interval:
+                    trace_file.flush()
+                    flushed_at = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join()
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "recorded": self.recorded, "dropped": self.dropped}
+
+
+traffic_recorder = TrafficRecorder(
+    path=recorder_settings.record_path,
+    salt=recorder_settings.record_salt,
+    queue_size=recorder_settings.record_queue_size,
+    flush_interval=recorder_settings.record_flush_interval,
+)
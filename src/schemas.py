@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -57,3 +57,15 @@ class ImageGenerationParams(BaseModel):
 class ImageGenerationRequest(BaseModel):
     discord: ImageGenerationDiscordParams
     params: ImageGenerationParams
+    callback_url: Optional[str] = Field(
+        None,
+        description="Base url the model server notifies at /tasks/{task_id}/images and /tasks/{task_id}/tx-hash.",
+    )
+
+
+class TaskRecord(BaseModel):
+    task_id: str
+    discord: ImageGenerationDiscordParams
+    params: ImageGenerationParams
+    warnings: List[str] = Field([], description="Warnings shown with the result.")
+    status: str
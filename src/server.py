@@ -0,0 +1,38 @@
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from logs import get_logger
+from settings import server_settings
+
+
+logger = get_logger(__name__)
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+class EmbeddedServer:
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.app = web.Application()
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_route(self, method: str, path: str, handler: Handler) -> None:
+        self.app.router.add_route(method, path, handler)
+
+    async def start(self) -> None:
+        if self._runner is not None or not len(self.app.router.routes()):
+            return
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Embedded server is listening on {self.host}:{self.port}")
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+embedded_server = EmbeddedServer(host=server_settings.server_host, port=server_settings.server_port)
@@ -1,6 +1,11 @@
+import os
+import secrets
+import socket
+from typing import Optional
+
 from pydantic import BaseSettings, Field, HttpUrl
 
-from enums import EnvEnum
+from enums import EnvEnum, LeaseBackend, LogFormat
 
 
 class DiscordBotSettings(BaseSettings):
@@ -18,5 +23,199 @@ class ModelSettings(BaseSettings):
     image_unit_size: int = 64
 
 
+class HTTPClientSettings(BaseSettings):
+    request_timeout: float = Field(10.0, description="Total timeout in seconds for a single endpoint request")
+    connect_timeout: float = Field(3.0, description="Timeout in seconds for opening a new connection")
+    pool_size: int = Field(100, description="Maximum number of pooled connections per endpoint")
+    keepalive_timeout: float = Field(30.0, description="Seconds an idle pooled connection is kept open")
+
+
+class PollerSettings(BaseSettings):
+    poll_interval: float = Field(1.0, description="Seconds per polling step when turning step counts into timeouts")
+    poll_min_interval: float = Field(0.5, description="Shortest delay between two polls of the same task")
+    poll_max_interval: float = Field(5.0, description="Longest delay between two polls of the same task")
+    poll_cold_max_interval: float = Field(
+        1.5, description="Longest delay between polls of an assigned task while its model has no ETA samples"
+    )
+    poll_backoff_factor: float = Field(1.5, description="Backoff multiplier while a task is waiting in the queue")
+    poll_jitter: float = Field(0.2, description="Relative random jitter applied to backoff delays")
+    poll_concurrency: int = Field(16, description="Maximum number of concurrent single task lookups")
+    bulk_status_url: Optional[HttpUrl] = Field(None, description="Endpoint returning the status of many tasks at once")
+    bulk_batch_size: int = Field(100, description="Maximum number of task ids per bulk status request")
+    bulk_retry_interval: float = Field(5.0, description="Seconds of single lookups after a failed bulk request")
+    bulk_retry_max_interval: float = Field(300.0, description="Longest pause of bulk lookups after repeated failures")
+
+
+class EstimatorSettings(BaseSettings):
+    eta_seconds_per_unit: float = Field(0.05, description="Initial seconds per 512x512 image step")
+    eta_overhead: float = Field(2.0, description="Fixed seconds added to every estimate")
+    eta_smoothing: float = Field(0.2, description="Weight of a new observation in the moving average")
+    eta_history_size: int = Field(200, description="Number of recent estimate/actual pairs kept for inspection")
+
+
+class ServerSettings(BaseSettings):
+    server_host: str = Field("0.0.0.0", description="Host the embedded http server binds to")
+    server_port: int = Field(8080, description="Port the embedded http server listens on")
+    health_enabled: bool = Field(False, description="Serve the process health report on /health")
+    metrics_enabled: bool = Field(False, description="Serve Prometheus metrics on /metrics")
+
+
+class WebhookSettings(BaseSettings):
+    webhook_enabled: bool = Field(False, description="Receive task notifications from the model server")
+    webhook_public_url: Optional[HttpUrl] = Field(None, description="Public url of the embedded http server")
+    webhook_token: str = Field(default_factory=lambda: secrets.token_urlsafe(16), description="Callback url secret")
+    webhook_fallback_interval: float = Field(15.0, description="Seconds between fallback polls of pushed tasks")
+
+
+class CacheSettings(BaseSettings):
+    cache_max_entries: int = Field(2048, description="Maximum number of cached task lookups")
+    cache_max_bytes: int = Field(32 * 1024 * 1024, description="Maximum size of the cached task lookups")
+    cache_completed_ttl: float = Field(24 * 60 * 60, description="Seconds a finished task lookup is cached")
+    cache_pending_ttl: float = Field(0, description="Seconds a pending or assigned task lookup is cached")
+
+
+class LookupSettings(BaseSettings):
+    lookup_max_task_ids: int = Field(25, description="Maximum number of task ids accepted by /result and /params")
+    lookup_concurrency: int = Field(8, description="Maximum number of concurrent task lookups per command")
+    lookup_page_timeout: float = Field(15 * 60, description="Seconds the page buttons of a multi task reply work")
+
+
+class DedupeSettings(BaseSettings):
+    dedupe_enabled: bool = Field(True, description="Reuse tasks generated from identical params")
+    dedupe_max_entries: int = Field(10000, description="Maximum number of params kept in memory")
+    dedupe_db_path: Optional[str] = Field(None, description="SQLite file keeping completed params across restarts")
+
+
+class AdmissionSettings(BaseSettings):
+    admission_user_rate: float = Field(1 / 10, description="Generations per second refilled for each user")
+    admission_user_burst: float = Field(3, description="Generations a user can request back to back")
+    admission_guild_rate: float = Field(1, description="Generations per second refilled for each guild")
+    admission_guild_burst: float = Field(20, description="Generations a guild can request back to back")
+    admission_global_rate: float = Field(5, description="Generations per second refilled for the whole bot")
+    admission_global_burst: float = Field(50, description="Generations the whole bot can request back to back")
+    admission_max_in_flight: int = Field(64, description="Generations submitted to the model server at once")
+    admission_max_in_flight_cost: float = Field(
+        600.0, description="Estimated model server seconds of the generations submitted at once"
+    )
+    admission_max_queue: int = Field(200, description="Generations waiting locally for a free slot")
+    admission_max_buckets: int = Field(10000, description="Maximum number of user and guild buckets kept")
+
+
+class MessageEditorSettings(BaseSettings):
+    edit_merge_window: float = Field(0.25, description="Seconds an edit waits for newer updates of the same message")
+    edit_message_interval: float = Field(1.0, description="Minimum seconds between two edits of the same message")
+    edit_global_rate: float = Field(40, description="Message edits per second sent to Discord")
+    edit_global_burst: float = Field(40, description="Message edits sent to Discord back to back")
+
+
+class TaskStoreSettings(BaseSettings):
+    task_store_path: Optional[str] = Field("tasks.db", description="SQLite file journaling in-flight tasks")
+    task_store_retention: float = Field(30 * 24 * 60 * 60, description="Seconds finished tasks are kept")
+
+
+class ShardSettings(BaseSettings):
+    shard_count: Optional[int] = Field(None, description="Total number of gateway shards, recommended count if unset")
+    shard_ids: Optional[str] = Field(None, description="Comma separated shard ids run by this process, all if unset")
+    shard_workers: int = Field(1, description="Number of worker processes the supervisor spreads the shards over")
+    shard_restart_delay: float = Field(5.0, description="Seconds the supervisor waits before restarting a dead worker")
+    message_cache_size: int = Field(0, description="Messages kept in each process's message cache, 0 disables it")
+
+
+class CommandSyncSettings(BaseSettings):
+    command_sync_state_path: Optional[str] = Field(
+        "command_tree.fingerprint", description="File keeping the fingerprint of the last synced command tree"
+    )
+    command_sync_force: bool = Field(False, description="Sync the command tree even if its fingerprint is unchanged")
+
+
+class WatchdogSettings(BaseSettings):
+    watchdog_enabled: bool = Field(True, description="Measure event loop lag and capture the stack of long stalls")
+    watchdog_interval: float = Field(0.1, description="Seconds between two event loop heartbeats")
+    watchdog_threshold: float = Field(0.25, description="Seconds the loop has to be blocked to capture a stall")
+    watchdog_max_samples: int = Field(20, description="Number of worst stalls kept for inspection")
+    watchdog_stack_depth: int = Field(15, description="Innermost stack frames kept per stall")
+    watchdog_log_stalls: bool = Field(True, description="Log every captured stall with its stack")
+
+
+class LoggingSettings(BaseSettings):
+    log_level: str = Field("INFO", description="Level of the bot's loggers")
+    log_format: LogFormat = Field(LogFormat.TEXT, description="text for humans, json for log pipelines")
+    log_queue_size: int = Field(10000, description="Records buffered for the log writer thread before dropping")
+    log_sample_interval: float = Field(10.0, description="Seconds between two sampled records with the same key")
+
+
+class EndpointPoolSettings(BaseSettings):
+    endpoint_replicas: Optional[str] = Field(None, description="Comma separated replicas of ENDPOINT")
+    upscale_endpoint_replicas: Optional[str] = Field(None, description="Comma separated replicas of UPSCALE_ENDPOINT")
+    breaker_failure_threshold: int = Field(5, description="Consecutive failures that open a replica's circuit")
+    breaker_reset_timeout: float = Field(30.0, description="Seconds an open circuit waits before a probe request")
+    replica_latency_smoothing: float = Field(0.2, description="Weight of the newest latency in a replica's average")
+    task_affinity_size: int = Field(100000, description="Task ids remembered with the replica that accepted them")
+
+
+class SweepSettings(BaseSettings):
+    sweep_max_jobs: int = Field(12, description="Maximum number of generations a single /sweep expands into")
+    sweep_concurrency: int = Field(4, description="Generations of one sweep submitted at the same time")
+
+
+class UpscaleSettings(BaseSettings):
+    upscale_max_per_user: int = Field(2, description="Upscales of different images a user can have running at once")
+    upscale_max_in_flight: int = Field(8, description="Upscales submitted to the upscale endpoint at once")
+
+
+class TxReconcilerSettings(BaseSettings):
+    # interaction tokens expire after 15 minutes, the last edit has to happen before that
+    tx_horizon: float = Field(840.0, description="Seconds a transaction hash is looked for after the images are shown")
+    tx_min_interval: float = Field(2.0, description="Delay before the first transaction hash lookup of a task")
+    tx_max_interval: float = Field(60.0, description="Longest delay between two transaction hash lookups of a task")
+    tx_backoff_factor: float = Field(1.5, description="Backoff multiplier between transaction hash lookups")
+    tx_batch_size: int = Field(50, description="Maximum number of transaction hash lookups sent at once")
+
+
+class RecorderSettings(BaseSettings):
+    record_path: Optional[str] = Field(None, description="Append anonymized traffic to this file, .gz is compressed")
+    record_salt: str = Field(
+        default_factory=lambda: secrets.token_hex(16), description="Salt of the hashes that replace ids and prompts"
+    )
+    record_queue_size: int = Field(10000, description="Records waiting for the writer thread before new ones drop")
+    record_flush_interval: float = Field(1.0, description="Seconds between flushes of the traffic file")
+
+
+class LeaseSettings(BaseSettings):
+    lease_enabled: bool = Field(False, description="Coordinate several bot replicas connected to the same shards")
+    lease_backend: LeaseBackend = Field(
+        LeaseBackend.SQLITE, description="Store shared by the replicas, memory is only allowed for tests"
+    )
+    lease_path: Optional[str] = Field("leases.db", description="SQLite file of the sqlite lease store")
+    replica_id: str = Field(
+        default_factory=lambda: f"{socket.gethostname()}-{os.getpid()}", description="Owner name of this replica"
+    )
+    lease_ttl: float = Field(30.0, description="Seconds a task lease lasts without a heartbeat")
+    lease_heartbeat_interval: float = Field(10.0, description="Seconds between renewals of the held task leases")
+    lease_takeover_interval: float = Field(15.0, description="Seconds between scans for tasks of dead replicas")
+    lease_interaction_ttl: float = Field(60.0, description="Seconds an answered interaction stays claimed")
+
+
 discord_bot_settings = DiscordBotSettings()
 model_settings = ModelSettings()
+http_client_settings = HTTPClientSettings()
+poller_settings = PollerSettings()
+estimator_settings = EstimatorSettings()
+server_settings = ServerSettings()
+webhook_settings = WebhookSettings()
+cache_settings = CacheSettings()
+lookup_settings = LookupSettings()
+dedupe_settings = DedupeSettings()
+admission_settings = AdmissionSettings()
+message_editor_settings = MessageEditorSettings()
+task_store_settings = TaskStoreSettings()
+shard_settings = ShardSettings()
+command_sync_settings = CommandSyncSettings()
+watchdog_settings = WatchdogSettings()
+logging_settings = LoggingSettings()
+endpoint_pool_settings = EndpointPoolSettings()
+sweep_settings = SweepSettings()
+upscale_settings = UpscaleSettings()
+tx_reconciler_settings = TxReconcilerSettings()
+recorder_settings = RecorderSettings()
+lease_settings = LeaseSettings()
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from metrics import singleflight_calls_total
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._tasks: Dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._tasks.get(key)
+        if task is None:
+            # run the call as its own task so a cancelled caller does not cancel the shared call
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done_task: self._forget(key, done_task))
+            singleflight_calls_total.inc(outcome="sent")
+        else:
+            self.coalesced += 1
+            singleflight_calls_total.inc(outcome="coalesced")
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._tasks),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+
+get_flight = SingleFlight()
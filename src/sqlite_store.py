@@ -0,0 +1,47 @@
+import abc
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class SQLiteStore(abc.ABC):
+    def __init__(self, db_path: Optional[str]) -> None:
+        self.db_path = db_path
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.db_path is not None
+
+    @abc.abstractmethod
+    def create_tables(self, connection: sqlite3.Connection) -> None:
+        ...
+
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            with self._connection:
+                self.create_tables(self._connection)
+        return self._connection
+
+    async def run(self, fn: Callable, *args) -> Any:
+        if not self.enabled:
+            return None
+        if self._executor is None:
+            # sqlite connections are bound to one thread, so every query runs on the same worker
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _close_connection(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.submit(self._close_connection)
+            self._executor.shutdown(wait=True)
+            self._executor = None
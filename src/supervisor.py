@@ -0,0 +1,150 @@
+import asyncio
+import math
+import os
+import signal
+import sys
+from typing import Dict, List, Optional, Tuple
+from urllib import parse
+
+from http_client import http_client
+from logs import get_logger
+from settings import discord_bot_settings, server_settings, shard_settings, webhook_settings
+
+
+logger = get_logger(__name__)
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord allows max_concurrency identifies per 5 seconds
+IDENTIFY_INTERVAL = 5.0
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+async def get_gateway_info() -> Tuple[int, int]:
+    is_success, res = await http_client.get(
+        GATEWAY_BOT_URL, headers={"Authorization": f"Bot {discord_bot_settings.bot_token}"}
+    )
+    await http_client.close()
+    if not is_success:
+        if shard_settings.shard_count is None:
+            raise RuntimeError(f"Cannot get the recommended shard count : {res}")
+        logger.warning(f"Cannot get the gateway info, start shards one at a time : {res}")
+        return shard_settings.shard_count, 1
+    shard_count = shard_settings.shard_count or res["shards"]
+    return shard_count, res["session_start_limit"]["max_concurrency"]
+
+
+def worker_public_url(public_url: str, index: int) -> Optional[str]:
+    # a worker's receiver listens on SERVER_PORT + index, its public url needs the same offset
+    split_url = parse.urlsplit(public_url)
+    if split_url.port is None:
+        return None
+    netloc = f"{split_url.hostname}:{split_url.port + index}"
+    return parse.urlunsplit(split_url._replace(netloc=netloc))
+
+
+def split_shards(shard_count: int, workers: int) -> List[List[int]]:
+    workers = max(1, min(workers, shard_count))
+    return [
+        list(range(index * shard_count // workers, (index + 1) * shard_count // workers)) for index in range(workers)
+    ]
+
+
+class ShardWorker:
+    def __init__(self, index: int, shard_ids: List[int], shard_count: int, restart_delay: float) -> None:
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.restart_delay = restart_delay
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+
+    def environ(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update(
+            SHARD_IDS=",".join(str(shard_id) for shard_id in self.shard_ids),
+            SHARD_COUNT=str(self.shard_count),
+            # every worker serves its own health report and webhook receiver
+            SERVER_PORT=str(server_settings.server_port + self.index),
+            HEALTH_ENABLED="true",
+        )
+        if webhook_settings.webhook_enabled and webhook_settings.webhook_public_url is not None:
+            public_url = worker_public_url(str(webhook_settings.webhook_public_url), self.index)
+            if public_url is None:
+                # callbacks of every worker would reach one process, polling is the only safe choice
+                env["WEBHOOK_ENABLED"] = "false"
+            else:
+                env["WEBHOOK_PUBLIC_URL"] = public_url
+        return env
+
+    async def run(self, stopping: asyncio.Event, start_delay: float) -> None:
+        delay = start_delay
+        while not await self._sleep(stopping, delay):
+            self.process = await asyncio.create_subprocess_exec(sys.executable, WORKER_SCRIPT, env=self.environ())
+            logger.info(
+                f"Worker {self.index} (pid: {self.process.pid}) runs shards {self.shard_ids}/{self.shard_count}"
+            )
+            return_code = await self.process.wait()
+            if stopping.is_set():
+                break
+            self.restarts += 1
+            delay = self.restart_delay
+            logger.error(f"Worker {self.index} exited with {return_code}, restart in {delay}s")
+        logger.info(f"Worker {self.index} stopped")
+
+    @staticmethod
+    async def _sleep(stopping: asyncio.Event, delay: float) -> bool:
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        return stopping.is_set()
+
+    def terminate(self) -> None:
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+
+class ShardSupervisor:
+    def __init__(self, workers: int, restart_delay: float) -> None:
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.shard_workers: List[ShardWorker] = []
+        # created in run, an event made before asyncio.run is bound to another loop on python < 3.10
+        self.stopping: Optional[asyncio.Event] = None
+
+    async def run(self) -> None:
+        self.stopping = asyncio.Event()
+        shard_count, max_concurrency = await get_gateway_info()
+        self.shard_workers = [
+            ShardWorker(index, shard_ids, shard_count, self.restart_delay)
+            for index, shard_ids in enumerate(split_shards(shard_count, self.workers))
+        ]
+        logger.info(f"Run {shard_count} shards on {len(self.shard_workers)} workers")
+        public_url = webhook_settings.webhook_public_url
+        if (
+            webhook_settings.webhook_enabled
+            and public_url is not None
+            and worker_public_url(str(public_url), 0) is None
+        ):
+            logger.warning("WEBHOOK_PUBLIC_URL has no port to offset per worker, task completion stays poll based")
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stop)
+        # stagger the workers so their shards do not identify at the same time
+        start_delay = 0.0
+        runs = []
+        for worker in self.shard_workers:
+            runs.append(worker.run(self.stopping, start_delay))
+            start_delay += IDENTIFY_INTERVAL * math.ceil(len(worker.shard_ids) / max_concurrency)
+        await asyncio.gather(*runs)
+
+    def stop(self) -> None:
+        logger.info("Stop all workers")
+        if self.stopping is not None:
+            self.stopping.set()
+        for worker in self.shard_workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(ShardSupervisor(shard_settings.shard_workers, shard_settings.shard_restart_delay).run())
@@ -0,0 +1,212 @@
+import asyncio
+import itertools
+import re
+from typing import Callable, Dict, List, Optional, TypeVar
+
+import discord
+
+from admission import admission_controller
+from enums import ErrorMessage, ErrorTitle, ResponseStatusEnum, SchedulerType
+from logs import bind_log_context, get_logger
+from message_editor import message_editor
+from paginator import Page, PaginatorView
+from schemas import ImageGenerationDiscordParams, ImageGenerationParams
+from settings import lookup_settings, model_settings, sweep_settings
+from task_store import TIMEOUT_STATUS
+from utils import (
+    build_error_message,
+    build_message,
+    build_result_page,
+    get_results,
+    preprocess_data,
+    request_generation,
+)
+
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+FINISHED_STATUSES = (ResponseStatusEnum.COMPLETED, ResponseStatusEnum.ERROR, TIMEOUT_STATUS)
+REQUEST_FAILED_STATUS = "request failed"
+
+
+def parse_values(text: Optional[str], cast: Callable[[str], T], name: str) -> List[T]:
+    values = []
+    for value in re.split(r"[\s,]+", text or ""):
+        if not value:
+            continue
+        try:
+            value = cast(value)
+        except ValueError:
+            raise ValueError(f"{name} : `{value}` is not a valid value")
+        if value not in values:
+            values.append(value)
+    return values
+
+
+def parse_scheduler_type(value: str) -> SchedulerType:
+    for scheduler_type in SchedulerType:
+        if value.lower() in (scheduler_type.value, scheduler_type.name.lower()):
+            return scheduler_type
+    raise ValueError(value)
+
+
+class SweepJob:
+    def __init__(self, label: str, params: ImageGenerationParams, warnings: List[str]) -> None:
+        self.label = label
+        self.params = params
+        self.warnings = warnings
+        self.task_id: Optional[str] = None
+        self.status: str = ResponseStatusEnum.PENDING
+        self.res: Dict = {}
+
+
+def expand_sweep(prompt: str, axes: Dict[str, List], fixed: Dict) -> List[SweepJob]:
+    # raises ValidationError like preprocess_data does for a single /generate
+    count = 1
+    for values in axes.values():
+        count *= len(values)
+    if count > sweep_settings.sweep_max_jobs:
+        raise ValueError(f"The sweep expands into {count} tasks, at most {sweep_settings.sweep_max_jobs} are allowed")
+    jobs = []
+    for index, values in enumerate(itertools.product(*axes.values())):
+        job_values = dict(zip(axes, values))
+        varied = [f"{name}={value}" for name, value in job_values.items() if len(axes[name]) > 1]
+        params, warnings = preprocess_data(prompt=prompt, **fixed, **job_values)
+        jobs.append(SweepJob(label=", ".join([f"#{index + 1}"] + varied), params=params, warnings=warnings))
+    return jobs
+
+
+def build_sweep_summary(jobs: List[SweepJob]) -> str:
+    lines = []
+    for job in jobs:
+        task = f" `{job.task_id}`" if job.task_id is not None else ""
+        lines.append(f"{job.label} : {job.status}{task}")
+    warnings = list(dict.fromkeys(warning for job in jobs for warning in job.warnings))
+    return "\n".join(lines + warnings)
+
+
+def build_sweep_job_page(job: SweepJob) -> Page:
+    if job.task_id is None:
+        return build_error_message(title=ErrorTitle.REQUEST, description=f"{job.label}\nThe request failed."), []
+    if job.status == ResponseStatusEnum.ERROR:
+        return (
+            build_error_message(
+                title=ErrorTitle.UNKNOWN, description=f"{job.label}\n{ErrorMessage.UNKNOWN}task_id: {job.task_id}"
+            ),
+            [],
+        )
+    if not job.res:
+        return (
+            build_error_message(
+                title=ErrorTitle.TIMEOUT,
+                description=f"{job.label}\nThe task did not finish in time.\ntask_id: {job.task_id}",
+            ),
+            [],
+        )
+    embed, items = build_result_page(job.task_id, (True, job.res), (True, job.params.dict()))
+    embed.description = f"{job.label}\n{embed.description}"
+    return embed, items
+
+
+async def run_sweep(interaction: discord.Interaction, jobs: List[SweepJob]) -> None:
+    mentions = discord.AllowedMentions(users=True)
+    user_mention = interaction.user.mention
+    user_id = str(interaction.user.id)
+    guild_id = str(interaction.guild.id)
+    channel_id = str(interaction.channel.id)
+    bind_log_context(user_id=user_id, guild_id=guild_id)
+
+    retry_after = admission_controller.check(user_id=user_id, guild_id=guild_id, amount=len(jobs))
+    if retry_after > 0:
+        error_embed = build_error_message(
+            title=ErrorTitle.RATE_LIMIT,
+            description=f"You are requesting too many tasks.\nPlease try again in {int(retry_after) + 1} seconds.",
+        )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+
+    message_embed = build_message(
+        title=f"Sweep > Prompt: {jobs[0].params.prompt}",
+        description=build_sweep_summary(jobs),
+        colour=discord.Colour.blue(),
+    )
+    await interaction.response.send_message(
+        embed=message_embed,
+        content=f"{user_mention} Your sweep of {len(jobs)} tasks is requested.",
+        allowed_mentions=mentions,
+    )
+    message = await interaction.original_response()
+    discord_data = ImageGenerationDiscordParams(
+        user_id=user_id, guild_id=guild_id, channel_id=channel_id, message_id=str(message.id)
+    )
+
+    async def refresh():
+        # every job reports here, the message editor merges the updates into a few edits
+        message_embed.description = build_sweep_summary(jobs)
+        finished = sum(job.status in FINISHED_STATUSES or job.task_id is None for job in jobs)
+        await message_editor.edit_original_response(
+            interaction,
+            wait=False,
+            embed=message_embed,
+            content=f"{user_mention} Your sweep is running. {finished}/{len(jobs)} tasks finished.",
+            allowed_mentions=mentions,
+        )
+
+    submit_semaphore = asyncio.Semaphore(sweep_settings.sweep_concurrency)
+
+    async def run_job(job: SweepJob):
+        cost = admission_controller.cost(job.params)
+        if not await admission_controller.acquire(cost, user_id, guild_id):
+            job.status = REQUEST_FAILED_STATUS
+            await refresh()
+            return
+        try:
+            async with submit_semaphore:
+                is_success, res = await request_generation(discord_data, job.params)
+            if not is_success:
+                job.status = REQUEST_FAILED_STATUS
+                await refresh()
+                return
+            job.task_id = res["task_id"]
+            await refresh()
+
+            async def on_status_change(prev_status: str, status: str):
+                job.status = status
+                await refresh()
+
+            # the jobs wait together, the shared poller looks them up in batches
+            _, job.res = await get_results(
+                url=f"{model_settings.endpoint}/tasks/{job.task_id}/images",
+                n=300,
+                user=user_mention,
+                interaction=interaction,
+                message=message_embed,
+                task_id=job.task_id,
+                params=job.params,
+                status_listener=on_status_change,
+                # the sweep message is not journaled, a restart does not resume its jobs
+                journaled=False,
+            )
+            job.status = job.res["status"] if job.res else TIMEOUT_STATUS
+        except Exception as unknown_error:
+            logger.error(f"Sweep job {job.label} failed : {unknown_error}")
+            job.status = REQUEST_FAILED_STATUS if job.task_id is None else ResponseStatusEnum.ERROR
+        finally:
+            admission_controller.release(cost)
+
+    await asyncio.gather(*[run_job(job) for job in jobs])
+
+    completed = sum(job.status == ResponseStatusEnum.COMPLETED for job in jobs)
+    message_embed.description = build_sweep_summary(jobs)
+    message_embed.colour = discord.Colour.green() if completed == len(jobs) else discord.Colour.orange()
+    pages = [(message_embed, [])] + [build_sweep_job_page(job) for job in jobs]
+    view = PaginatorView(pages, timeout=lookup_settings.lookup_page_timeout)
+    await message_editor.edit_original_response(
+        interaction,
+        embed=view.embed,
+        content=f"{user_mention} Your sweep is completed. {completed}/{len(jobs)} tasks succeeded.",
+        allowed_mentions=mentions,
+        view=view,
+    )
@@ -0,0 +1,142 @@
+import json
+import sqlite3
+import time
+from typing import List, Optional
+
+from enums import ResponseStatusEnum
+from logs import get_logger
+from schemas import ImageGenerationDiscordParams, ImageGenerationParams, TaskRecord
+from settings import task_store_settings
+from sqlite_store import SQLiteStore
+
+
+logger = get_logger(__name__)
+
+# the bot stopped waiting, the task may still finish on the server
+TIMEOUT_STATUS = "timeout"
+# the images are shown, the transaction hash is still looked for
+TX_PENDING_STATUS = "tx pending"
+# the discord message was deleted or is out of reach, the result can never be shown
+MESSAGE_LOST_STATUS = "message lost"
+UNFINISHED_STATUSES = (ResponseStatusEnum.PENDING, ResponseStatusEnum.ASSIGNED, TX_PENDING_STATUS)
+COLUMNS = "task_id, user_id, guild_id, channel_id, message_id, params, warnings, status"
+
+
+def _to_record(row: tuple) -> TaskRecord:
+    task_id, user_id, guild_id, channel_id, message_id, params, warnings, status = row
+    return TaskRecord(
+        task_id=task_id,
+        discord=ImageGenerationDiscordParams(
+            user_id=user_id, guild_id=guild_id, channel_id=channel_id, message_id=message_id
+        ),
+        params=ImageGenerationParams.parse_raw(params),
+        warnings=json.loads(warnings),
+        status=status,
+    )
+
+
+class TaskStore(SQLiteStore):
+    def create_tables(self, connection: sqlite3.Connection) -> None:
+        # one row per discord message, identical requests may share a task id
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "message_id TEXT PRIMARY KEY, task_id TEXT NOT NULL, user_id TEXT NOT NULL, guild_id TEXT NOT NULL, "
+            "channel_id TEXT NOT NULL, params TEXT NOT NULL, warnings TEXT NOT NULL, status TEXT NOT NULL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS tasks_task_id ON tasks (task_id)")
+        connection.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status)")
+
+    def _insert(self, record: TaskRecord) -> None:
+        now = time.time()
+        with self.connection() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO tasks ({COLUMNS}, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.task_id,
+                    record.discord.user_id,
+                    record.discord.guild_id,
+                    record.discord.channel_id,
+                    record.discord.message_id,
+                    record.params.json(),
+                    json.dumps(record.warnings),
+                    record.status,
+                    now,
+                    now,
+                ),
+            )
+
+    def _update_status(self, task_id: str, status: str) -> None:
+        # a message waiting for its transaction hash already saw the result, only its own update finishes it
+        with self.connection() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = ?, updated_at = ? WHERE task_id = ? AND status NOT IN (?, ?)",
+                (status, time.time(), task_id, TX_PENDING_STATUS, MESSAGE_LOST_STATUS),
+            )
+
+    def _update_message_status(self, message_id: str, status: str) -> None:
+        with self.connection() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = ?, updated_at = ? WHERE message_id = ?", (status, time.time(), message_id)
+            )
+
+    def _select_unfinished(self) -> List[TaskRecord]:
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATUSES)
+        rows = self.connection().execute(
+            f"SELECT {COLUMNS} FROM tasks WHERE status IN ({placeholders}) ORDER BY created_at",
+            [str(status) for status in UNFINISHED_STATUSES],
+        )
+        return [_to_record(row) for row in rows]
+
+    def _select(self, task_id: str) -> Optional[TaskRecord]:
+        row = (
+            self.connection()
+            .execute(f"SELECT {COLUMNS} FROM tasks WHERE task_id = ? ORDER BY created_at LIMIT 1", (task_id,))
+            .fetchone()
+        )
+        return _to_record(row) if row else None
+
+    def _prune(self, older_than: float) -> int:
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATUSES)
+        with self.connection() as connection:
+            cursor = connection.execute(
+                f"DELETE FROM tasks WHERE updated_at < ? AND status NOT IN ({placeholders})",
+                [older_than] + [str(status) for status in UNFINISHED_STATUSES],
+            )
+        return cursor.rowcount
+
+    async def add(
+        self,
+        task_id: str,
+        discord_data: ImageGenerationDiscordParams,
+        params: ImageGenerationParams,
+        warnings: List[str],
+    ) -> None:
+        record = TaskRecord(
+            task_id=task_id,
+            discord=discord_data,
+            params=params,
+            warnings=warnings,
+            status=ResponseStatusEnum.PENDING,
+        )
+        await self.run(self._insert, record)
+
+    async def update_status(self, task_id: str, status: str) -> None:
+        await self.run(self._update_status, task_id, status)
+
+    async def update_message_status(self, message_id: str, status: str) -> None:
+        await self.run(self._update_message_status, message_id, status)
+
+    async def unfinished(self) -> List[TaskRecord]:
+        return await self.run(self._select_unfinished) or []
+
+    async def get(self, task_id: str) -> Optional[TaskRecord]:
+        return await self.run(self._select, task_id)
+
+    async def prune(self, retention: float) -> None:
+        deleted = await self.run(self._prune, time.time() - retention)
+        if deleted:
+            logger.info(f"Pruned {deleted} finished tasks")
+
+
+task_store = TaskStore(db_path=task_store_settings.task_store_path)
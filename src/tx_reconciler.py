@@ -0,0 +1,182 @@
+import asyncio
+import heapq
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from endpoint_pool import endpoint_router
+from enums import ResponseStatusEnum
+from logs import get_logger
+from metrics import tx_pending, tx_reconciled_total
+from settings import model_settings, tx_reconciler_settings
+
+
+logger = get_logger(__name__)
+
+
+class _PendingTx:
+    __slots__ = ("task_id", "waiters", "deadline", "interval", "due_at")
+
+    def __init__(self, task_id: str, deadline: float, interval: float) -> None:
+        self.task_id = task_id
+        # deduplicated generations share a task, every message waiting for it gets the hash
+        self.waiters: List[asyncio.Future] = []
+        self.deadline = deadline
+        self.interval = interval
+        self.due_at = 0.0
+
+
+class TxReconciler:
+    def __init__(
+        self,
+        horizon: float,
+        min_interval: float,
+        max_interval: float,
+        backoff_factor: float,
+        batch_size: int,
+    ) -> None:
+        self.horizon = horizon
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.batch_size = batch_size
+        self._pending: Dict[str, _PendingTx] = {}
+        # (due_at, sequence, task_id), entries whose due_at changed are skipped when popped
+        self._queue: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def wait(self, task_id: str) -> Optional[str]:
+        # returns the hash, or None when the task failed or the hash did not show up within the horizon
+        loop = asyncio.get_running_loop()
+        entry = self._pending.get(task_id)
+        if entry is None:
+            entry = _PendingTx(task_id=task_id, deadline=loop.time() + self.horizon, interval=self.min_interval)
+            self._pending[task_id] = entry
+            tx_pending.set(len(self._pending))
+            self._schedule(entry, loop.time() + entry.interval)
+            self._ensure_running()
+        else:
+            # a later message's interaction expires later
+            entry.deadline = max(entry.deadline, loop.time() + self.horizon)
+        waiter = loop.create_future()
+        entry.waiters.append(waiter)
+        try:
+            return await waiter
+        finally:
+            if waiter in entry.waiters:
+                # the wait was cancelled, the lookups stop with the last waiter
+                entry.waiters.remove(waiter)
+                if not entry.waiters and self._pending.get(task_id) is entry:
+                    self._finish(entry, "cancelled")
+
+    def push(self, task_id: str, res: Dict) -> bool:
+        entry = self._pending.get(task_id)
+        if entry is None:
+            return False
+        self._update(entry, res)
+        return True
+
+    def _schedule(self, entry: _PendingTx, due_at: float) -> None:
+        entry.due_at = due_at
+        heapq.heappush(self._queue, (due_at, next(self._sequence), entry.task_id))
+
+    def _ensure_running(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    def _pop_due(self, now: float) -> List[_PendingTx]:
+        entries = []
+        while self._queue and self._queue[0][0] <= now and len(entries) < self.batch_size:
+            due_at, _, task_id = heapq.heappop(self._queue)
+            entry = self._pending.get(task_id)
+            if entry is not None and entry.due_at == due_at:
+                entries.append(entry)
+        return entries
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            entries = self._pop_due(loop.time())
+            if entries:
+                await asyncio.gather(*[self._lookup(entry) for entry in entries])
+                continue
+            while self._queue and self._queue[0][2] not in self._pending:
+                heapq.heappop(self._queue)
+            if not self._queue:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, self._queue[0][0] - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+        self._task = None
+
+    async def _lookup(self, entry: _PendingTx) -> None:
+        is_success, res = await endpoint_router.get(
+            f"{model_settings.endpoint}/tasks/{entry.task_id}/tx-hash",
+            headers={"accept": "application/json"},
+        )
+        if not is_success:
+            logger.warning(f"Tx hash lookup of {entry.task_id} failed : {res}", extra={"sample_key": "tx_lookup"})
+            res = {}
+        self._update(entry, res)
+
+    def _update(self, entry: _PendingTx, res: Dict) -> None:
+        if self._pending.get(entry.task_id) is not entry:
+            return
+        status = res.get("status")
+        tx_hash = (res.get("tx_hash") or {}).get(ResponseStatusEnum.COMPLETED)
+        if status == ResponseStatusEnum.COMPLETED and tx_hash:
+            self._finish(entry, "resolved", tx_hash)
+            return
+        if status == ResponseStatusEnum.ERROR:
+            self._finish(entry, "error")
+            return
+        now = asyncio.get_running_loop().time()
+        if now >= entry.deadline:
+            logger.info(f"Tx hash of {entry.task_id} did not show up in {self.horizon:.0f}s")
+            self._finish(entry, "expired")
+            return
+        entry.interval = min(entry.interval * self.backoff_factor, self.max_interval)
+        self._schedule(entry, min(now + entry.interval, entry.deadline))
+        self._wakeup.set()
+
+    def _finish(self, entry: _PendingTx, outcome: str, tx_hash: Optional[str] = None) -> None:
+        del self._pending[entry.task_id]
+        tx_pending.set(len(self._pending))
+        tx_reconciled_total.inc(outcome=outcome)
+        for waiter in entry.waiters:
+            if not waiter.done():
+                waiter.set_result(tx_hash)
+        entry.waiters.clear()
+
+    def stats(self) -> Dict:
+        return {"pending": len(self._pending), "queued": len(self._queue)}
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        # cancelled rather than resolved, the waiting tasks stay unfinished for the next replica
+        for entry in self._pending.values():
+            for waiter in entry.waiters:
+                waiter.cancel()
+        self._pending.clear()
+        self._queue.clear()
+        self._task = None
+
+
+tx_reconciler = TxReconciler(
+    horizon=tx_reconciler_settings.tx_horizon,
+    min_interval=tx_reconciler_settings.tx_min_interval,
+    max_interval=tx_reconciler_settings.tx_max_interval,
+    backoff_factor=tx_reconciler_settings.tx_backoff_factor,
+    batch_size=tx_reconciler_settings.tx_batch_size,
+)
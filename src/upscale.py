@@ -0,0 +1,131 @@
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from cache import task_cache
+from enums import ResponseStatusEnum
+from logs import get_logger
+from settings import upscale_settings
+
+
+logger = get_logger(__name__)
+
+QUEUED_STATUS = "queued"
+REQUESTED_STATUS = "requested"
+REQUEST_FAILED_STATUS = "request failed"
+
+# called with the job and its previous status whenever the job's status changes
+UpscaleListener = Callable[["UpscaleJob", str], Awaitable[None]]
+
+
+class UpscaleJob:
+    def __init__(self, image_url: str) -> None:
+        self.image_url = image_url
+        self.task_id: Optional[str] = None
+        self.status: str = QUEUED_STATUS
+        self.output: Optional[str] = None
+        self.listeners: List[UpscaleListener] = []
+        self.future: Optional[asyncio.Future] = None
+
+    async def update(self, status: str) -> None:
+        prev_status, self.status = self.status, status
+        # an expired interaction of one click must not stop the others from being updated
+        results = await asyncio.gather(
+            *[listener(self, prev_status) for listener in list(self.listeners)], return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Upscale listener failed : {result}")
+
+
+class UpscaleManager:
+    def __init__(self, max_per_user: int, max_in_flight: int) -> None:
+        self.max_per_user = max_per_user
+        # one upscale job per source image, later clicks attach to it
+        self._jobs: Dict[str, UpscaleJob] = {}
+        self._user_jobs: Counter = Counter()
+        self.max_in_flight = max_in_flight
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.requested = 0
+        self.reused = 0
+        self.attached = 0
+        self.rejected = 0
+        self.submitted = 0
+
+    @staticmethod
+    def cache_key(image_url: str) -> str:
+        return f"upscale/{image_url}"
+
+    async def upscale(
+        self,
+        image_url: str,
+        user_id: str,
+        run: Callable[[UpscaleJob], Awaitable[None]],
+        listener: UpscaleListener,
+    ) -> Optional[UpscaleJob]:
+        # returns None when the user already has too many upscales running
+        self.requested += 1
+        res = task_cache.get(self.cache_key(image_url))
+        if res is not None:
+            self.reused += 1
+            job = UpscaleJob(image_url)
+            job.task_id = res["task_id"]
+            job.output = res["output"]
+            job.status = ResponseStatusEnum.COMPLETED
+            return job
+        job = self._jobs.get(image_url)
+        if job is None:
+            if self._user_jobs[user_id] >= self.max_per_user:
+                self.rejected += 1
+                return None
+            job = UpscaleJob(image_url)
+            self._jobs[image_url] = job
+            self._user_jobs[user_id] += 1
+            job.future = asyncio.ensure_future(self._run(job, user_id, run))
+        else:
+            self.attached += 1
+        job.listeners.append(listener)
+        try:
+            # a cancelled click leaves the job running for the others
+            await asyncio.shield(job.future)
+        finally:
+            job.listeners.remove(listener)
+        return job
+
+    async def _run(self, job: UpscaleJob, user_id: str, run: Callable[[UpscaleJob], Awaitable[None]]) -> None:
+        if self._semaphore is None:
+            # created inside the running loop, the client starts a new one after import
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        try:
+            async with self._semaphore:
+                self.submitted += 1
+                await run(job)
+            if job.status == ResponseStatusEnum.COMPLETED:
+                task_cache.set(
+                    self.cache_key(job.image_url),
+                    {"status": job.status, "task_id": job.task_id, "output": job.output},
+                )
+        except Exception as unknown_error:
+            logger.error(f"Upscale of {job.image_url} failed : {unknown_error}")
+            job.status = ResponseStatusEnum.ERROR if job.task_id is not None else REQUEST_FAILED_STATUS
+        finally:
+            del self._jobs[job.image_url]
+            self._user_jobs[user_id] -= 1
+            if self._user_jobs[user_id] <= 0:
+                del self._user_jobs[user_id]
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._jobs),
+            "requested": self.requested,
+            "reused": self.reused,
+            "attached": self.attached,
+            "rejected": self.rejected,
+            "submitted": self.submitted,
+        }
+
+
+upscale_manager = UpscaleManager(
+    max_per_user=upscale_settings.upscale_max_per_user,
+    max_in_flight=upscale_settings.upscale_max_in_flight,
+)
@@ -1,29 +1,47 @@
 import asyncio
+import functools
 import json
-import logging
-import logging.handlers
+import math
 import random
-from typing import Callable, Dict, List, Optional, Tuple
+import re
+import time
+from typing import Awaitable, Dict, List, Optional, Tuple
 from urllib import parse
 
 import discord
-import requests
-from discord.ui import Button, View
-
-from enums import EnvEnum, ErrorMessage, ErrorTitle, ModelEnum, ResponseStatusEnum, SchedulerType, WarningMessages
-from schemas import ImageGenerationDiscordParams, ImageGenerationParams
-from settings import discord_bot_settings, model_settings
-
-
-def get_logger(name):
-    logger = logging.getLogger(name)
-    handler = logging.StreamHandler()
-    dt_fmt = "%Y-%m-%d %H:%M:%S"
-    formatter = logging.Formatter("[{asctime}] [{levelname:<8}] {name}: {message}", dt_fmt, style="{")
-    handler.setFormatter(formatter)
-    logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
-    return logger
+from discord.ui import Button, Item
+from pydantic import ValidationError
+
+from admission import admission_controller
+from cache import task_cache
+from components import build_custom_id, build_static_view, component_dispatcher
+from dedupe import generation_index
+from endpoint_pool import endpoint_router
+from enums import (
+    ComponentAction,
+    EnvEnum,
+    ErrorMessage,
+    ErrorTitle,
+    ModelEnum,
+    ResponseStatusEnum,
+    SchedulerType,
+    WarningMessages,
+)
+from lease import lease_coordinator, task_key
+from logs import bind_log_context, get_logger
+from message_editor import EditFunction, message_editor
+from metrics import errors_total, lease_takeovers_total, time_to_result_seconds, waits_in_flight
+from paginator import Page
+from poller import StatusListener, task_poller
+from recorder import GENERATE, STATUS, TASK, traffic_recorder
+from schemas import ImageGenerationDiscordParams, ImageGenerationParams, TaskRecord
+from settings import dedupe_settings, discord_bot_settings, model_settings, poller_settings, task_store_settings
+from singleflight import get_flight
+from task_store import MESSAGE_LOST_STATUS, TIMEOUT_STATUS, TX_PENDING_STATUS, task_store
+from tx_reconciler import tx_reconciler
+from upscale import REQUEST_FAILED_STATUS, REQUESTED_STATUS, UpscaleJob, upscale_manager
+from watchdog import loop_watchdog
+from webhook import webhook_receiver
 
 
 logger = get_logger(__name__)
@@ -69,7 +87,8 @@ def preprocess_data(
     return image_generation_request, warning_message_list
 
 
-def build_error_message(title: str, description: str) -> discord.Embed:
+def build_error_message(title: ErrorTitle, description: str) -> discord.Embed:
+    errors_total.inc(title=title)
     return build_message(title=title, description=description, colour=discord.Colour.red())
 
 
@@ -79,322 +98,675 @@ def build_message(title: str, description: str, colour: discord.Colour) -> disco
     return discord.Embed(title=title, colour=colour, description=description)
 
 
-def post_req(
-    url: str, data: Dict, headers: Dict = {"Content-Type": "application/json", "accept": "application/json"}
+async def post_req(
+    url: str,
+    data: Dict,
+    headers: Dict = {"Content-Type": "application/json", "accept": "application/json"},
+    timeout: Optional[float] = None,
 ) -> Tuple[bool, Dict]:
-    res = requests.post(
+    return await endpoint_router.post(
         url,
         headers=headers,
         data=json.dumps(data),
+        timeout=timeout,
     )
-    if res.status_code == 200:
-        return True, res.json()
-    else:
-        return False, res.text
 
 
-def get_req(url: str) -> Tuple[bool, Dict]:
-    res = requests.get(
+async def request_generation(
+    discord_data: ImageGenerationDiscordParams, image_generation_request: ImageGenerationParams
+) -> Tuple[bool, Dict]:
+    request_data = {
+        "discord": discord_data.dict(),
+        "params": image_generation_request.dict(),
+    }
+    if webhook_receiver.callback_url is not None:
+        request_data["callback_url"] = webhook_receiver.callback_url
+    logger.info(
+        f"Request generation : {image_generation_request.model_id} {image_generation_request.width}x{image_generation_request.height} "
+        f"steps={image_generation_request.steps} images={image_generation_request.images}"
+    )
+    logger.debug(f"Data : {request_data}")
+
+    async def submit() -> Tuple[bool, Dict]:
+        return await post_req(url=f"{model_settings.endpoint}/generate", data=request_data)
+
+    if not dedupe_settings.dedupe_enabled:
+        return await submit()
+    return await generation_index.submit(image_generation_request, submit)
+
+
+async def get_req(url: str, timeout: Optional[float] = None) -> Tuple[bool, Dict]:
+    # concurrent lookups of the same url share one request
+    return await get_flight.do(
         url,
-        headers={
-            "accept": "application/json",
-        },
+        lambda: endpoint_router.get(
+            url,
+            headers={
+                "accept": "application/json",
+            },
+            timeout=timeout,
+        ),
     )
-    if res.status_code == 200:
-        return True, res.json()
-    else:
-        return False, res.text
+
+
+def parse_task_ids(text: str) -> List[str]:
+    task_ids = []
+    for task_id in re.split(r"[\s,]+", text):
+        if task_id and task_id not in task_ids:
+            task_ids.append(task_id)
+    return task_ids
+
+
+async def gather_with_limit(aws: List[Awaitable], limit: int) -> List:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[run(aw) for aw in aws])
+
+
+async def get_task_images(task_id: str) -> Tuple[bool, Dict]:
+    cache_key = f"{task_id}/images"
+    res = task_cache.get(cache_key)
+    if res is not None:
+        return True, res
+    is_success, res = await get_req(url=f"{model_settings.endpoint}/tasks/{task_id}/images")
+    if is_success:
+        task_cache.set(cache_key, res)
+    return is_success, res
+
+
+async def get_task_params(task_id: str) -> Tuple[bool, Dict]:
+    cache_key = f"{task_id}/params"
+    res = task_cache.get(cache_key)
+    if res is not None:
+        return True, res
+    is_success, res = await get_req(url=f"{model_settings.endpoint}/tasks/{task_id}/params")
+    if is_success:
+        task_cache.set(cache_key, res, ttl=task_cache.completed_ttl)
+    return is_success, res
+
+
+def build_task_not_found_message(task_id: str) -> discord.Embed:
+    return build_error_message(
+        title=ErrorTitle.WRONG_TASK_ID,
+        description=f"Requested task was not found. Your task id({task_id}) may be wrong. Please input correct task id.",
+    )
+
+
+def build_result_page(task_id: str, images_lookup: Tuple[bool, Dict], params_lookup: Tuple[bool, Dict]) -> Page:
+    is_success, res = images_lookup
+    if not is_success:
+        return build_task_not_found_message(task_id), []
+
+    if res["status"] != ResponseStatusEnum.COMPLETED:
+        message_embed = build_message(
+            title="Task is not finished",
+            description=f"task_id: {task_id}\nCurrent status : {res['status']}",
+            colour=discord.Colour.orange(),
+        )
+        return message_embed, []
+
+    is_success, request_params = params_lookup
+    if not is_success:
+        return build_task_not_found_message(task_id), []
+
+    result = res["result"]
+    button_list = build_image_buttons(task_id, request_params["images"])
+
+    message_embed = build_message(
+        title=f"Prompt: {request_params['prompt']}",
+        description=f"task_id: {task_id}",
+        colour=discord.Colour.green(),
+    )
+    message_embed.set_image(url=result["grid"]["url"])
+    if sum([each["is_filtered"] for each in result.values()]):
+        message_embed.colour = discord.Colour.orange()
+        message_embed.description = "\n".join([f"task_id: {task_id}", WarningMessages.NSFW])
+    return message_embed, button_list
+
+
+def build_params_text(request_params: Dict) -> str:
+    params_text = ""
+    for param_name, param_val in request_params.items():
+        params_text += f"> **{param_name}**\n> {param_val}\n"
+    return params_text
+
+
+def build_params_page(task_id: str, params_lookup: Tuple[bool, Dict]) -> Page:
+    is_success, request_params = params_lookup
+    if not is_success:
+        return build_task_not_found_message(task_id), []
+    message_embed = build_message(
+        title=f"task_id: {task_id}",
+        description=build_params_text(request_params),
+        colour=discord.Colour.blue(),
+    )
+    return message_embed, []
+
+
+def check_task_result(res: Dict) -> Optional[bool]:
+    status = res["status"]
+    if status == ResponseStatusEnum.COMPLETED:
+        return True
+    if status == ResponseStatusEnum.ERROR:
+        return False
+    return None
 
 
 async def get_results(
     url: str,
     n: int,
     user: str,
-    interaction: discord.Interaction,
+    interaction: Optional[discord.Interaction],
     message: discord.Embed,
+    task_id: Optional[str] = None,
+    params: Optional[ImageGenerationParams] = None,
+    edit_message: Optional[EditFunction] = None,
+    status_listener: Optional[StatusListener] = None,
+    journaled: bool = True,
 ) -> Tuple[bool, Dict]:
-    prev_status: ResponseStatusEnum = ResponseStatusEnum.PENDING
-    mentions = discord.AllowedMentions(users=True)
-    for step in range(n):
-        logger.info(f"Step : {step}/{n}")
-        is_success, res = get_req(url)
-        if not is_success:
-            logger.error(f"Failed To Get Req : {res}")
-            await asyncio.sleep(1)
-            continue
-        status = res["status"]
-        if status == ResponseStatusEnum.COMPLETED:
-            return True, res
-        if status == ResponseStatusEnum.ERROR:
-            return False, res
-        elif status != prev_status:
-            await interaction.edit_original_response(
-                embed=message,
-                content=f"{user} Your task's status is updated from {prev_status} to {status}",
-                allowed_mentions=mentions,
-            )
-            prev_status = status
-        await asyncio.sleep(1)
-    else:
-        return False, {}
-
-
-async def get_tx_hash(
-    url: str,
-    n: int,
-) -> Tuple[bool, Dict]:
-    for step in range(n):
-        logger.info(f"Step : {step}/{n}")
-        is_success, res = get_req(url)
-        if not is_success:
-            logger.error(f"Failed To Get Req : {res}")
-            await asyncio.sleep(1)
-            continue
-        status = res["status"]
-        if status == ResponseStatusEnum.COMPLETED:
-            if ResponseStatusEnum.COMPLETED in res["tx_hash"]:
-                return True, res
-        if status == ResponseStatusEnum.ERROR:
-            return False, res
-        await asyncio.sleep(1)
-    else:
-        return False, {}
-
-
-def up_scale_image_button(image_url: str, title: str) -> Callable:
     mentions = discord.AllowedMentions(users=True)
-
-    async def call_back(interaction: discord.Interaction):
-        user = interaction.user.mention
-        message_embed = build_message(title=f"Upscale > {title}", colour=discord.Colour.blue(), description="")
-        await interaction.response.send_message(
-            embed=message_embed,
+    if edit_message is None:
+        edit_message = functools.partial(message_editor.edit_original_response, interaction)
+    # only tasks added to the task store have a row to update
+    journaled = journaled and task_id is not None
+    if task_id is not None:
+        res = task_cache.get(f"{task_id}/images")
+        if res is not None and check_task_result(res) is not None:
+            if journaled:
+                await task_store.update_status(task_id, res["status"])
+            return check_task_result(res), res
+
+    async def on_status_change(prev_status: str, status: str):
+        if task_id is not None:
+            traffic_recorder.record(STATUS, task=task_id, s=status)
+        if journaled:
+            await task_store.update_status(task_id, status)
+        if status_listener is not None:
+            await status_listener(prev_status, status)
+            return
+        await edit_message(
+            wait=False,
+            embed=message,
+            content=f"{user} Your task's status is updated from {prev_status} to {status}",
             allowed_mentions=mentions,
-            ephemeral=True,
         )
-        is_success, res = post_req(
-            url=f"{model_settings.upscale_endpoint}/upscale/url?url={image_url}",
-            headers={"accept": "application/json"},
-            data={},
+
+    with waits_in_flight.track(kind="generate" if task_id is not None else "upscale"):
+        is_success, res = await task_poller.wait(
+            url,
+            timeout=n * poller_settings.poll_interval,
+            check=check_task_result,
+            on_status_change=on_status_change,
+            task_id=task_id,
+            params=params,
+            push=task_id is not None,
         )
+    if task_id is not None:
+        traffic_recorder.record(STATUS, task=task_id, s=res["status"] if res else TIMEOUT_STATUS)
+    if journaled:
+        await task_store.update_status(task_id, res["status"] if res else TIMEOUT_STATUS)
+    if task_id is not None and res:
+        task_cache.set(f"{task_id}/images", res)
+    if task_id is not None and params is not None and dedupe_settings.dedupe_enabled:
         if is_success:
-            task_id = res["task_id"]
-            message_embed = build_message(
-                title=f"Upscale > {title}", colour=discord.Colour.blue(), description=f"task id: {task_id}"
-            )
-            await interaction.edit_original_response(
-                embed=message_embed,
-                content=f"{user} Your task is successfully requested.",
-                allowed_mentions=mentions,
-            )
-            is_success, res = await get_results(
-                url=f"{model_settings.upscale_endpoint}/result/{task_id}",
-                n=300,
-                user=user,
-                interaction=interaction,
-                message=message_embed,
-            )
-            if is_success:
-                output = res["output"]
-                message_embed.set_image(url=output)
-                content_message = f"{user} Your task is completed."
-                message_embed.colour = discord.Colour.green()
-                await interaction.edit_original_response(
-                    content=content_message,
-                    embed=message_embed,
-                    allowed_mentions=mentions,
-                )
-                return
-            else:
-                error_embed = build_error_message(
-                    title="TimeOut Error",
-                    description=f"Your task cannot be generated because there are too many tasks on the server.\nIf you want to get your results late, let the community manager know your task id: {task_id}.",
-                )
-                await interaction.edit_original_response(embed=error_embed)
-                return
+            await generation_index.complete(params, task_id)
         else:
-            error_embed = build_error_message(
-                title="Upscale Request Error",
-                description="The request failed.\nPlease try again in a momentarily.\nIf the situation repeats, please let our community manager know.",
-            )
-            await interaction.edit_original_response(embed=error_embed)
-            return
+            await generation_index.forget(params, task_id)
+    return is_success, res
 
-    return call_back
 
+def get_image_url(result: Dict, index: int) -> str:
+    image = result[str(index)]
+    if image["is_filtered"]:
+        return image["origin_url"]
+    return image["url"]
 
-def individual_image_button(image_url: str, title: str, description: str) -> Callable:
-    async def call_back(interaction: discord.Interaction):
-        embed = build_message(title=title, description=description, colour=discord.Colour.green())
-        embed.set_image(url=image_url)
-        view = View(timeout=None)
-        upscale_button = Button(label="Upscale", style=discord.ButtonStyle.gray)
-        upscale_button.callback = up_scale_image_button(image_url, title)
-        view.add_item(upscale_button)
 
-        await interaction.response.send_message(embed=embed, ephemeral=True, view=view)
+def build_image_buttons(task_id: str, images: int, row: Optional[int] = None) -> List[Button]:
+    return [
+        Button(
+            label=f"#{i + 1}",
+            style=discord.ButtonStyle.gray,
+            custom_id=build_custom_id(ComponentAction.IMAGE, task_id, i + 1),
+            row=row,
+        )
+        for i in range(images)
+    ]
+
+
+async def get_generation_params(task_id: str) -> Optional[ImageGenerationParams]:
+    record = await task_store.get(task_id)
+    if record is not None:
+        return record.params
+    is_success, res = await get_task_params(task_id)
+    if not is_success:
+        return None
+    try:
+        return ImageGenerationParams.parse_obj(res)
+    except ValidationError as validation_error:
+        logger.warning(f"Cannot restore params of {task_id}: {validation_error}")
+        return None
+
+
+async def get_image_context(task_id: str, index: int) -> Optional[Tuple[str, str, str]]:
+    is_success, res = await get_task_images(task_id)
+    if not is_success or res["status"] != ResponseStatusEnum.COMPLETED or str(index) not in res["result"]:
+        return None
+    image_url = get_image_url(res["result"], index)
+    params = await get_generation_params(task_id)
+    if params is None:
+        return image_url, "Image", f"task_id: {task_id}"
+    return image_url, f"Prompt: {params.prompt}", f"task_id: {task_id}\nmodel_id: {params.model_id}"
+
+
+async def run_upscale(job: UpscaleJob) -> None:
+    is_success, res = await post_req(
+        url=f"{model_settings.upscale_endpoint}/upscale/url?{parse.urlencode({'url': job.image_url})}",
+        headers={"accept": "application/json"},
+        data={},
+    )
+    if not is_success:
+        await job.update(REQUEST_FAILED_STATUS)
+        return
+    job.task_id = res["task_id"]
+    loop_watchdog.tag(task_id=job.task_id)
+    bind_log_context(task_id=job.task_id)
+    await job.update(REQUESTED_STATUS)
+
+    async def on_status_change(prev_status: str, status: str):
+        await job.update(status)
+
+    with waits_in_flight.track(kind="upscale"):
+        is_success, res = await task_poller.wait(
+            f"{model_settings.upscale_endpoint}/result/{job.task_id}",
+            timeout=300 * poller_settings.poll_interval,
+            check=check_task_result,
+            on_status_change=on_status_change,
+        )
+    if is_success:
+        job.output = res["output"]
+    job.status = res["status"] if res else TIMEOUT_STATUS
 
-    return call_back
 
+async def upscale_image(interaction: discord.Interaction, image_url: str, title: str) -> None:
+    mentions = discord.AllowedMentions(users=True)
+    user = interaction.user.mention
+    message_embed = build_message(title=f"Upscale > {title}", colour=discord.Colour.blue(), description="")
+    await message_editor.edit_original_response(
+        interaction, wait=False, embed=message_embed, allowed_mentions=mentions
+    )
 
-def re_generate_button(image_generation_request: ImageGenerationParams) -> Callable:
-    # TODO: remove duplicate code
-    async def call_back(interaction: discord.Interaction):
-        seed = random.randint(0, 4294967295)
-        # Is it possible?
-        while image_generation_request.seed == seed:
-            seed = random.randint(0, 4294967295)
-        image_generation_request.seed = seed
-        model_endpoint = model_settings.endpoint
+    async def on_update(job: UpscaleJob, prev_status: str):
+        if job.task_id is None:
+            return
+        message_embed.description = f"task id: {job.task_id}"
+        if job.status == REQUESTED_STATUS:
+            content = f"{user} Your task is successfully requested."
+        else:
+            content = f"{user} Your task's status is updated from {prev_status} to {job.status}"
+        await message_editor.edit_original_response(
+            interaction, wait=False, embed=message_embed, content=content, allowed_mentions=mentions
+        )
 
-        message_embed = build_message(
-            title=f"Prompt: {image_generation_request.prompt}",
-            description="",
-            colour=discord.Colour.blue(),
+    job = await upscale_manager.upscale(image_url, str(interaction.user.id), run_upscale, on_update)
+    if job is None:
+        error_embed = build_error_message(
+            title=ErrorTitle.RATE_LIMIT,
+            description=f"You already have {upscale_manager.max_per_user} upscales running.\nPlease try again when one of them is finished.",
+        )
+        await message_editor.edit_original_response(interaction, embed=error_embed)
+        return
+    if job.status == ResponseStatusEnum.COMPLETED:
+        message_embed.description = f"task id: {job.task_id}"
+        message_embed.set_image(url=job.output)
+        message_embed.colour = discord.Colour.green()
+        await message_editor.edit_original_response(
+            interaction,
+            content=f"{user} Your task is completed.",
+            embed=message_embed,
+            allowed_mentions=mentions,
+        )
+        return
+    if job.task_id is None:
+        error_embed = build_error_message(
+            title=ErrorTitle.UPSCALE_REQUEST,
+            description="The request failed.\nPlease try again in a momentarily.\nIf the situation repeats, please let our community manager know.",
+        )
+        await message_editor.edit_original_response(interaction, embed=error_embed)
+        return
+    error_embed = build_error_message(
+        title=ErrorTitle.TIMEOUT,
+        description=f"Your task cannot be generated because there are too many tasks on the server.\nIf you want to get your results late, let the community manager know your task id: {job.task_id}.",
+    )
+    await message_editor.edit_original_response(interaction, embed=error_embed)
+
+
+async def handle_upscale_button(interaction: discord.Interaction, task_id: str, index: str) -> None:
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    image_context = await get_image_context(task_id, int(index))
+    if image_context is None:
+        await message_editor.edit_original_response(interaction, embed=build_task_not_found_message(task_id))
+        return
+    image_url, title, _ = image_context
+    await upscale_image(interaction, image_url, title)
+
+
+async def handle_image_button(interaction: discord.Interaction, task_id: str, index: str) -> None:
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    image_context = await get_image_context(task_id, int(index))
+    if image_context is None:
+        await interaction.followup.send(embed=build_task_not_found_message(task_id), ephemeral=True)
+        return
+    image_url, title, description = image_context
+    embed = build_message(title=title, description=description, colour=discord.Colour.green())
+    embed.set_image(url=image_url)
+    upscale_button = Button(
+        label="Upscale",
+        style=discord.ButtonStyle.gray,
+        custom_id=build_custom_id(ComponentAction.UPSCALE, task_id, index),
+    )
+    await interaction.followup.send(embed=embed, ephemeral=True, view=build_static_view([upscale_button]))
+
+
+async def generate_image(
+    interaction: discord.Interaction,
+    image_generation_request: ImageGenerationParams,
+    warning_message_list: List[str],
+) -> None:
+    started_at = time.time()
+    mentions = discord.AllowedMentions(users=True)
+    user_mention = interaction.user.mention
+    user_id = str(interaction.user.id)
+    guild_id = str(interaction.guild.id)
+    channel_id = str(interaction.channel.id)
+    bind_log_context(user_id=user_id, guild_id=guild_id)
+
+    traffic_recorder.record_interaction(GENERATE, interaction, p=image_generation_request)
+    retry_after = admission_controller.check(user_id=user_id, guild_id=guild_id)
+    if retry_after > 0:
+        error_embed = build_error_message(
+            title=ErrorTitle.RATE_LIMIT,
+            description=f"You are requesting too many tasks.\nPlease try again in {math.ceil(retry_after)} seconds.",
         )
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
 
-        mentions = discord.AllowedMentions(users=True)
-        await interaction.response.send_message(
+    message_embed = build_message(
+        title=f"Prompt: {image_generation_request.prompt}",
+        description="",
+        colour=discord.Colour.blue(),
+    )
+    await interaction.response.send_message(
+        embed=message_embed,
+        allowed_mentions=mentions,
+    )
+
+    async def on_queue_position(position: int):
+        await message_editor.edit_original_response(
+            interaction,
+            wait=False,
             embed=message_embed,
+            content=f"{user_mention} Your task is waiting in the queue. Position: {position}",
             allowed_mentions=mentions,
         )
 
+    cost = admission_controller.cost(image_generation_request)
+    if not await admission_controller.acquire(cost, user_id, guild_id, on_queue_position=on_queue_position):
+        error_embed = build_error_message(
+            title=ErrorTitle.QUEUE_FULL,
+            description="There are too many tasks waiting right now.\nPlease try again in a momentarily.",
+        )
+        await message_editor.edit_original_response(interaction, embed=error_embed)
+        return
+    try:
         message = await interaction.original_response()
-        message_id = str(message.id)
-        user_id = str(interaction.user.id)
-        guild_id = str(interaction.guild.id)
-        channel_id = str(interaction.channel.id)
-
         discord_data = ImageGenerationDiscordParams(
             user_id=user_id,
             guild_id=guild_id,
             channel_id=channel_id,
-            message_id=message_id,
+            message_id=str(message.id),
         )
-        request_data = {
-            "discord": discord_data.dict(),
-            "params": image_generation_request.dict(),
-        }
-        logger.info(f"Data : {request_data}")
+        await _generate_image(interaction, discord_data, image_generation_request, warning_message_list, started_at)
+    except Exception as unknown_error:
+        error_message = ErrorMessage.UNKNOWN
+        error_message += f"Error: {unknown_error}"
+        error_embed = build_error_message(title=ErrorTitle.UNKNOWN, description=error_message)
+        await message_editor.edit_original_response(interaction, embed=error_embed)
+    finally:
+        admission_controller.release(cost)
 
-        is_success, res = post_req(url=f"{model_endpoint}/generate", data=request_data)
 
-        if is_success:
-            task_id = res["task_id"]
-            user_mention = interaction.user.mention
-            model_id = image_generation_request.model_id
-            message_embed = build_message(
-                title=f"Prompt: {image_generation_request.prompt}",
-                description=f"task_id: {task_id}\nmodel_id: {model_id}",
-                colour=discord.Colour.blue(),
-            )
-            await interaction.edit_original_response(
-                embed=message_embed,
-                content=f"{user_mention} Your task is successfully requested.",
-                allowed_mentions=mentions,
+async def _generate_image(
+    interaction: discord.Interaction,
+    discord_data: ImageGenerationDiscordParams,
+    image_generation_request: ImageGenerationParams,
+    warning_message_list: List[str],
+    started_at: float,
+) -> None:
+    mentions = discord.AllowedMentions(users=True)
+    is_success, res = await request_generation(discord_data, image_generation_request)
+    if not is_success:
+        error_message = "The request failed.\nPlease try again in a momentarily.\nIf the situation repeats, please let our community manager know."
+        error_embed = build_error_message(title=ErrorTitle.REQUEST, description=error_message)
+        await message_editor.edit_original_response(interaction, embed=error_embed)
+        return
+
+    task_id = res["task_id"]
+    traffic_recorder.record(TASK, i=interaction.id, task=task_id)
+    lease_key = task_key(task_id, discord_data.message_id)
+    # claimed before the task is journaled, so no other replica can resume it in between
+    if not await lease_coordinator.claim(lease_key):
+        logger.warning(f"Task {task_id} of message {discord_data.message_id} is already owned by another replica")
+        return
+    try:
+        await task_store.add(task_id, discord_data, image_generation_request, warning_message_list)
+        user_mention = interaction.user.mention
+        model_id = image_generation_request.model_id
+        message_embed = build_message(
+            title=f"Prompt: {image_generation_request.prompt}",
+            description=f"task_id: {task_id}\nmodel_id: {model_id}",
+            colour=discord.Colour.blue(),
+        )
+        await message_editor.edit_original_response(
+            interaction,
+            wait=False,
+            embed=message_embed,
+            content=f"{user_mention} Your task is successfully requested.",
+            allowed_mentions=mentions,
+        )
+        await wait_for_generation(
+            edit_message=functools.partial(message_editor.edit_original_response, interaction),
+            task_id=task_id,
+            image_generation_request=image_generation_request,
+            warning_message_list=warning_message_list,
+            user_mention=user_mention,
+            message_id=discord_data.message_id,
+            started_at=started_at,
+        )
+    finally:
+        await lease_coordinator.release(lease_key)
+
+
+async def wait_for_generation(
+    edit_message: EditFunction,
+    task_id: str,
+    image_generation_request: ImageGenerationParams,
+    warning_message_list: List[str],
+    user_mention: str,
+    message_id: str,
+    started_at: Optional[float] = None,
+) -> None:
+    loop_watchdog.tag(task_id=task_id)
+    bind_log_context(task_id=task_id)
+    mentions = discord.AllowedMentions(users=True)
+    model_endpoint = model_settings.endpoint
+    model_id = image_generation_request.model_id
+    message_embed = build_message(
+        title=f"Prompt: {image_generation_request.prompt}",
+        description=f"task_id: {task_id}\nmodel_id: {model_id}",
+        colour=discord.Colour.blue(),
+    )
+    is_success, res = await get_results(
+        url=f"{model_endpoint}/tasks/{task_id}/images",
+        n=300,
+        user=user_mention,
+        interaction=None,
+        message=message_embed,
+        task_id=task_id,
+        params=image_generation_request,
+        edit_message=edit_message,
+    )
+
+    if not is_success:
+        if res:
+            error_embed = build_error_message(
+                title=ErrorTitle.UNKNOWN,
+                description=ErrorMessage.UNKNOWN,
             )
-            is_success, res = await get_results(
-                url=f"{model_endpoint}/tasks/{task_id}/images",
-                n=300,
-                user=user_mention,
-                interaction=interaction,
-                message=message_embed,
+        else:
+            error_embed = build_error_message(
+                title=ErrorTitle.TIMEOUT,
+                description=f"Your task cannot be generated because there are too many tasks on the server.\nIf you want to get your results late, let the community manager know your task id {task_id}.",
             )
-            if is_success:
-                button_list = [
-                    Button(label=f"#{i + 1}", style=discord.ButtonStyle.gray, row=0)
-                    for i in range(image_generation_request.images)
-                ]
-                view = View(timeout=None)
-                result = res["result"]
-                for i in range(image_generation_request.images):
-                    if result[str(i + 1)]["is_filtered"]:
-                        button_list[i].callback = individual_image_button(
-                            result[str(i + 1)]["origin_url"],
-                            title=f"Prompt: {image_generation_request.prompt}",
-                            description=f"task_id: {task_id}\nmodel_id: {model_id}",
-                        )
-                    else:
-                        button_list[i].callback = individual_image_button(
-                            result[str(i + 1)]["url"],
-                            title=f"Prompt: {image_generation_request.prompt}",
-                            description=f"task_id: {task_id}\nmodel_id: {model_id}",
-                        )
-                    view.add_item(button_list[i])
-                re_gen_button = Button(label="🔄", style=discord.ButtonStyle.gray)
-                re_gen_button.callback = re_generate_button(image_generation_request)
-                view.add_item(re_gen_button)
-                twitter_url = get_twitter_url(task_id=task_id)
-                share_twitter_button = Button(
-                    label="Share on Twitter",
-                    style=discord.ButtonStyle.gray,
-                    url=twitter_url,
-                    row=1,
-                )
+        await edit_message(embed=error_embed)
+        return
+
+    await task_store.update_message_status(message_id, TX_PENDING_STATUS)
+    result = res["result"]
+    button_list: List[Item] = build_image_buttons(task_id, image_generation_request.images, row=0)
+    re_gen_button = Button(
+        label="🔄",
+        style=discord.ButtonStyle.gray,
+        custom_id=build_custom_id(ComponentAction.REGENERATE, task_id),
+        row=0,
+    )
+    button_list.append(re_gen_button)
+    twitter_url = get_twitter_url(task_id=task_id)
+    share_twitter_button = Button(label="Share on Twitter", style=discord.ButtonStyle.gray, url=twitter_url, row=1)
+    button_list.append(share_twitter_button)
+    view = build_static_view(button_list)
+
+    message_embed.set_image(url=result["grid"]["url"])
+    warning_message_list = list(warning_message_list)
+    if sum([each["is_filtered"] for each in result.values()]):
+        warning_message_list.append(WarningMessages.NSFW)
+    content_message = f"{user_mention} Your task is completed."
+    if len(warning_message_list) != 0:
+        warning_message_list.insert(0, f"model_id: {model_id}")
+        warning_message_list.insert(0, f"task_id: {task_id}")
+        message_embed.colour = discord.Colour.orange()
+        message_embed.description = "\n".join(warning_message_list)
+    else:
+        message_embed.colour = discord.Colour.green()
+    try:
+        await edit_message(
+            content=content_message,
+            embed=message_embed,
+            allowed_mentions=mentions,
+            view=view,
+        )
+    except (discord.NotFound, discord.Forbidden) as discord_error:
+        # every later resume would fail the same way, so the journal stops offering the task
+        logger.warning(f"Cannot show the result of {task_id}: {discord_error}")
+        await task_store.update_message_status(message_id, MESSAGE_LOST_STATUS)
+        return
+    if started_at is not None:
+        time_to_result_seconds.observe(
+            time.time() - started_at,
+            model_id=image_generation_request.model_id,
+            scheduler_type=image_generation_request.scheduler_type,
+        )
 
-                view.add_item(share_twitter_button)
-
-                message_embed.set_image(url=result["grid"]["url"])
-                warning_message_list = []
-                if sum([each["is_filtered"] for each in result.values()]):
-                    warning_message_list.append(WarningMessages.NSFW)
-                content_message = f"{user_mention} Your task is completed."
-                if len(warning_message_list) != 0:
-                    warning_message_list.insert(0, f"model_id: {model_id}")
-                    warning_message_list.insert(0, f"task_id: {task_id}")
-                    message_embed.colour = discord.Colour.orange()
-                    message_embed.description = "\n".join(warning_message_list)
-                    await interaction.edit_original_response(
-                        content=f"{user_mention} Your task is completed.",
-                        embed=message_embed,
-                        allowed_mentions=mentions,
-                        view=view,
-                    )
-                else:
-                    content_message = f"{user_mention} Your task is completed."
-                    message_embed.colour = discord.Colour.green()
-                    await interaction.edit_original_response(
+    async def show_tx_hash():
+        try:
+            tx_hash = await tx_reconciler.wait(task_id)
+            if tx_hash is not None:
+                insight_button = Button(
+                    label="View on Insight", style=discord.ButtonStyle.gray, url=get_tx_insight_url(tx_hash), row=1
+                )
+                try:
+                    await edit_message(
                         content=content_message,
                         embed=message_embed,
                         allowed_mentions=mentions,
-                        view=view,
-                    )
-                is_success, res = await get_tx_hash(url=f"{model_endpoint}/tasks/{task_id}/tx-hash", n=20)
-                if is_success:
-                    if res["status"] != ResponseStatusEnum.ERROR:
-                        status = res["status"]
-                        tx_hash = res["tx_hash"][status]
-                        tx_insight_url = get_tx_insight_url(tx_hash)
-                        insight_button = Button(
-                            label="View on Insight",
-                            style=discord.ButtonStyle.gray,
-                            url=tx_insight_url,
-                            row=1,
-                        )
-                        view.add_item(insight_button)
-
-                        await interaction.edit_original_response(
-                            content=content_message,
-                            embed=message_embed,
-                            allowed_mentions=mentions,
-                            view=view,
-                        )
-                return
-            else:
-                if res:
-                    error_embed = build_error_message(
-                        title=ErrorTitle.UNKNOWN,
-                        description=ErrorMessage.UNKNOWN,
+                        view=build_static_view(button_list + [insight_button]),
                     )
-                else:
-                    error_embed = build_error_message(
-                        title=ErrorTitle.TIMEOUT,
-                        description=f"Your task cannot be generated because there are too many tasks on the server.\nIf you want to get your results late, let the community manager know your task id {task_id}.",
-                    )
-                    await interaction.edit_original_response(embed=error_embed)
-                return
+                except Exception as unknown_error:
+                    logger.error(f"Failed To Show Tx Hash Of {task_id} : {unknown_error}")
+            await task_store.update_message_status(message_id, ResponseStatusEnum.COMPLETED)
+        finally:
+            await lease_coordinator.release(lease_key)
+
+    # the hash often shows up long after the images, the button is added whenever it does.
+    # the lookup keeps the task's lease, so a replica taking over a stopped one also resumes it
+    lease_key = task_key(task_id, message_id)
+    tx_task = asyncio.ensure_future(show_tx_hash())
+    if not await lease_coordinator.claim(lease_key, holder=tx_task):
+        tx_task.cancel()
+
+
+async def resume_generation(client: discord.Client, record: TaskRecord, takeover: bool = False) -> None:
+    lease_key = task_key(record.task_id, record.discord.message_id)
+    # another replica may be waiting for the task already
+    if not await lease_coordinator.claim(lease_key):
+        return
+    if takeover:
+        lease_takeovers_total.inc()
+    channel = client.get_partial_messageable(int(record.discord.channel_id))
+    message = channel.get_partial_message(int(record.discord.message_id))
+    try:
+        await wait_for_generation(
+            edit_message=functools.partial(message_editor.edit_message, message),
+            task_id=record.task_id,
+            image_generation_request=record.params,
+            warning_message_list=record.warnings,
+            user_mention=f"<@{record.discord.user_id}>",
+            message_id=record.discord.message_id,
+        )
+    except Exception as unknown_error:
+        logger.error(f"Failed To Resume Task {record.task_id} : {unknown_error}")
+    finally:
+        await lease_coordinator.release(lease_key)
+
+
+def is_own_guild(client: discord.AutoShardedClient, guild_id: str) -> bool:
+    if client.shard_ids is None or client.shard_count is None:
+        return True
+    # https://discord.com/developers/docs/topics/gateway#sharding-sharding-formula
+    return (int(guild_id) >> 22) % client.shard_count in client.shard_ids
+
+
+async def resume_generations(client: discord.AutoShardedClient, takeover: bool = False) -> None:
+    await task_store.prune(task_store_settings.task_store_retention)
+    # every worker shares the journal, so each one resumes only the guilds of its own shards
+    records = [
+        record
+        for record in await task_store.unfinished()
+        if is_own_guild(client, record.discord.guild_id)
+        and not lease_coordinator.holds(task_key(record.task_id, record.discord.message_id))
+    ]
+    if records:
+        logger.info(f"Resume {len(records)} unfinished tasks")
+        # the shared poller batches the lookups of every resumed task, a lost lease cancels only its own wait
+        await asyncio.gather(
+            *[resume_generation(client, record, takeover) for record in records], return_exceptions=True
+        )
 
-    return call_back
+
+async def handle_regenerate_button(interaction: discord.Interaction, task_id: str) -> None:
+    image_generation_request = await get_generation_params(task_id)
+    if image_generation_request is None:
+        await interaction.response.send_message(embed=build_task_not_found_message(task_id), ephemeral=True)
+        return
+    seed = random.randint(0, 4294967295)
+    # Is it possible?
+    while image_generation_request.seed == seed:
+        seed = random.randint(0, 4294967295)
+    await generate_image(interaction, image_generation_request.copy(update={"seed": seed}), [])
 
 
 def get_twitter_url(task_id: str) -> str:
@@ -417,3 +789,8 @@ def get_tx_insight_url(tx_hash: str) -> str:
         prefix = ""
     tx_insight_url = f"https://{prefix}insight.ainetwork.ai/transactions/{tx_hash}"
     return tx_insight_url
+
+
+component_dispatcher.register(ComponentAction.IMAGE, handle_image_button)
+component_dispatcher.register(ComponentAction.UPSCALE, handle_upscale_button)
+component_dispatcher.register(ComponentAction.REGENERATE, handle_regenerate_button)
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import itertools
+import sys
+import threading
+import time
+import traceback
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from logs import get_logger
+from metrics import loop_lag_seconds, loop_stalls_total
+from settings import watchdog_settings
+
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class StallSample:
+    started_at: float
+    stack: List[str]
+    tags: Dict[str, str] = field(default_factory=dict)
+    lag: float = 0.0
+
+    def format(self, stack_depth: Optional[int] = None) -> str:
+        tags = ", ".join(f"{name}={value}" for name, value in self.tags.items()) or "untagged"
+        stack = self.stack if stack_depth is None else self.stack[-stack_depth:]
+        started_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at))
+        return f"{self.lag:.3f}s at {started_at} ({tags})\n" + "".join(stack)
+
+
+class LoopWatchdog:
+    def __init__(
+        self, interval: float, threshold: float, max_samples: int, stack_depth: int, log_stalls: bool
+    ) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.max_samples = max_samples
+        self.stack_depth = stack_depth
+        self.log_stalls = log_stalls
+        self._tags: "weakref.WeakKeyDictionary[asyncio.Task, Dict[str, str]]" = weakref.WeakKeyDictionary()
+        # min heap of the worst stalls, the counter breaks ties between equal lags
+        self._worst: List[Tuple[float, int, StallSample]] = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._stall: Optional[StallSample] = None
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def tag(self, **tags: object) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self._tags.setdefault(task, {}).update({name: str(value) for name, value in tags.items()})
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog reports stalls longer than {self.threshold}s")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            loop_lag_seconds.observe(lag)
+            self._beat = time.monotonic()
+            with self._lock:
+                stall, self._stall = self._stall, None
+            if stall is not None:
+                stall.lag = lag
+                self._record(stall)
+
+    def _watch(self) -> None:
+        # runs in its own thread, so it sees the loop while the loop is blocked
+        while not self._stopped.wait(self.interval / 2):
+            if time.monotonic() - self._beat - self.interval < self.threshold or self._stall is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            # current_task only reads a dict, which is safe enough from another thread
+            task = asyncio.current_task(self._loop)
+            stall = StallSample(
+                started_at=time.time(),
+                stack=traceback.format_stack(frame)[-self.stack_depth :],
+                tags=dict(self._tags.get(task, {})) if task is not None else {},
+            )
+            if task is not None:
+                stall.tags.setdefault("coroutine", task.get_coro().__qualname__)
+            with self._lock:
+                self._stall = stall
+
+    def _record(self, stall: StallSample) -> None:
+        loop_stalls_total.inc(command=stall.tags.get("command", ""))
+        item = (stall.lag, next(self._counter), stall)
+        if len(self._worst) < self.max_samples:
+            heapq.heappush(self._worst, item)
+        else:
+            heapq.heappushpop(self._worst, item)
+        if self.log_stalls:
+            logger.warning(f"Event loop was blocked for {stall.format()}")
+
+    def worst(self, count: Optional[int] = None) -> List[StallSample]:
+        samples = [stall for _, _, stall in sorted(self._worst, reverse=True)]
+        return samples if count is None else samples[:count]
+
+    def clear(self) -> None:
+        self._worst.clear()
+
+
+loop_watchdog = LoopWatchdog(
+    interval=watchdog_settings.watchdog_interval,
+    threshold=watchdog_settings.watchdog_threshold,
+    max_samples=watchdog_settings.watchdog_max_samples,
+    stack_depth=watchdog_settings.watchdog_stack_depth,
+    log_stalls=watchdog_settings.watchdog_log_stalls,
+)
@@ -0,0 +1,71 @@
+from typing import Optional
+
+from aiohttp import web
+
+from logs import get_logger
+from poller import TaskPoller, task_poller
+from server import EmbeddedServer
+from settings import model_settings, webhook_settings
+from tx_reconciler import TxReconciler, tx_reconciler
+
+
+logger = get_logger(__name__)
+
+
+class WebhookReceiver:
+    def __init__(
+        self,
+        poller: TaskPoller,
+        reconciler: TxReconciler,
+        public_url: Optional[str],
+        token: str,
+        fallback_interval: float,
+    ) -> None:
+        self.poller = poller
+        self.reconciler = reconciler
+        self.public_url = public_url
+        self.token = token
+        self.fallback_interval = fallback_interval
+        self.callback_url: Optional[str] = None
+
+    def register(self, server: EmbeddedServer) -> None:
+        if self.public_url is None:
+            logger.error("WEBHOOK_PUBLIC_URL is not set, task completion stays poll based")
+            return
+        server.add_route("POST", "/callbacks/{token}/tasks/{task_id}/{kind:images|tx-hash}", self.handle_callback)
+        # the model server appends /tasks/{task_id}/images or /tasks/{task_id}/tx-hash to this url
+        self.callback_url = f"{str(self.public_url).rstrip('/')}/callbacks/{self.token}"
+        self.poller.push_fallback_interval = self.fallback_interval
+        logger.info("Webhook receiver is enabled")
+
+    async def handle_callback(self, request: web.Request) -> web.Response:
+        if request.match_info["token"] != self.token:
+            return web.json_response({"detail": "Not Found"}, status=404)
+        task_id = request.match_info["task_id"]
+        kind = request.match_info["kind"]
+        try:
+            res = await request.json()
+        except ValueError:
+            return web.json_response({"detail": "Invalid JSON"}, status=400)
+        if not isinstance(res, dict) or "status" not in res:
+            return web.json_response({"detail": "status is required"}, status=400)
+        if kind == "tx-hash":
+            # transaction hashes are looked for in the background after the images are shown
+            is_waiting = self.reconciler.push(task_id, res)
+            logger.info(f"Callback {kind} {task_id} : {res['status']}")
+            return web.json_response({"task_id": task_id, "waiting": is_waiting})
+        try:
+            is_waiting = self.poller.push(f"{model_settings.endpoint}/tasks/{task_id}/{kind}", res)
+        except KeyError as key_error:
+            return web.json_response({"detail": f"{key_error} is required"}, status=400)
+        logger.info(f"Callback {kind} {task_id} : {res['status']}")
+        return web.json_response({"task_id": task_id, "waiting": is_waiting})
+
+
+webhook_receiver = WebhookReceiver(
+    poller=task_poller,
+    reconciler=tx_reconciler,
+    public_url=webhook_settings.webhook_public_url,
+    token=webhook_settings.webhook_token,
+    fallback_interval=webhook_settings.webhook_fallback_interval,
+)
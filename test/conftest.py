@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+
+# the bot's modules are flat in src and read their settings on import
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ.setdefault("GUILD_ID", "1")
+os.environ.setdefault("ENDPOINT", "http://127.0.0.1:9")
+os.environ.setdefault("UPSCALE_ENDPOINT", "http://127.0.0.1:9")
+_state_dir = tempfile.mkdtemp(prefix="tti-test-")
+os.environ.setdefault("TASK_STORE_PATH", os.path.join(_state_dir, "tasks.db"))
+os.environ.setdefault("LEASE_PATH", os.path.join(_state_dir, "leases.db"))
+os.environ.setdefault("COMMAND_SYNC_STATE_PATH", os.path.join(_state_dir, "command_tree.fingerprint"))
+os.environ.pop("RECORD_PATH", None)
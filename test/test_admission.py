@@ -0,0 +1,31 @@
+import unittest
+
+from admission import AdmissionController
+
+
+class AdmissionCheckTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.controller = AdmissionController(
+            user_rate=1,
+            user_burst=3,
+            guild_rate=1000,
+            guild_burst=1000,
+            global_rate=1000,
+            global_burst=1000,
+            max_in_flight=10,
+            max_in_flight_cost=1000,
+            max_queue=10,
+            max_buckets=100,
+        )
+
+    def test_single_requests_spend_the_burst(self):
+        for _ in range(3):
+            self.assertEqual(self.controller.check("user", "guild"), 0)
+        self.assertAlmostEqual(self.controller.check("user", "guild"), 1, places=1)
+
+    def test_batch_larger_than_the_burst_leaves_the_bucket_in_debt(self):
+        self.assertEqual(self.controller.check("user", "guild", amount=12), 0)
+        # twelve tasks cost twelve tokens, as many as twelve single requests would
+        self.assertAlmostEqual(self.controller.check("user", "guild"), 10, places=1)
+        self.assertEqual(self.controller.check("other user", "guild", amount=12), 0)
+        self.assertEqual(self.controller.rate_limited, 1)
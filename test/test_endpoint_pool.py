@@ -0,0 +1,132 @@
+import asyncio
+import json
+import socket
+import time
+import unittest
+
+from aiohttp import web
+
+from endpoint_pool import EndpointPool
+from enums import CircuitState
+from http_client import http_client
+
+
+HOST = "127.0.0.1"
+PATH = "/tasks/task-1/images"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class StubReplica:
+    def __init__(self) -> None:
+        self.status = 200
+        self.body = json.dumps({"task_id": "task-1", "status": "completed", "result": {}})
+        self.delay = 0.0
+        self.hits = 0
+        self.port = free_port()
+        self.url = f"http://{HOST}:{self.port}"
+        self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.hits += 1
+        await asyncio.sleep(self.delay)
+        return web.Response(status=self.status, text=self.body)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, HOST, self.port).start()
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+
+
+class EndpointPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.first, self.second = StubReplica(), StubReplica()
+        await self.first.start()
+        await self.second.start()
+        self.pool = EndpointPool(
+            name="model",
+            urls=[self.first.url, self.second.url],
+            failure_threshold=1,
+            reset_timeout=0.2,
+            latency_smoothing=0.2,
+            affinity_size=10,
+        )
+        self.first_replica, self.second_replica = self.pool.replicas
+
+    async def asyncTearDown(self) -> None:
+        await http_client.close()
+        await self.first.close()
+        await self.second.close()
+
+    def open_first(self) -> None:
+        self.first_replica.state = CircuitState.OPEN
+        self.first_replica.opened_at = time.monotonic() - self.pool.reset_timeout
+
+    async def test_circuit_trips_and_a_probe_closes_or_reopens_it(self):
+        self.first.status = 503
+        self.assertTrue((await self.pool.request("GET", "/health"))[0])
+        self.assertEqual(self.first_replica.state, CircuitState.OPEN)
+        self.assertEqual(self.pool.candidates(None), [self.second_replica])
+
+        await asyncio.sleep(self.pool.reset_timeout)
+        self.assertEqual(self.pool.candidates(None)[0], self.first_replica)
+        self.assertTrue((await self.pool.request("GET", "/health"))[0])
+        self.assertEqual(self.second.hits, 2)
+        self.assertEqual(self.first_replica.state, CircuitState.OPEN)
+
+        await asyncio.sleep(self.pool.reset_timeout)
+        self.first.status = 200
+        self.assertTrue((await self.pool.request("GET", "/health"))[0])
+        self.assertEqual(self.first_replica.state, CircuitState.CLOSED)
+        self.assertEqual(self.second.hits, 2)
+
+    async def test_cancelled_probe_reopens_the_circuit(self):
+        self.open_first()
+        self.first.delay = 1
+        request = asyncio.ensure_future(self.pool.request("GET", "/health"))
+        while self.first.hits == 0:
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.first_replica.state, CircuitState.HALF_OPEN)
+        request.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await request
+        self.assertEqual(self.first_replica.state, CircuitState.OPEN)
+        self.assertEqual(self.first_replica.outstanding, 0)
+        self.assertNotIn(self.first_replica, self.pool.candidates(None))
+        await asyncio.sleep(self.pool.reset_timeout)
+        self.assertIn(self.first_replica, self.pool.candidates(None))
+
+    async def test_crashed_probe_reopens_the_circuit(self):
+        self.open_first()
+        self.first.body = "not json"
+        with self.assertRaises(ValueError):
+            await self.pool.request("GET", "/health")
+        self.assertEqual(self.first_replica.state, CircuitState.OPEN)
+
+    async def test_lookups_stay_on_the_owner(self):
+        self.assertTrue((await self.pool.request("POST", "/generate"))[0])
+        self.assertEqual(self.first.hits, 1)
+        self.first.status = 404
+        self.assertFalse((await self.pool.request("GET", PATH))[0])
+        self.assertEqual(self.second.hits, 0)
+        # only an open circuit moves the lookup to a replica that may not know the task
+        self.first.status = 503
+        self.assertFalse((await self.pool.request("GET", PATH))[0])
+        self.assertEqual(self.first_replica.state, CircuitState.OPEN)
+        self.assertTrue((await self.pool.request("GET", PATH))[0])
+        self.assertEqual(self.second.hits, 1)
+
+    async def test_lookup_of_an_unknown_task_tries_every_replica(self):
+        self.first.status = 404
+        self.assertTrue((await self.pool.request("GET", PATH))[0])
+        self.assertEqual((self.first.hits, self.second.hits), (1, 1))
+        self.assertEqual(self.pool.candidates("task-1"), [self.second_replica])
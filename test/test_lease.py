@@ -0,0 +1,155 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from enums import LeaseBackend
+from lease import LeaseCoordinator, LeaseStore, MemoryLeaseStore, SQLiteLeaseStore, build_lease_store, task_key
+
+
+KEY = task_key("task-1", "1")
+
+
+class LeaseStoreTests:
+    def build_store(self) -> LeaseStore:
+        raise NotImplementedError
+
+    async def asyncSetUp(self) -> None:
+        self.store = self.build_store()
+
+    async def asyncTearDown(self) -> None:
+        self.store.close()
+
+    async def test_lease_is_exclusive_until_it_expires(self):
+        self.assertTrue(await self.store.acquire(KEY, "a", ttl=0.1))
+        self.assertFalse(await self.store.acquire(KEY, "b", ttl=0.1))
+        # re-acquiring extends the lease of its owner
+        self.assertTrue(await self.store.acquire(KEY, "a", ttl=0.1))
+        await asyncio.sleep(0.15)
+        self.assertTrue(await self.store.acquire(KEY, "b", ttl=0.1))
+        self.assertFalse(await self.store.acquire(KEY, "a", ttl=0.1))
+
+    async def test_renew_returns_the_keys_still_owned(self):
+        other_key = task_key("task-2", "2")
+        await self.store.acquire(KEY, "a", ttl=0.1)
+        await self.store.acquire(other_key, "b", ttl=0.1)
+        self.assertEqual(await self.store.renew([KEY, other_key], "a", ttl=0.1), [KEY])
+
+    async def test_release_and_prune(self):
+        await self.store.acquire(KEY, "a", ttl=60)
+        await self.store.release([KEY], "b")
+        self.assertFalse(await self.store.acquire(KEY, "b", ttl=60))
+        await self.store.release([KEY], "a")
+        self.assertTrue(await self.store.acquire(KEY, "b", ttl=0.05))
+        await asyncio.sleep(0.1)
+        self.assertEqual(await self.store.prune(), 1)
+        self.assertEqual(await self.store.prune(), 0)
+
+
+class MemoryLeaseStoreTest(LeaseStoreTests, unittest.IsolatedAsyncioTestCase):
+    def build_store(self) -> LeaseStore:
+        return MemoryLeaseStore()
+
+
+class SQLiteLeaseStoreTest(LeaseStoreTests, unittest.IsolatedAsyncioTestCase):
+    def build_store(self) -> LeaseStore:
+        return SQLiteLeaseStore(db_path=os.path.join(tempfile.mkdtemp(prefix="tti-lease-"), "leases.db"))
+
+
+class BuildLeaseStoreTest(unittest.TestCase):
+    def test_memory_backend_is_rejected_for_replicas(self):
+        with self.assertRaises(ValueError):
+            build_lease_store(LeaseBackend.MEMORY, None, enabled=True)
+        self.assertIsInstance(build_lease_store(LeaseBackend.MEMORY, None, enabled=False), MemoryLeaseStore)
+
+    def test_lease_store_is_abstract(self):
+        with self.assertRaises(TypeError):
+            LeaseStore()
+
+
+class LeaseCoordinatorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.store = MemoryLeaseStore()
+        self.replicas = [self.build_coordinator("a"), self.build_coordinator("b")]
+
+    async def asyncTearDown(self) -> None:
+        for coordinator in self.replicas:
+            await coordinator.close()
+
+    def build_coordinator(self, owner: str) -> LeaseCoordinator:
+        return LeaseCoordinator(
+            store=self.store,
+            owner=owner,
+            enabled=True,
+            ttl=0.2,
+            heartbeat_interval=0.05,
+            takeover_interval=60,
+            interaction_ttl=60,
+        )
+
+    async def test_claims_are_shared_until_the_last_release(self):
+        a, b = self.replicas
+        self.assertTrue(await a.claim(KEY))
+        self.assertTrue(await a.claim(KEY))
+        self.assertFalse(await b.claim(KEY))
+        await a.release(KEY)
+        self.assertTrue(a.holds(KEY))
+        self.assertFalse(await b.claim(KEY))
+        await a.release(KEY)
+        self.assertFalse(a.holds(KEY))
+        self.assertTrue(await b.claim(KEY))
+
+    async def test_heartbeat_keeps_the_lease(self):
+        a, b = self.replicas
+        a.start(lambda: asyncio.sleep(0))
+        self.assertTrue(await a.claim(KEY))
+        await asyncio.sleep(0.4)
+        self.assertFalse(await b.claim(KEY))
+        self.assertEqual(a.lost, 0)
+
+    async def test_stopped_replica_is_taken_over(self):
+        a, b = self.replicas
+        # without a heartbeat the lease of a expires like the one of a replica that stopped
+        self.assertTrue(await a.claim(KEY))
+        await asyncio.sleep(0.25)
+        self.assertTrue(await b.claim(KEY))
+
+    async def test_lost_lease_cancels_its_holder(self):
+        a, b = self.replicas
+        holder = asyncio.ensure_future(asyncio.sleep(10))
+        self.assertTrue(await a.claim(KEY, holder=holder))
+        a.start(lambda: asyncio.sleep(0))
+        # a stalled past the ttl while b took the task over
+        self.store._leases[KEY] = ("a", time.time() - 1)
+        self.assertTrue(await b.claim(KEY))
+        with self.assertRaises(asyncio.CancelledError):
+            await asyncio.wait_for(holder, 1)
+        self.assertFalse(a.holds(KEY))
+        self.assertEqual(a.lost, 1)
+        self.assertTrue(b.holds(KEY))
+
+    async def test_claim_defaults_to_the_current_task(self):
+        a, b = self.replicas
+
+        async def hold():
+            await a.claim(KEY)
+            await asyncio.sleep(10)
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        a._lose(KEY)
+        with self.assertRaises(asyncio.CancelledError):
+            await holder
+
+    async def test_close_hands_the_leases_over(self):
+        a, b = self.replicas
+        self.assertTrue(await a.claim(KEY))
+        await a.close()
+        self.assertTrue(await b.claim(KEY))
+
+    async def test_interactions_are_answered_once(self):
+        a, b = self.replicas
+        self.assertTrue(await a.claim_interaction(1))
+        self.assertFalse(await b.claim_interaction(1))
+        self.assertTrue(await b.claim_interaction(2))
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+from enums import ResponseStatusEnum
+from schemas import ImageGenerationDiscordParams, ImageGenerationParams
+from task_store import MESSAGE_LOST_STATUS, TX_PENDING_STATUS, TaskStore
+
+
+def discord_data(message_id: str) -> ImageGenerationDiscordParams:
+    return ImageGenerationDiscordParams(user_id="1", guild_id="1", channel_id="1", message_id=message_id)
+
+
+class TaskStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.store = TaskStore(db_path=os.path.join(tempfile.mkdtemp(prefix="tti-tasks-"), "tasks.db"))
+        params = ImageGenerationParams(prompt="a cat")
+        await self.store.add("task-1", discord_data("1"), params, [])
+        await self.store.add("task-1", discord_data("2"), params, [])
+
+    async def asyncTearDown(self) -> None:
+        self.store.close()
+
+    async def unfinished(self):
+        return {record.discord.message_id: record.status for record in await self.store.unfinished()}
+
+    async def test_message_updates_only_touch_their_own_row(self):
+        await self.store.update_message_status("1", TX_PENDING_STATUS)
+        # the task id update of the other message leaves the tx pending row alone
+        await self.store.update_status("task-1", ResponseStatusEnum.ASSIGNED)
+        self.assertEqual(await self.unfinished(), {"1": TX_PENDING_STATUS, "2": ResponseStatusEnum.ASSIGNED})
+        await self.store.update_message_status("1", ResponseStatusEnum.COMPLETED)
+        self.assertEqual(await self.unfinished(), {"2": ResponseStatusEnum.ASSIGNED})
+
+    async def test_lost_message_is_not_resumed_again(self):
+        await self.store.update_message_status("1", MESSAGE_LOST_STATUS)
+        await self.store.update_status("task-1", ResponseStatusEnum.PENDING)
+        self.assertEqual(await self.unfinished(), {"2": ResponseStatusEnum.PENDING})
+        await self.store.prune(retention=0)
+        self.assertEqual(await self.store.run(self._count), 1)
+
+    def _count(self) -> int:
+        return self.store.connection().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
@@ -0,0 +1,136 @@
+import asyncio
+import socket
+import unittest
+
+import aiohttp
+
+from benchmark.stub_server import StubModelServer, parse_distribution
+from estimator import CompletionEstimator, PollSchedule
+from poller import TaskPoller
+from server import EmbeddedServer
+from settings import model_settings
+from tx_reconciler import TxReconciler
+from utils import check_task_result
+from webhook import WebhookReceiver
+
+
+HOST = "127.0.0.1"
+TOKEN = "secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.poller = TaskPoller(
+            schedule=PollSchedule(
+                min_interval=0.5, max_interval=5.0, cold_max_interval=1.5, backoff_factor=1.5, jitter=0
+            ),
+            estimator=CompletionEstimator(seconds_per_unit=0.05, overhead=2.0, smoothing=0.2, history_size=10),
+            concurrency=4,
+        )
+        self.reconciler = TxReconciler(horizon=60, min_interval=30, max_interval=60, backoff_factor=1.5, batch_size=10)
+        port = free_port()
+        self.receiver = WebhookReceiver(
+            poller=self.poller,
+            reconciler=self.reconciler,
+            public_url=f"http://{HOST}:{port}",
+            token=TOKEN,
+            # polls would go to a closed port, every result here has to be pushed
+            fallback_interval=60,
+        )
+        self.server = EmbeddedServer(HOST, port)
+        self.receiver.register(self.server)
+        await self.server.start()
+        self.session = aiohttp.ClientSession()
+
+    async def asyncTearDown(self) -> None:
+        await self.session.close()
+        await self.server.close()
+        await self.poller.close()
+        await self.reconciler.close()
+
+    async def post(self, path: str, **kwargs) -> aiohttp.ClientResponse:
+        async with self.session.post(f"{self.receiver.callback_url}{path}", **kwargs) as res:
+            await res.read()
+            return res
+
+    def wait(self, task_id: str, **kwargs):
+        return self.poller.wait(
+            f"{model_settings.endpoint}/tasks/{task_id}/images",
+            timeout=10,
+            check=check_task_result,
+            task_id=task_id,
+            push=True,
+            **kwargs,
+        )
+
+    async def test_pushed_completion_ends_the_wait(self):
+        statuses = []
+
+        async def on_status_change(prev_status: str, status: str):
+            statuses.append(status)
+
+        waiting = asyncio.ensure_future(self.wait("task-1", on_status_change=on_status_change))
+        await asyncio.sleep(0.05)
+        res = await self.post("/tasks/task-1/images", json={"status": "assigned", "result": {}})
+        self.assertEqual(res.status, 200)
+        completed = {"status": "completed", "result": {"grid": {"url": "https://stub.invalid/grid.png"}}}
+        await self.post("/tasks/task-1/images", json=completed)
+        self.assertEqual(await asyncio.wait_for(waiting, 1), (True, completed))
+        self.assertEqual(statuses, ["assigned"])
+        self.assertEqual(len(self.poller), 0)
+
+    async def test_early_notification_is_kept_for_the_wait(self):
+        completed = {"status": "completed", "result": {}}
+        async with self.session.post(f"{self.receiver.callback_url}/tasks/task-2/images", json=completed) as res:
+            self.assertEqual(await res.json(), {"task_id": "task-2", "waiting": False})
+        self.assertEqual(await asyncio.wait_for(self.wait("task-2"), 1), (True, completed))
+
+    async def test_pushed_tx_hash_reaches_the_reconciler(self):
+        waiting = asyncio.ensure_future(self.reconciler.wait("task-3"))
+        await asyncio.sleep(0.05)
+        await self.post("/tasks/task-3/tx-hash", json={"status": "completed", "tx_hash": {"completed": "0xabc"}})
+        self.assertEqual(await asyncio.wait_for(waiting, 1), "0xabc")
+        self.assertEqual(len(self.reconciler), 0)
+
+    async def test_bad_payloads_are_rejected(self):
+        url = f"http://{HOST}:{self.server.port}/callbacks"
+        async with self.session.post(f"{url}/wrong/tasks/task-4/images", json={"status": "completed"}) as res:
+            self.assertEqual(res.status, 404)
+        async with self.session.post(f"{url}/{TOKEN}/tasks/task-4/params", json={"status": "completed"}) as res:
+            self.assertEqual(res.status, 404)
+        self.assertEqual((await self.post("/tasks/task-4/images", data="{not json")).status, 400)
+        self.assertEqual((await self.post("/tasks/task-4/images", json=["completed"])).status, 400)
+        self.assertEqual((await self.post("/tasks/task-4/images", json={"result": {}})).status, 400)
+        # nothing was parked for a later wait
+        self.assertEqual(len(self.poller._early_results), 0)
+
+    async def test_stub_server_pushes_status_changes(self):
+        stub = StubModelServer(
+            latency=parse_distribution("fixed:0"),
+            queue_time=parse_distribution("fixed:0.1"),
+            run_time=parse_distribution("fixed:0.2"),
+            tx_time=parse_distribution("fixed:0.1"),
+            upscale_time=parse_distribution("fixed:0"),
+            seed=1,
+        )
+        stub_port = free_port()
+        await stub.start(HOST, stub_port)
+        try:
+            async with self.session.post(
+                f"http://{HOST}:{stub_port}/generate",
+                json={"params": {"images": 2}, "callback_url": self.receiver.callback_url},
+            ) as res:
+                task_id = (await res.json())["task_id"]
+            is_success, res = await asyncio.wait_for(self.wait(task_id), 2)
+            self.assertTrue(is_success)
+            self.assertEqual(set(res["result"]), {"1", "2", "grid"})
+            self.assertEqual(stub.counts["GET /tasks/{task_id}/images"], 0)
+            self.assertEqual(stub.counts["callback images"], 2)
+        finally:
+            await stub.close()